@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS "public"."ubkg_cache" (
+    "cache_key" text NOT NULL,
+    "status_code" integer NOT NULL,
+    "body" jsonb,
+    "expires_at" double precision NOT NULL,
+    PRIMARY KEY ("cache_key")
+);
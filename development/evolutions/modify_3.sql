@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS "public"."jobs" (
+    "job_id" uuid NOT NULL,
+    "kind" text NOT NULL,
+    "status" text NOT NULL,
+    "phase" text,
+    "progress" jsonb NOT NULL DEFAULT '{}',
+    "errors" jsonb NOT NULL DEFAULT '[]',
+    "result" jsonb,
+    "cancel_requested" boolean NOT NULL DEFAULT false,
+    "created_timestamp" double precision NOT NULL,
+    "started_timestamp" double precision,
+    "finished_timestamp" double precision,
+    PRIMARY KEY ("job_id")
+);
+
+CREATE INDEX IF NOT EXISTS jobs_kind_status_index ON jobs(kind, status);
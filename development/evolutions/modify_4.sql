@@ -0,0 +1,30 @@
+CREATE INDEX IF NOT EXISTS antibodies_created_timestamp_index ON antibodies(created_timestamp);
+
+CREATE TABLE IF NOT EXISTS "public"."catalog_version" (
+    "id" integer NOT NULL DEFAULT 1 CHECK ("id" = 1),
+    "write_count" bigint NOT NULL DEFAULT 0,
+    "modified_timestamp" double precision NOT NULL DEFAULT EXTRACT(epoch FROM NOW()),
+    PRIMARY KEY ("id")
+);
+
+INSERT INTO catalog_version (id) VALUES (1) ON CONFLICT DO NOTHING;
+
+-- Counts the transactions that change the catalog, once each, as they commit. The trigger is deferred so
+-- that the catalog_version row is only locked while committing, and the count is only seen with the data.
+CREATE OR REPLACE FUNCTION count_catalog_write() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('catalog_version.counted_xid', true) IS DISTINCT FROM txid_current()::text THEN
+        PERFORM set_config('catalog_version.counted_xid', txid_current()::text, true);
+        UPDATE catalog_version SET write_count = write_count + 1, modified_timestamp = EXTRACT(epoch FROM NOW());
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS antibodies_catalog_write ON antibodies;
+CREATE CONSTRAINT TRIGGER antibodies_catalog_write AFTER INSERT OR UPDATE OR DELETE ON antibodies
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION count_catalog_write();
+
+DROP TRIGGER IF EXISTS vendors_catalog_write ON vendors;
+CREATE CONSTRAINT TRIGGER vendors_catalog_write AFTER INSERT OR UPDATE OR DELETE ON vendors
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION count_catalog_write();
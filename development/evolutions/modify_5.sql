@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS "public"."identifier_validation_cache" (
+    "kind" text NOT NULL,
+    "value" text NOT NULL,
+    "status" text NOT NULL,
+    "expires_at" double precision NOT NULL,
+    PRIMARY KEY ("kind", "value")
+);
+
+CREATE INDEX IF NOT EXISTS identifier_validation_cache_expires_at_index ON identifier_validation_cache(expires_at);
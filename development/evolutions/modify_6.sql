@@ -0,0 +1,10 @@
+-- HuBMAP ids minted by the uuid-api that have not been used yet. An import takes its ids from here in its own
+-- transaction, so that the ids of an import that rolls back are left for the next one (see utils/hubmap_ids).
+CREATE TABLE IF NOT EXISTS "public"."hubmap_id_reserve" (
+    "id" serial,
+    "uuid" uuid NOT NULL,
+    "hubmap_id" text NOT NULL,
+    "reserved_timestamp" double precision NOT NULL DEFAULT EXTRACT(epoch FROM NOW()),
+    PRIMARY KEY ("id"),
+    UNIQUE ("uuid")
+);
@@ -0,0 +1,3 @@
+-- The process running a job renews its heartbeat, so that jobs left active by a process that is gone can be
+-- told apart from live ones and marked failed (see utils/jobs).
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS "heartbeat_timestamp" double precision;
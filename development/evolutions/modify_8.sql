@@ -0,0 +1,2 @@
+-- The user who started a job, so that only they (or a data admin) can see its status (see import_antibodies).
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS "created_by_user_sub" text;
@@ -68,3 +68,82 @@ CREATE TABLE IF NOT EXISTS "public"."antibodies" (
 );
 
 CREATE UNIQUE INDEX IF NOT EXISTS antibody_uuid_index ON antibodies(antibody_uuid);
+
+CREATE TABLE IF NOT EXISTS "public"."ubkg_cache" (
+    "cache_key" text NOT NULL,
+    "status_code" integer NOT NULL,
+    "body" jsonb,
+    "expires_at" double precision NOT NULL,
+    PRIMARY KEY ("cache_key")
+);
+
+CREATE TABLE IF NOT EXISTS "public"."jobs" (
+    "job_id" uuid NOT NULL,
+    "kind" text NOT NULL,
+    "status" text NOT NULL,
+    "phase" text,
+    "progress" jsonb NOT NULL DEFAULT '{}',
+    "errors" jsonb NOT NULL DEFAULT '[]',
+    "result" jsonb,
+    "cancel_requested" boolean NOT NULL DEFAULT false,
+    "created_timestamp" double precision NOT NULL,
+    "started_timestamp" double precision,
+    "finished_timestamp" double precision,
+    "heartbeat_timestamp" double precision,
+    "created_by_user_sub" text,
+    PRIMARY KEY ("job_id")
+);
+
+CREATE INDEX IF NOT EXISTS jobs_kind_status_index ON jobs(kind, status);
+
+CREATE INDEX IF NOT EXISTS antibodies_created_timestamp_index ON antibodies(created_timestamp);
+
+CREATE TABLE IF NOT EXISTS "public"."catalog_version" (
+    "id" integer NOT NULL DEFAULT 1 CHECK ("id" = 1),
+    "write_count" bigint NOT NULL DEFAULT 0,
+    "modified_timestamp" double precision NOT NULL DEFAULT EXTRACT(epoch FROM NOW()),
+    PRIMARY KEY ("id")
+);
+
+INSERT INTO catalog_version (id) VALUES (1) ON CONFLICT DO NOTHING;
+
+-- Counts the transactions that change the catalog, once each, as they commit. The trigger is deferred so
+-- that the catalog_version row is only locked while committing, and the count is only seen with the data.
+CREATE OR REPLACE FUNCTION count_catalog_write() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('catalog_version.counted_xid', true) IS DISTINCT FROM txid_current()::text THEN
+        PERFORM set_config('catalog_version.counted_xid', txid_current()::text, true);
+        UPDATE catalog_version SET write_count = write_count + 1, modified_timestamp = EXTRACT(epoch FROM NOW());
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS antibodies_catalog_write ON antibodies;
+CREATE CONSTRAINT TRIGGER antibodies_catalog_write AFTER INSERT OR UPDATE OR DELETE ON antibodies
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION count_catalog_write();
+
+DROP TRIGGER IF EXISTS vendors_catalog_write ON vendors;
+CREATE CONSTRAINT TRIGGER vendors_catalog_write AFTER INSERT OR UPDATE OR DELETE ON vendors
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION count_catalog_write();
+
+CREATE TABLE IF NOT EXISTS "public"."identifier_validation_cache" (
+    "kind" text NOT NULL,
+    "value" text NOT NULL,
+    "status" text NOT NULL,
+    "expires_at" double precision NOT NULL,
+    PRIMARY KEY ("kind", "value")
+);
+
+CREATE INDEX IF NOT EXISTS identifier_validation_cache_expires_at_index ON identifier_validation_cache(expires_at);
+
+-- HuBMAP ids minted by the uuid-api that have not been used yet. An import takes its ids from here in its own
+-- transaction, so that the ids of an import that rolls back are left for the next one (see utils/hubmap_ids).
+CREATE TABLE IF NOT EXISTS "public"."hubmap_id_reserve" (
+    "id" serial,
+    "uuid" uuid NOT NULL,
+    "hubmap_id" text NOT NULL,
+    "reserved_timestamp" double precision NOT NULL DEFAULT EXTRACT(epoch FROM NOW()),
+    PRIMARY KEY ("id"),
+    UNIQUE ("uuid")
+);
@@ -150,7 +150,7 @@ class MyParser(argparse.ArgumentParser):
 
 parser = MyParser(
     description='''
-    This is a script to change entries in the database using the 'csv_file' provided, and then restore ElasticSearch.
+    This is a script to change entries in the database using the 'csv_file' provided, and then re-index them in ElasticSearch.
     
     For the 'token' parameter, login through the UI to get the credentials for the environment that you are using.
     https://ingest.dev.hubmapconsortium.org/ (DEV)
@@ -208,8 +208,11 @@ for line in csv_file_lines[1:]:
     line_no += 1
 logger.info(f"Checks on scv file '{args.csv_file}' passed.")
 
+antibody_hubmap_id_index: int = csv_file_header.index('antibody_hubmap_id')
+antibody_hubmap_ids: list = []
 for line in csv_file_lines[1:]:
     line_items: list = [only_printable_and_strip(c) for c in line.split(',')]
+    antibody_hubmap_ids.append(line_items[antibody_hubmap_id_index])
     try:
         make_update(conn, csv_file_header, line_items)
     except psycopg2.OperationalError as oe:
@@ -225,11 +228,27 @@ headers: dict = {
     "Accept": "application/json",
     "Authorization": f"Bearer {args.token}"
 }
-response = requests.put(restore_elasticsearch_url, headers=headers)
-if response.status_code != 200:
-    logger.error(f"Restore ElasticSearch failed; status:{response.status_code}")
+# Only the documents of the rows that were changed are re-indexed.
+response = requests.put(restore_elasticsearch_url, headers=headers,
+                        json={'antibody_hubmap_ids': antibody_hubmap_ids})
+if response.status_code != 202:
+    logger.error(f"Restore ElasticSearch failed; status:{response.status_code}; {response.text}")
     exit(1)
-logger.info(f"Restore ElasticSearch succeeded")
+job_id: str = response.json()['job_id']
+logger.info(f"Restore ElasticSearch started; job_id: {job_id}")
+while True:
+    time.sleep(2)
+    response = requests.get(f"{restore_elasticsearch_url}/{job_id}", headers=headers)
+    if response.status_code != 200:
+        logger.error(f"Restore ElasticSearch status failed; status:{response.status_code}")
+        exit(1)
+    job: dict = response.json()
+    if job['status'] not in ('queued', 'running'):
+        break
+if job['status'] != 'succeeded':
+    logger.error(f"Restore ElasticSearch {job['status']}; errors: {job['errors']}")
+    exit(1)
+logger.info(f"Restore ElasticSearch succeeded; {job['result']}")
 
 logger.info(f"Run Time: {datetime.timedelta(seconds=time.time() - start_time)}")
 logger.info('Done!')
@@ -8,6 +8,12 @@ from antibodyapi.logout import logout_blueprint
 from antibodyapi.restore_elasticsearch import restore_elasticsearch_blueprint
 from antibodyapi.save_antibody import save_antibody_blueprint
 from antibodyapi.status import status_blueprint
+from antibodyapi.utils import db
+from antibodyapi.utils import elasticsearch as antibody_elasticsearch
+from antibodyapi.utils import search as antibody_search
+from antibodyapi.utils import ubkg
+from antibodyapi.utils import validation_cache
+from antibodyapi.utils import vendors
 from antibodyapi import default_config
 
 logger = logging.getLogger(__name__)
@@ -24,6 +30,13 @@ def create_app(testing=False):
         # this file lives in '/instance/app.conf'
         app.config.from_pyfile('app.conf')
 
+    db.init_app(app)
+    antibody_elasticsearch.init_app(app)
+    antibody_search.init_app(app)
+    ubkg.init_app(app)
+    validation_cache.init_app(app)
+    vendors.init_app(app)
+
     app.register_blueprint(webui_blueprint)
     app.register_blueprint(import_antibodies_blueprint)
     app.register_blueprint(list_antibodies_blueprint)
@@ -36,7 +49,7 @@ def create_app(testing=False):
     @app.teardown_appcontext
     def close_db(error): # pylint: disable=unused-argument
         if 'connection' in g and g.connection is not None:
-            logger.info(f"Closing Database Connection")
-            g.connection.close()
+            db.get_db_pool().putconn(g.connection)
+            g.connection = None
 
     return app
@@ -26,13 +26,122 @@ class DefaultConfig:
     SEARCH_API_BASE = 'should-be-overridden'
     UUID_API_URL = 'http://uuidmock:1080'
     INGEST_API_URL = 'http://uuidmock:1080'
+    # HuBMAP ids are minted by the uuid-api at most UUID_API_BATCH_SIZE to a request
+    # (see utils/hubmap_ids).
+    UUID_API_BATCH_SIZE = 100
+    UUID_API_TIMEOUT = 30
     ASSETS_URL = 'should-be-overridden'
 
     ANTIBODY_ELASTICSEARCH_INDEX = 'hm_antibodies'
+    # Settings for the one Elasticsearch client that each process shares (see utils/elasticsearch).
+    # The pool size should be at least the number of uWSGI threads per process.
+    ELASTICSEARCH_POOL_MAXSIZE = 10
+    ELASTICSEARCH_TIMEOUT = 30
+    ELASTICSEARCH_MAX_RETRIES = 3
+    ELASTICSEARCH_RETRY_ON_TIMEOUT = True
+    # Limits for each _bulk request sent by the BulkIndexer during imports.
+    ELASTICSEARCH_BULK_MAX_ACTIONS = 500
+    ELASTICSEARCH_BULK_MAX_BYTES = 5 * 1024 * 1024
+    # Settings given to a rebuilt index once it is loaded, before the alias is moved to it;
+    # and the number of earlier rebuilt indices kept around for rolling back.
+    ELASTICSEARCH_INDEX_REPLICAS = 1
+    ELASTICSEARCH_INDEX_REFRESH_INTERVAL = '1s'
+    ELASTICSEARCH_INDEX_KEEP_PREVIOUS = 1
+    # The restore streams rows from the database RESTORE_FETCH_SIZE at a time, looks up target
+    # aliases on RESTORE_ALIAS_WORKERS threads, and holds at most RESTORE_MAX_PENDING rows
+    # waiting to be indexed.
+    RESTORE_FETCH_SIZE = 1000
+    RESTORE_ALIAS_WORKERS = 8
+    RESTORE_MAX_PENDING = 2000
     QUERY_ELASTICSEARCH_DIRECTLY = False
+    # The backend used by /_search (see utils/search): 'elasticsearch', 'search-api', or 'failover'
+    # which uses the faster of the two and falls back to the other on errors. When None,
+    # QUERY_ELASTICSEARCH_DIRECTLY chooses between the first two.
+    SEARCH_BACKEND = None
+    SEARCH_TIMEOUT = 10
+    SEARCH_API_POOL_MAXSIZE = 10
+    SEARCH_LATENCY_EWMA_ALPHA = 0.2
+    SEARCH_FAILOVER_COOLDOWN = 30
+    SEARCH_FAILOVER_PROBE_RATE = 0.05
+    # Responses to /_search are cached per process for SEARCH_CACHE_TTL seconds (see utils/search).
+    # A SEARCH_CACHE_MAXSIZE of 0 disables the cache. A write to the index is seen by the other
+    # workers at once when SEARCH_GENERATION_UWSGI_CACHE names a uWSGI cache (see uwsgi.ini), and
+    # only once their entries expire otherwise.
+    SEARCH_CACHE_MAXSIZE = 1000
+    SEARCH_CACHE_TTL = 60
+    SEARCH_GENERATION_UWSGI_CACHE = None
+    # Identical searches that arrive while one is running wait up to SEARCH_SINGLE_FLIGHT_TIMEOUT
+    # seconds to share its result. Set SEARCH_SINGLE_FLIGHT_UWSGI_CACHE to the name of a uWSGI cache
+    # (see uwsgi.ini) to also share them between workers.
+    SEARCH_SINGLE_FLIGHT_TIMEOUT = 15
+    SEARCH_SINGLE_FLIGHT_UWSGI_CACHE = None
 
+    # Background jobs (see utils/jobs) write their progress to the 'jobs' table at most every
+    # JOB_PROGRESS_INTERVAL seconds, and keep the first JOB_MAX_ERRORS errors that they hit.
+    JOB_PROGRESS_INTERVAL = 2
+    JOB_MAX_ERRORS = 100
+    # Their process renews their heartbeat every JOB_HEARTBEAT_INTERVAL seconds, and a queued
+    # or running job with none for JOB_ORPHANED_AFTER seconds is marked failed when the next
+    # job starts.
+    JOB_HEARTBEAT_INTERVAL = 30
+    JOB_ORPHANED_AFTER = 300
+    # POST /antibodies/import queues the import as a job and returns 202, unless
+    # IMPORT_ANTIBODIES_ASYNC is False. Each process runs at most IMPORT_ANTIBODIES_WORKERS imports
+    # at once, so they leave its uWSGI threads free.
+    IMPORT_ANTIBODIES_ASYNC = True
+    IMPORT_ANTIBODIES_WORKERS = 1
+    # The rows of each uploaded TSV file, and the links to their previous versions, are written with
+    # statements of up to IMPORT_ANTIBODIES_INSERT_BATCH_SIZE rows.
+    IMPORT_ANTIBODIES_INSERT_BATCH_SIZE = 1000
+
+    # The external identifiers in an uploaded TSV file are checked on VALIDATION_WORKERS threads,
+    # waiting at most VALIDATION_TIMEOUT seconds for each response (see utils/validation). Each
+    # process sends a host at most VALIDATION_RATE_LIMITS[host] requests per second, or
+    # VALIDATION_DEFAULT_RATE_LIMIT if it is not listed. HGNC asks for no more than 10 per second,
+    # which is 5 for each of the uWSGI processes.
+    VALIDATION_WORKERS = 8
+    VALIDATION_TIMEOUT = 30
+    VALIDATION_DEFAULT_RATE_LIMIT = 20
+    VALIDATION_RATE_LIMITS = {'rest.genenames.org': 5}
+    # The outcome of checking an identifier is cached for VALIDATION_CACHE_TTL seconds, or
+    # VALIDATION_CACHE_NEGATIVE_TTL seconds if it was not found. Like the UBKG responses below,
+    # outcomes are cached in process, and with VALIDATION_CACHE_PERSISTENT also in a table that
+    # keeps at most VALIDATION_CACHE_MAX_ROWS of them. Both tables are opt-in, as they need their
+    # evolution to have been run (modify_5.sql here, modify_2.sql for UBKG).
+    VALIDATION_CACHE_MAXSIZE = 10000
+    VALIDATION_CACHE_TTL = 30 * 24 * 60 * 60
+    VALIDATION_CACHE_NEGATIVE_TTL = 60 * 60
+    VALIDATION_CACHE_PERSISTENT = False
+    VALIDATION_CACHE_MAX_ROWS = 100000
+
+    # UBKG responses used for target_symbol and cell_marker lookups are cached for UBKG_CACHE_TTL
+    # seconds, and those that were not found for UBKG_CACHE_NEGATIVE_TTL seconds. With
+    # UBKG_CACHE_PERSISTENT they are also kept in the 'ubkg_cache' table which is shared by all
+    # workers (see modify_2.sql).
+    UBKG_TIMEOUT = 30
+    UBKG_CACHE_MAXSIZE = 10000
+    UBKG_CACHE_TTL = 24 * 60 * 60
+    UBKG_CACHE_NEGATIVE_TTL = 60 * 60
+    UBKG_CACHE_PERSISTENT = False
+
+    # The ids of vendors are cached in process for VENDOR_CACHE_TTL seconds (see utils/vendors).
+    VENDOR_CACHE_MAXSIZE = 1000
+    VENDOR_CACHE_TTL = 60 * 60
+
+    # GET /antibodies streams the catalog from the database this many rows at a time,
+    # and returns pages of at most LIST_ANTIBODIES_MAX_LIMIT rows.
+    LIST_ANTIBODIES_FETCH_SIZE = 1000
+    LIST_ANTIBODIES_MAX_LIMIT = 10000
 
     DATABASE_HOST = 'db'
     DATABASE_NAME = 'antibodydb_test'
     DATABASE_USER = 'postgres'
     DATABASE_PASSWORD = 'password'
+    # Each process shares a pool of between DATABASE_POOL_MINCONN and DATABASE_POOL_MAXCONN
+    # connections (see utils/db), and a thread waits up to DATABASE_POOL_TIMEOUT seconds for one to
+    # be free. A connection is only checked before use after it has been idle for
+    # DATABASE_POOL_CHECK_IDLE seconds.
+    DATABASE_POOL_MINCONN = 1
+    DATABASE_POOL_MAXCONN = 10
+    DATABASE_POOL_TIMEOUT = 30
+    DATABASE_POOL_CHECK_IDLE = 30
@@ -1,7 +1,6 @@
 import csv
 import os
 import json
-import requests
 from flask import (
     abort, Blueprint, current_app, jsonify, make_response,
     redirect, request, session, url_for, render_template
@@ -9,17 +8,24 @@ from flask import (
 import psycopg2
 from psycopg2._psycopg import connection
 from psycopg2.errors import UniqueViolation #pylint: disable=no-name-in-module
-from antibodyapi.utils.decorators import require_avr_group
+from psycopg2.extras import execute_values
+from antibodyapi.utils.decorators import is_data_admin, require_avr_group
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 from antibodyapi.utils import (
-    allowed_file, find_or_create_vendor, get_cursor,
-    get_file_uuid, get_group_id, get_hubmap_uuid,
-    insert_query, insert_query_with_avr_file_and_uuid,
-    json_error, update_next_version_query, fetch_previous_version_pdf_uuid_query
+    allowed_file,
+    bulk_insert_query, bulk_insert_template,
+    get_file_uuid, get_group_id,
+    json_error, update_next_versions_query
 )
-from antibodyapi.utils.elasticsearch import update_next_version_es
 from antibodyapi.utils.validation import validate_antibodytsv, CanonicalizeYNResponse, CanonicalizeDOI
-from antibodyapi.utils.elasticsearch import index_antibody
+from antibodyapi.utils.db import get_db_pool
+from antibodyapi.utils.elasticsearch import BulkIndexer
+from antibodyapi.utils.hubmap_ids import reserve_hubmap_ids
+from antibodyapi.utils.vendors import cache_vendors, find_or_create_vendors
+from antibodyapi.utils.jobs import JobCancelled, JobFailed, get_job, start_job
+from antibodyapi.utils.pdf_files import PdfFile, PdfFiles, spooled_copy
 from typing import List
 import string
 import logging
@@ -27,6 +33,8 @@ import logging
 import_antibodies_blueprint = Blueprint('import_antibodies', __name__)
 logger = logging.getLogger(__name__)
 
+JOB_KIND: str = 'import_antibodies'
+
 
 def only_printable_and_strip(s: str) -> str:
     # This does not work because (apparently) the TM symbol is a unicode character.
@@ -42,6 +50,10 @@ def import_antibodies(): # pylint: disable=too-many-branches
     Currently this is called from 'server/antibodyapi/webui/templates/upload.html' through the
     <form onsubmit="AJAXSubmit(this);..." enctype="..." action="/antibodies/import" method="post" ...>
 
+    With IMPORT_ANTIBODIES_ASYNC the import runs as a job (see utils/jobs) on one of IMPORT_ANTIBODIES_WORKERS
+    threads, and this returns 202 with the 'job_id' that GET /antibodies/import/<job_id> reports on.
+    Otherwise it returns 201 once the import is done.
+
     NOTE: The maximum .pdf size is currently 10Mb.
     """
     if not session.get('is_authenticated'):
@@ -60,29 +72,133 @@ def import_antibodies(): # pylint: disable=too-many-branches
         abort(json_error('TSV file missing', 406))
 
     app = current_app
-    cur = get_cursor(app)
-    hubmap_ids_and_names = []
 
     group_id = get_group_id(app.config['INGEST_API_URL'], request.form.get('group_id'))
     if group_id is None:
         abort(json_error('Not a member of a data provider group or no group_id provided', 406))
 
+    # The job runs outside of this request, so it is given what it needs from the session.
+    user: dict = {
+        'name': session['name'],
+        'email': session['email'],
+        'sub': session['sub'],
+        'token': session['groups_access_token']
+    }
+    if not app.config['IMPORT_ANTIBODIES_ASYNC']:
+        return make_response(jsonify(_import_antibodies(None, request.files, group_id, user)), 201)
+
+    try:
+        job_id: str = start_job(JOB_KIND, _import_antibodies_job, _read_files(request.files), group_id, user,
+                                workers=app.config['IMPORT_ANTIBODIES_WORKERS'], created_by_user_sub=user['sub'])
+    except Exception as e:
+        logger.exception(e)
+        abort(json_error(f"Unable to start the import: {e}", 500))
+
+    response = make_response(jsonify({'message': "Import accepted", 'job_id': job_id}), 202)
+    response.headers['Location'] = url_for('import_antibodies.import_antibodies_job', job_id=job_id)
+    return response
+
+
+@import_antibodies_blueprint.route('/antibodies/import/<job_id>', methods=['GET'])
+@require_avr_group()
+def import_antibodies_job(job_id: str):
+    """
+    The status of an import: its 'phase' ('validating', 'importing' or 'indexing'), the 'row' that it is on,
+    'rows_done' of 'rows_total', the 'errors' (with the row of each as its 'ref') and, once it has succeeded,
+    the same 'result' as the 201 response of a synchronous import.
+
+    The errors hold the rows of the upload, so only the user who started the import, or a data admin,
+    can see it; to anyone else it is not found.
+    """
+    job = get_job(JOB_KIND, job_id)
+    if job is None or (job['created_by_user_sub'] != session.get('sub') and not is_data_admin()):
+        abort(json_error(f"No import job found with job_id: {job_id}", 404))
+    report: dict = {k: v for k, v in job.items() if k not in ('progress', 'created_by_user_sub')}
+    report.update(job['progress'])
+    return make_response(jsonify(report), 200)
+
+
+def _read_files(files) -> MultiDict:
+    """
+    A copy of the uploaded 'files' (see spooled_copy()), since those of the request are closed once it
+    has been answered.
+    """
+    return MultiDict([(key, spooled_copy(file)) for key, file in files.items(multi=True)])
+
+
+def _progress(job, **progress) -> None:
+    if job is not None:
+        job.update(**progress)
+
+
+def _import_antibodies_job(job, files: MultiDict, group_id: str, user: dict) -> dict:
+    try:
+        return _import_antibodies(job, files, group_id, user)
+    except HTTPException as e:
+        # The message is the one that a synchronous import would have responded with.
+        message = e.response.get_json()['message'] if e.response is not None else e.description
+        job.add_error(message, ref=job.progress.get('row'))
+        raise JobFailed() from e
+
+
+def _insert_antibodies(job, cur, antibodies: list) -> None:
+    """
+    Insert the (row number, antibody) 'antibodies' of a .tsv file with INSERTs of up to
+    IMPORT_ANTIBODIES_INSERT_BATCH_SIZE rows each, rather than one for each row. Should that fail, they are
+    inserted again one at a time from a savepoint to find the row that fails, and its error is raised with
+    the job's 'row' set to it.
+    """
+    if not antibodies:
+        return
+    cur.execute('SAVEPOINT insert_antibodies')
+    try:
+        execute_values(cur, bulk_insert_query(), [antibody for _, antibody in antibodies],
+                       template=bulk_insert_template(),
+                       page_size=current_app.config['IMPORT_ANTIBODIES_INSERT_BATCH_SIZE'])
+    except psycopg2.Error as e:
+        logger.debug(f"import_antibodies: SQL inserting {len(antibodies)} rows failed: {e}; inserting them one by one")
+        cur.execute('ROLLBACK TO SAVEPOINT insert_antibodies')
+        for row_i, antibody in antibodies:
+            _progress(job, row=row_i)
+            logger.debug(f"import_antibodies: SQL inserting row: {antibody}")
+            execute_values(cur, bulk_insert_query(), [antibody], template=bulk_insert_template())
+    cur.execute('RELEASE SAVEPOINT insert_antibodies')
+    logger.debug(f"import_antibodies: SQL inserting {len(antibodies)} rows SUCCESS!")
+
+
+def _import_antibodies(job, files: MultiDict, group_id: str, user: dict) -> dict:
+    """
+    Validate and then save the antibodies of the .tsv 'files' (and their .pdf files), reporting progress
+    to the 'job' when there is one. Errors abort with the response that the request should return.
+    """
+    app = current_app
+    hubmap_ids_and_names = []
+
     # Validate everything before saving anything...
-    pdf_files_processed, target_datas =\
-        validate_antibodytsv(request.files, app.config['UBKG_API_URL'])
+    _progress(job, phase='validating')
+    # The .pdf files by name, for both validation and import.
+    pdf_files: PdfFiles = PdfFiles(files)
+    pdf_files_processed, target_datas, previous_versions =\
+        validate_antibodytsv(files, app.config['UBKG_API_URL'], on_row=lambda row_i: _progress(job, row=row_i),
+                             pdf_files=pdf_files)
     
-    conn = psycopg2.connect(
-        host=app.config['DATABASE_HOST'],
-        user=app.config['DATABASE_USER'],
-        dbname=app.config['DATABASE_NAME'],
-        password=app.config['DATABASE_PASSWORD']
-    )
-    conn.autocommit = False
+    # The rows are saved in one transaction on a connection of its own from the pool,
+    # as the app context's connection is in autocommit.
+    db_pool = get_db_pool()
+    conn = db_pool.getconn(autocommit=False)
+    # The vendors found by the transaction, which are only cached once it has committed.
+    vendors_found: dict = {}
 
     try:
         with conn:
             cur = conn.cursor()
-            for file in request.files.getlist('file'):
+            # The documents are sent to Elasticsearch in batches, and any failures are checked
+            # before the transaction is committed.
+            bulk_indexer = BulkIndexer()
+            _progress(job, phase='importing', rows_done=0)
+            rows_done: int = 0
+            rows_total: int = 0
+            for file in files.getlist('file'):
                 if not (file and allowed_file(file.filename)):
                     raise Exception('Incorrect File Type. TSV and PDF files required.')
                 filename: str = secure_filename(file.filename)
@@ -90,33 +206,34 @@ def import_antibodies(): # pylint: disable=too-many-branches
                 file_path: bytes = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 file.save(file_path)
                 with open(file_path, encoding="ascii", errors="ignore") as tsvfile:
+                    # silently drop any non-printable characters like Trademark symbols from Excel documents
+                    # and make all the keys lowercase so comparison is easy...
+                    rows: list = [{k.lower().strip(): only_printable_and_strip(v) for (k, v) in row_dr.items()}
+                                  for row_dr in csv.DictReader(tsvfile, delimiter='\t')]
+                    rows_total += len(rows)
+                    # The ids for all of the rows are taken at once, and only used up if the transaction commits.
+                    hubmap_ids: list = reserve_hubmap_ids(cur, len(rows), app.config['UUID_API_URL'],
+                                                          token=user['token'])
+                    # As are the vendors, creating those that are new with one INSERT.
+                    vendor_ids: dict = find_or_create_vendors(cur, [row['vendor'] for row in rows if 'vendor' in row],
+                                                              vendors_found)
+                    # The (row number, row, Elasticsearch document) of the rows to insert together.
+                    antibodies: list = []
+                    # The (row number, previous_version_id, next_version_id, previous version's antibody_uuid)
+                    # of the versions that the rows follow, linked together once the rows are inserted.
+                    next_versions: list = []
                     row_i: int = 1
-                    for row_dr in csv.DictReader(tsvfile, delimiter='\t'):
-                        # silently drop any non-printable characters like Trademark symbols from Excel documents
-                        # and make all the keys lowercase so comparison is easy...
-                        row = {k.lower().strip(): only_printable_and_strip(v) for (k, v) in row_dr.items()}
+                    for row in rows:
                         row_i += 1
+                        _progress(job, row=row_i, rows_done=rows_done, rows_total=rows_total)
                         try:
-                            row['vendor_id'] = find_or_create_vendor(cur, row['vendor'])
+                            row['vendor_id'] = vendor_ids[row['vendor']]
                         except KeyError:
                             raise ValueError(f"TSV file row number `{row_i}`: Problem processing `vendor` field")
                         # Save this for index_antibody() Elasticsearch, but remove from for DB store...
                         vendor_name: str = row['vendor']
                         del row['vendor']
 
-                        if 'cell_marker' in row:
-                            cell_marker = row['cell_marker'].upper()
-                            cell_marker_err = f"TSV file row number `{row_i}`: Problem processing `cell_marker` field with value `{cell_marker}`"
-                            try:
-                                cell_marker_url = f"{app.config['UBKG_API_URL']}/celltypes/{cell_marker.replace('CL:', '')}" 
-                                response = requests.get(
-                                    cell_marker_url
-                                )
-                                if not response.ok:
-                                    raise ValueError(f"{cell_marker_err}. Invalid cell type.\nPlease refer to the cell types ontology for a list of valid cell types and associated codes. {app.config['UBKG_CELL_TYPES_ONTOLOGY_URL']}") 
-                            except Exception as http_e:
-                               raise ValueError(f"{http_e}") 
-
                         # The .tsv file contains a 'target_symbol' field that is (possibly) resolved into a different
                         # 'target_symbol' by the UBKG lookup during validation. Here, whatever the user entered is
                         # replaced by the 'target_symbol' returned by UBKG.
@@ -125,12 +242,12 @@ def import_antibodies(): # pylint: disable=too-many-branches
                         # The target_aliases is a list of the other symbols that are associated with the target_symbol,
                         # and it gets saved to ElasticSearch, but not the database.
                         target_aliases: List[str] = target_datas[target_symbol_from_tsv]['target_aliases']
-                        hubmap_uuid_dict: dict = get_hubmap_uuid(app.config['UUID_API_URL'])
+                        hubmap_uuid_dict: dict = hubmap_ids[row_i - 2]
                         row['antibody_uuid'] = hubmap_uuid_dict.get('uuid')
                         row['antibody_hubmap_id'] = hubmap_uuid_dict.get('hubmap_id')
-                        row['created_by_user_displayname'] = session['name']
-                        row['created_by_user_email'] = session['email']
-                        row['created_by_user_sub'] = session['sub']
+                        row['created_by_user_displayname'] = user['name']
+                        row['created_by_user_email'] = user['email']
+                        row['created_by_user_sub'] = user['sub']
                         row['group_uuid'] = group_id
 
                         # Canonicalize entries that we can so that they are always saved under the same string...
@@ -145,68 +262,80 @@ def import_antibodies(): # pylint: disable=too-many-branches
                         row['protocol_doi'] = canonicalize_doi.canonicalize_multiple(row['protocol_doi'])
                         if row['manuscript_doi'] != '':
                             row['manuscript_doi'] = canonicalize_doi.canonicalize(row['manuscript_doi'])
-                        
-                        previous_pdf = fetch_previous_version_pdf_uuid_query()
-                        cur.execute(previous_pdf, {'previous_version_id': row['previous_version_id']})
-                        prev_result = cur.fetchone()            
-                        if prev_result:
-                            row['previous_version_pdf_uuid'] = prev_result[0]
-                            row['previous_version_pdf_filename'] = prev_result[1]
+
+                        # Found when the upload was validated.
+                        previous_version: dict = previous_versions.get(row['previous_version_id'])
+                        if previous_version is not None:
+                            row['previous_version_pdf_uuid'] = previous_version['avr_pdf_uuid']
+                            row['previous_version_pdf_filename'] = previous_version['avr_pdf_filename']
                         else:
                             row['previous_version_pdf_uuid'] = None
                             row['previous_version_pdf_filename'] = None
                         row['next_version_id'] = None
-                        query = insert_query()
+                        avr_pdf: dict = {'avr_pdf_uuid': None, 'avr_pdf_filename': None}
                         if 'avr_pdf_filename' in row.keys():
-                            if 'pdf' in request.files:
-                                for avr_file in request.files.getlist('pdf'):
-                                    if avr_file.filename == row['avr_pdf_filename']:
-                                        row['avr_pdf_uuid'] = get_file_uuid(
-                                            app.config['INGEST_API_URL'],
-                                            app.config['UPLOAD_FOLDER'],
-                                            row['antibody_uuid'],
-                                            avr_file
-                                        )
-                                        query = insert_query_with_avr_file_and_uuid()
-                                        row['avr_pdf_filename'] = secure_filename(row['avr_pdf_filename'])
-                        
-                        logger.debug(f"import_antibodies: SQL inserting row: {row}")
-                        cur.execute(query, row)
-                        logger.debug(f"import_antibodies: SQL inserting row SUCCESS!")
+                            pdf_file: PdfFile = pdf_files.get(row['avr_pdf_filename'])
+                            if pdf_file is not None:
+                                row['avr_pdf_uuid'] = get_file_uuid(
+                                    app.config['INGEST_API_URL'],
+                                    app.config['UPLOAD_FOLDER'],
+                                    row['antibody_uuid'],
+                                    pdf_file.file,
+                                    token=user['token']
+                                )
+                                row['avr_pdf_filename'] = secure_filename(row['avr_pdf_filename'])
+                                avr_pdf = {'avr_pdf_uuid': row['avr_pdf_uuid'],
+                                           'avr_pdf_filename': row['avr_pdf_filename']}
+
+                        antibodies.append((row_i, row | avr_pdf,
+                                           row | {'vendor_name': vendor_name, 'target_aliases': target_aliases}))
+                        if row['previous_version_id']:
+                            next_versions.append((row_i, row['previous_version_id'], row['antibody_hubmap_id'],
+                                                  previous_version and previous_version['antibody_uuid']))
+                    _insert_antibodies(job, cur, [(row_i, antibody) for row_i, antibody, _ in antibodies])
+                    if next_versions:
+                        execute_values(cur, update_next_versions_query(),
+                                       [(previous_version_id, next_version_id)
+                                        for _, previous_version_id, next_version_id, _ in next_versions],
+                                       page_size=app.config['IMPORT_ANTIBODIES_INSERT_BATCH_SIZE'])
+                    for row_i, _, next_version_id, previous_version_uuid in next_versions:
+                        if previous_version_uuid is not None:
+                            bulk_indexer.update_next_version(previous_version_uuid, next_version_id, ref=row_i)
+                    for row_i, antibody, document in antibodies:
                         hubmap_ids_and_names.append({
-                            'antibody_hubmap_id': row['antibody_hubmap_id'],
-                            'antibody_name': row.get('avr_pdf_filename')
+                            'antibody_hubmap_id': antibody['antibody_hubmap_id'],
+                            'antibody_name': document.get('avr_pdf_filename')
                         })
-                        try:
-                            index_antibody(row | {'vendor_name': vendor_name, 'target_aliases': target_aliases})
-                        except Exception as index_err:
-                            logger.debug(f"Elasticsearch indexing failed on row {row_i}: {index_err}")
-                            raise Exception("We couldn’t complete your request due to a system error. Your data has not been saved. Please try again in a few minutes. If the problem continues, contact support.")
-                        if row['previous_version_id']:
-                            update_query = update_next_version_query()
-                            cur.execute(update_query, {
-                                'next_version_id': row['antibody_hubmap_id'],
-                                'previous_version_id': row['previous_version_id']
-                            })
-                            try:
-                                update_next_version_es(row['previous_version_id'], row['antibody_hubmap_id'])
-                            except Exception as index_err:
-                                logger.debug(f"Elasticsearch indexing failed on {row_i} updating next_version_id")
+                        bulk_indexer.index(document, ref=row_i)
+                    rows_done += len(antibodies)
+            _progress(job, phase='indexing', rows_done=rows_done)
+            try:
+                index_errors: list = bulk_indexer.close()
+            except Exception as index_err:
+                logger.debug(f"Elasticsearch indexing failed: {index_err}")
+                index_errors = [{'ref': None, 'action': None, 'error': str(index_err)}]
+            for index_error in index_errors:
+                if index_error['action'] == 'update':
+                    logger.debug(f"Elasticsearch indexing failed on {index_error['ref']} updating next_version_id")
+                else:
+                    logger.debug(f"Elasticsearch indexing failed on row {index_error['ref']}: {index_error['error']}")
+                    raise Exception("We couldn’t complete your request due to a system error. Your data has not been saved. Please try again in a few minutes. If the problem continues, contact support.")
             cur.close()
+        cache_vendors(vendors_found)
+    except JobCancelled:
+        conn.rollback()
+        raise
     except ValueError as e:
         conn.rollback()
-        conn.close()
         abort(json_error(str(e), 406))
     except Exception as e:
         conn.rollback()
-        conn.close()
         logger.debug(f"Exception {e}")
         abort(json_error(str(e), 500))
     finally:
-        if not conn.closed:
-            conn.close()
+        db_pool.putconn(conn)
     pdf_files_not_processed: list = []
-    for avr_file in request.files.getlist('pdf'):
+    for avr_file in files.getlist('pdf'):
         if avr_file.filename not in pdf_files_processed:
             pdf_files_not_processed.append(avr_file.filename)
-    return make_response(jsonify(antibodies=hubmap_ids_and_names, pdf_files_not_processed=pdf_files_not_processed), 201)
+    return {'antibodies': hubmap_ids_and_names, 'pdf_files_not_processed': pdf_files_not_processed}
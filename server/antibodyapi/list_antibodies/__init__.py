@@ -1,15 +1,155 @@
-from flask import Blueprint, current_app, jsonify, make_response
-from antibodyapi.utils import base_antibody_query, base_antibody_query_result_to_json, get_cursor
+import json
+import uuid
+from urllib.parse import urlencode
+import psycopg2
+from flask import Blueprint, Response, abort, current_app, jsonify, make_response, request, stream_with_context
+from antibodyapi.utils import (
+    ANTIBODY_FIELD_COLUMNS, get_cursor, json_error, projected_antibody_query, projected_antibody_query_result_to_json
+)
+from antibodyapi.utils.db import get_db_pool
+from antibodyapi.utils.etag import add_validators, catalog_etag, not_modified
 
 list_antibodies_blueprint = Blueprint('list_antibodies', __name__)
 
+NDJSON_MIMETYPE: str = 'application/x-ndjson'
+
 
 @list_antibodies_blueprint.route('/antibodies')
 def list_antibodies():
+    """
+    The antibodies are streamed from a server side cursor LIST_ANTIBODIES_FETCH_SIZE rows at a time,
+    so the memory used does not grow with the size of the catalog. They are written as the usual
+    {"antibodies": [...]} JSON, or with '?format=ndjson' (or 'Accept: application/x-ndjson')
+    as one JSON object per line.
+
+    '?fields=antibody_hubmap_id,rrid' returns only those fields. '?limit=N' returns a page of at most N
+    antibodies, with a 'next_after' (and a 'Link' header) to pass as '?after=' for the next page, which
+    is null on the last page.
+
+    Responses have an ETag of the catalog version, and a request with a matching If-None-Match gets a 304
+    after one small query rather than the catalog.
+    """
+    ndjson: bool = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+    fields: list = _requested_fields()
+    limit = _int_arg('limit', 1, current_app.config['LIST_ANTIBODIES_MAX_LIMIT'])
+    after = _int_arg('after', 0)
+
+    etag = catalog_etag(request.full_path, ndjson)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    query: str = projected_antibody_query(fields)
+    params: list = []
+    if after is not None:
+        query += ' WHERE a.id > %s'
+        params.append(after)
+    query += ' ORDER BY a.id ASC'
+    if limit is not None:
+        return add_validators(_antibodies_page(query, params, fields, limit, ndjson), etag)
+
+    cur, close = _open_cursor()
+    try:
+        cur.execute(query, params)
+    except Exception:
+        close()
+        raise
+    body = _stream_antibodies(cur, fields, current_app.config['LIST_ANTIBODIES_FETCH_SIZE'], ndjson)
+    response = Response(stream_with_context(body), status=200,
+                        mimetype=NDJSON_MIMETYPE if ndjson else 'application/json')
+    # Whether or not the body is ever read (e.g., for a HEAD, or a client that goes away first).
+    response.call_on_close(close)
+    return add_validators(response, etag)
+
+
+def _open_cursor():
+    """
+    A server side cursor, with a name of its own, in a transaction on a connection of its own from the pool,
+    so that the rows are read from the database as the response is streamed rather than all at once. Also
+    returns the function that closes the cursor and gives the connection back to the pool (which ends
+    the transaction); it must be called once the response is closed.
+    """
+    db_pool = get_db_pool()
+    try:
+        conn = db_pool.getconn(autocommit=False)
+    except psycopg2.Error as e:
+        abort(json_error(f"Unable to connect to PosgreSQL database; error: {e}", 502))
+    cur = conn.cursor(name=f'list_antibodies_{uuid.uuid4().hex}')
+    closed: list = []
+
+    def close() -> None:
+        if closed:
+            return
+        closed.append(True)
+        try:
+            cur.close()
+        except psycopg2.Error:
+            pass
+        finally:
+            db_pool.putconn(conn)
+    return cur, close
+
+
+def _antibodies_page(query: str, params: list, fields: list, limit: int, ndjson: bool):
+    # One more row than the page is read to know whether there is another page.
     cur = get_cursor(current_app)
-    cur.execute(base_antibody_query() + ' ORDER BY a.id ASC')
-    results = []
-    for antibody in cur:
-        ant = base_antibody_query_result_to_json(antibody)
-        results.append(ant)
-    return make_response(jsonify(antibodies=results), 200)
+    cur.execute(query + ' LIMIT %s', params + [limit + 1])
+    rows: list = cur.fetchall()
+    cur.close()
+    next_after = rows[limit - 1][0] if len(rows) > limit else None
+    antibodies: list = [projected_antibody_query_result_to_json(row, fields) for row in rows[:limit]]
+    if ndjson:
+        response = make_response(''.join(json.dumps(a) + '\n' for a in antibodies), 200)
+        response.mimetype = NDJSON_MIMETYPE
+    else:
+        response = make_response(jsonify(antibodies=antibodies, next_after=next_after), 200)
+    if next_after is not None:
+        next_args: dict = request.args.to_dict() | {'after': next_after}
+        next_url: str = request.base_url + '?' + urlencode(next_args)
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def _stream_antibodies(cur, fields: list, fetch_size: int, ndjson: bool):
+    # The cursor is closed with the response (see _open_cursor()).
+    if not ndjson:
+        yield '{"antibodies": ['
+    separator: str = ''
+    while True:
+        rows: list = cur.fetchmany(fetch_size)
+        if not rows:
+            break
+        antibodies: list = [json.dumps(projected_antibody_query_result_to_json(row, fields)) for row in rows]
+        if ndjson:
+            yield '\n'.join(antibodies) + '\n'
+        else:
+            yield separator + ', '.join(antibodies)
+            separator = ', '
+    if not ndjson:
+        yield ']}\n'
+
+
+def _requested_fields() -> list:
+    fields_arg = request.args.get('fields')
+    if fields_arg is None:
+        return list(ANTIBODY_FIELD_COLUMNS)
+    fields: list = list(dict.fromkeys(f.strip() for f in fields_arg.split(',') if f.strip() != ''))
+    unknown: list = [f for f in fields if f not in ANTIBODY_FIELD_COLUMNS]
+    if len(fields) == 0 or unknown:
+        abort(json_error(f"Unknown fields: {', '.join(unknown)}; valid fields are: {', '.join(ANTIBODY_FIELD_COLUMNS)}", 400))
+    return fields
+
+
+def _int_arg(name: str, minimum: int, maximum: int = None):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        abort(json_error(f"'{name}' must be an integer", 400))
+    if value < minimum or (maximum is not None and value > maximum):
+        abort(json_error(f"'{name}' must be between {minimum} and {maximum}" if maximum is not None
+                         else f"'{name}' must be at least {minimum}", 400))
+    return value
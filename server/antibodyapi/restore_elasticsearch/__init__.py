@@ -1,65 +1,401 @@
-from flask import Blueprint, current_app, jsonify, make_response, request, abort
-from antibodyapi.utils import (
-    base_antibody_query, base_antibody_query_result_to_json, get_cursor
+from flask import Blueprint, current_app, jsonify, make_response, request, abort, url_for
+from antibodyapi.utils import base_antibody_query, base_antibody_query_result_to_json, json_error
+from antibodyapi.utils.elasticsearch import (
+    BulkIndexer, antibody_to_es_doc, create_versioned_index, es_doc_id, get_es_client, prune_versioned_indices,
+    swap_index_alias
 )
-from antibodyapi.utils.elasticsearch import index_antibody
-import elasticsearch
 import requests
 import logging
+import collections
 import concurrent.futures
-import threading
+import hashlib
+import json
+import time
 
+from antibodyapi.utils.db import get_db_pool, pooled_connection
 from antibodyapi.utils.decorators import require_data_admin
+from antibodyapi.utils.jobs import JobAlreadyRunning, JobFailed, get_job, request_cancel, start_job
+from antibodyapi.utils.ubkg import get_gene_relationships
 
 restore_elasticsearch_blueprint = Blueprint('restore_elasticsearch', __name__)
 logger = logging.getLogger(__name__)
 
+JOB_KIND: str = 'restore_elasticsearch'
+
+
 @restore_elasticsearch_blueprint.route('/restore_elasticsearch', methods=['PUT'])
 @require_data_admin()
 def restore_elasticsearch():
-    app_obj = current_app._get_current_object()
+    """
+    With no body the whole index is rebuilt. Otherwise only some rows are re-indexed into the live index,
+    those given by one of (see _reindex_elasticsearch()):
+        {"antibody_hubmap_ids": ["HBM...", ...]}
+        {"created_since": <created_timestamp>}
+        {"mode": "checksum"}
+    """
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        abort(json_error('The body must be a JSON object', 400))
+    selectors: list = [k for k in ('antibody_hubmap_ids', 'created_since', 'mode') if k in body]
+    if len(selectors) > 1:
+        abort(json_error(f"Only one of {', '.join(selectors)} may be given", 400))
+    if 'antibody_hubmap_ids' in body:
+        antibody_hubmap_ids = body['antibody_hubmap_ids']
+        if not isinstance(antibody_hubmap_ids, list) or len(antibody_hubmap_ids) == 0 \
+                or not all(isinstance(i, str) for i in antibody_hubmap_ids):
+            abort(json_error('antibody_hubmap_ids must be a non-empty list of strings', 400))
+        target, args = _reindex_elasticsearch, ('a.antibody_hubmap_id = ANY(%s)', (antibody_hubmap_ids,), False)
+    elif 'created_since' in body:
+        created_since = body['created_since']
+        if isinstance(created_since, bool) or not isinstance(created_since, (int, float)):
+            abort(json_error('created_since must be a created_timestamp (seconds since the epoch)', 400))
+        target, args = _reindex_elasticsearch, ('a.created_timestamp >= %s', (created_since,), False)
+    elif 'mode' in body:
+        if body['mode'] != 'checksum':
+            abort(json_error(f"Unknown mode '{body['mode']}'; the only mode is 'checksum'", 400))
+        target, args = _reindex_elasticsearch, ('TRUE', (), True)
+    else:
+        target, args = _restore_elasticsearch, ()
+
     try:
-        threading.Thread(target=_restore_elasticsearch, args=(app_obj,)).start()
-        logger.info("Started to restore ES index")
+        # Only one restore (of any kind) may run at a time across all of the workers.
+        job_id: str = start_job(JOB_KIND, target, *args, exclusive=True)
+    except JobAlreadyRunning as e:
+        abort(json_error(f"A restore of the Elastic Search index is already running; job_id: {e.job_id}", 409))
     except Exception as e:
         logger.exception(e)
         abort(500, description=f"restore_elasticsearch {e}")
 
+    response = make_response(jsonify({'message': f"Request of reindexing accepted", 'job_id': job_id}), 202)
+    response.headers['Location'] = url_for('restore_elasticsearch.restore_elasticsearch_job', job_id=job_id)
+    return response
+
 
-    return make_response(jsonify({'message': f"Request of reindexing accepted"}), 202)
+@restore_elasticsearch_blueprint.route('/restore_elasticsearch/<job_id>', methods=['GET'])
+@require_data_admin()
+def restore_elasticsearch_job(job_id: str):
+    job = get_job(JOB_KIND, job_id)
+    if job is None:
+        abort(json_error(f"No restore job found with job_id: {job_id}", 404))
+    return make_response(jsonify(_job_report(job)), 200)
+
+
+@restore_elasticsearch_blueprint.route('/restore_elasticsearch/<job_id>', methods=['DELETE'])
+@require_data_admin()
+def cancel_restore_elasticsearch_job(job_id: str):
+    if not request_cancel(JOB_KIND, job_id):
+        abort(json_error(f"No running restore job found with job_id: {job_id}", 404))
+    return make_response(jsonify({'message': f"Cancel of restore job requested", 'job_id': job_id}), 202)
+
+
+def _job_report(job: dict) -> dict:
+    """
+    The job with its progress counters, and the rate that rows are processed and the estimated time
+    remaining when they are known.
+    """
+    progress: dict = job['progress']
+    report: dict = {k: v for k, v in job.items() if k != 'progress'}
+    report.update(progress)
+    rows_per_second = None
+    eta_seconds = None
+    if job['started_timestamp'] is not None:
+        elapsed: float = (job['finished_timestamp'] or time.time()) - job['started_timestamp']
+        rows_read: int = progress.get('rows_read', 0)
+        if elapsed > 0 and rows_read > 0:
+            rows_per_second = round(rows_read / elapsed, 1)
+            if job['status'] == 'running' and progress.get('rows_total') is not None:
+                eta_seconds = round(max(progress['rows_total'] - rows_read, 0) / rows_per_second)
+    report['rows_per_second'] = rows_per_second
+    report['eta_seconds'] = eta_seconds
+    return report
 
 
-def _restore_elasticsearch(app):
+def _restore_elasticsearch(job) -> dict:
     """
     This endpoint will restore the ElasticSearch index from the data that has been stored
     in the database. However, since the 'target_aliases' field in ElasticSearch is not saved
     in the database but derived from a UBKG API endpoint, it must be reconstituted from there.
+
+    The data is loaded into a new timestamped index while searches continue to use the current one
+    through the ANTIBODY_ELASTICSEARCH_INDEX alias, which is only moved over once the load is complete.
+
+    The rows are streamed from a server side cursor RESTORE_FETCH_SIZE at a time. The target aliases are
+    looked up on a pool of RESTORE_ALIAS_WORKERS threads while the rows wait in a queue of at most
+    RESTORE_MAX_PENDING rows, and they leave the queue in order through a BulkIndexer. When the indexer
+    is slow the queue fills and reading stops, so memory does not grow with the size of the catalog.
+
+    Imports and saves go on writing through the alias to the previous index while the new one loads.
+    So once it is loaded, the rows added since the load began (and the previous versions that they
+    link to) are indexed into it again before the alias is moved, and those added meanwhile once
+    more after (see _catch_up()). Only a save whose transaction commits after that last pass, having
+    indexed its antibody before the alias moved, can be missing from the new index; a restore of its
+    antibody_hubmap_ids adds it.
+
+    This runs as a job (see utils/jobs) which reports its progress, and which stops when cancelled
+    the next time that it does so, leaving the alias on the previous index.
+    """
+    server: str = current_app.config['ELASTICSEARCH_SERVER']
+    ubkg_api_url: str = current_app.config['UBKG_API_URL']
+    fetch_size: int = current_app.config['RESTORE_FETCH_SIZE']
+    alias_workers: int = current_app.config['RESTORE_ALIAS_WORKERS']
+    max_pending: int = current_app.config['RESTORE_MAX_PENDING']
+    es_conn = get_es_client()
+
+    antibody_elasticsearch_index: str = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
+    new_index: str = create_versioned_index(es_conn, antibody_elasticsearch_index)
+    logger.info(f'Restoring Elastic Search index {new_index} on server {server}')
+    db_pool = get_db_pool()
+    conn = db_pool.getconn(autocommit=False)
+    try:
+        job.update(phase='counting', index=new_index)
+        with conn.cursor() as cur:
+            # Taken before the rows are read, so that those written as they load can be caught up.
+            marker: tuple = _write_marker(cur)
+            cur.execute('SELECT COUNT(*) FROM antibodies')
+            rows_total: int = cur.fetchone()[0]
+        job.update(phase='indexing', rows_total=rows_total, rows_read=0, rows_indexed=0, alias_lookups=0)
+
+        bulk_indexer = BulkIndexer(index=new_index, refresh=False)
+        # Each distinct target_symbol is looked up once per restore, and its UBKG responses are cached.
+        target_aliases_futures: dict = {}
+        pending: collections.deque = collections.deque()
+        rows_read: int = 0
+        app = current_app._get_current_object()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=alias_workers) as executor:
+            try:
+                # A named cursor keeps the result set on the server and fetches it 'itersize' rows at a time.
+                with conn.cursor(name='restore_elasticsearch') as cur:
+                    cur.itersize = fetch_size
+                    cur.execute(base_antibody_query() + ' ORDER BY a.id ASC')
+                    for antibody_array in cur:
+                        rows_read += 1
+                        antibody: dict = base_antibody_query_result_to_json(antibody_array)
+                        target_symbol: str = antibody['target_symbol']
+                        if target_symbol not in target_aliases_futures:
+                            target_aliases_futures[target_symbol] = executor.submit(
+                                _target_aliases, app, job, ubkg_api_url, target_symbol
+                            )
+                        pending.append((antibody, target_aliases_futures[target_symbol]))
+                        if len(pending) >= max_pending:
+                            _index_pending(bulk_indexer, pending, max_pending // 2)
+                        job.update(rows_read=rows_read, rows_indexed=bulk_indexer.success_count,
+                                   alias_lookups=len(target_aliases_futures))
+                _index_pending(bulk_indexer, pending, 0)
+            except BaseException:
+                # Don't wait on lookups for rows that will not be indexed.
+                for target_aliases_future in target_aliases_futures.values():
+                    target_aliases_future.cancel()
+                raise
+        # Ending the transaction of the load keeps it from holding back the markers of the catch-up.
+        conn.rollback()
+        logger.info(f'Rows retrieved: {rows_read}; distinct target symbols: {len(target_aliases_futures)}')
+        index_errors: list = bulk_indexer.close()
+        for index_error in index_errors:
+            job.add_error(index_error['error'], ref=index_error['ref'])
+        job.update(phase='catching up', force=True, rows_indexed=bulk_indexer.success_count)
+        if index_errors:
+            raise JobFailed(f"{len(index_errors)} antibodies could not be indexed")
+        marker, rows_caught_up = _catch_up(job, ubkg_api_url, new_index, marker)
+        job.update(phase='swapping alias', force=True, rows_caught_up=rows_caught_up)
+    except BaseException:
+        # The alias has not been moved, so searches are still served from the previous index.
+        logger.exception(f"Restoring Elastic Search index {new_index} failed or was cancelled; deleting it")
+        es_conn.indices.delete(index=new_index, ignore=[404])
+        raise
+    finally:
+        db_pool.putconn(conn)
+    swap_index_alias(es_conn, antibody_elasticsearch_index, new_index)
+    # Rows added between the catch-up and the swap were written to the previous index.
+    _, rows_caught_up_after_swap = _catch_up(job, ubkg_api_url, antibody_elasticsearch_index,
+                                             marker)
+    prune_versioned_indices(es_conn, antibody_elasticsearch_index)
+    job.update(phase='done', force=True, rows_caught_up=rows_caught_up + rows_caught_up_after_swap)
+    logger.info(f'Restored Elastic Search index {antibody_elasticsearch_index} from {new_index}')
+    return {'index': new_index, 'rows_indexed': bulk_indexer.success_count,
+            'rows_caught_up': rows_caught_up + rows_caught_up_after_swap}
+
+
+def _write_marker(cur) -> tuple:
+    """
+    (max id, timestamp) such that every row written after it has a greater id or a created_timestamp
+    no earlier than the timestamp.
+
+    Rows are only ever inserted, with the start of their transaction as their created_timestamp, or
+    given the next_version_id of a row inserted by the same transaction. So the timestamp is the
+    start of the oldest transaction still open, whose rows may commit later with an id lower than
+    those already seen.
     """
-    # Delete the index...
+    cur.execute('''
+        SELECT (SELECT COALESCE(MAX(id), 0) FROM antibodies),
+            LEAST(EXTRACT(epoch FROM NOW()), (
+                SELECT EXTRACT(epoch FROM MIN(xact_start)) FROM pg_stat_activity
+                WHERE datname = current_database()
+            ))
+    ''')
+    return tuple(cur.fetchone())
+
+
+def _catch_up(job, ubkg_api_url: str, index: str, marker: tuple) -> tuple:
+    """
+    Index into 'index' the rows written since the 'marker' (see _write_marker()), and the previous
+    versions that they link to. Returns the marker taken before they were read, and the number of
+    rows indexed.
+    """
+    max_id, since = marker
+    app = current_app._get_current_object()
+    bulk_indexer = BulkIndexer(index=index)
+    target_aliases: dict = {}
+    rows_read: int = 0
+    with pooled_connection(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            next_marker: tuple = _write_marker(cur)
+        with conn.cursor(name='catch_up_elasticsearch') as cur:
+            cur.itersize = current_app.config['RESTORE_FETCH_SIZE']
+            cur.execute(base_antibody_query() + '''
+                WHERE a.id > %(max_id)s OR a.created_timestamp >= %(since)s
+                    OR a.antibody_hubmap_id IN (
+                        SELECT previous_version_id FROM antibodies
+                        WHERE id > %(max_id)s OR created_timestamp >= %(since)s
+                    )
+                ORDER BY a.id ASC
+            ''', {'max_id': max_id, 'since': since})
+            for antibody_array in cur:
+                rows_read += 1
+                antibody: dict = base_antibody_query_result_to_json(antibody_array)
+                target_symbol: str = antibody['target_symbol']
+                if target_symbol not in target_aliases:
+                    target_aliases[target_symbol] = _target_aliases(app, job, ubkg_api_url,
+                                                                    target_symbol)
+                antibody['target_aliases'] = target_aliases[target_symbol]
+                bulk_indexer.index(antibody, ref=antibody['antibody_hubmap_id'])
+    index_errors: list = bulk_indexer.close()
+    for index_error in index_errors:
+        job.add_error(index_error['error'], ref=index_error['ref'])
+    if index_errors:
+        raise JobFailed(f"{len(index_errors)} antibodies could not be caught up")
+    logger.info(f'Caught up {rows_read} rows written since {marker} in index {index}')
+    return next_marker, rows_read
+
+
+def _reindex_elasticsearch(job, where: str, params: tuple, checksum: bool) -> dict:
+    """
+    Re-index the antibodies selected by the SQL condition 'where' (on the base_antibody_query() tables)
+    into the live index, so that correcting a few rows costs a few document writes rather than a rebuild.
+
+    With 'checksum' each row's document is compared with the one in the index, fetched RESTORE_FETCH_SIZE
+    at a time with _mget, and only those that differ or are missing are written. The 'target_aliases'
+    are left out of the comparison as they come from UBKG rather than the database. Documents are only
+    ever written, so a full restore is still needed to drop those of rows deleted from the database.
+    """
+    ubkg_api_url: str = current_app.config['UBKG_API_URL']
+    fetch_size: int = current_app.config['RESTORE_FETCH_SIZE']
+    alias_workers: int = current_app.config['RESTORE_ALIAS_WORKERS']
+    antibody_elasticsearch_index: str = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
+    es_conn = get_es_client()
+    logger.info(f'Re-indexing antibodies where {where} {params}; checksum: {checksum}')
+    db_pool = get_db_pool()
+    conn = db_pool.getconn(autocommit=False)
+    try:
+        job.update(phase='counting', index=antibody_elasticsearch_index)
+        with conn.cursor() as cur:
+            cur.execute(f'SELECT COUNT(*) FROM antibodies a WHERE {where}', params)
+            rows_total: int = cur.fetchone()[0]
+        job.update(phase='indexing', rows_total=rows_total, rows_read=0, rows_indexed=0,
+                   rows_unchanged=0, alias_lookups=0)
+
+        bulk_indexer = BulkIndexer()
+        target_aliases_futures: dict = {}
+        pending: collections.deque = collections.deque()
+        antibody_hubmap_ids_read: set = set()
+        rows_read: int = 0
+        rows_unchanged: int = 0
+        app = current_app._get_current_object()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=alias_workers) as executor:
+            with conn.cursor(name='reindex_elasticsearch') as cur:
+                cur.execute(base_antibody_query() + f' WHERE {where} ORDER BY a.id ASC', params)
+                while True:
+                    antibodies: list = [base_antibody_query_result_to_json(a) for a in cur.fetchmany(fetch_size)]
+                    if not antibodies:
+                        break
+                    rows_read += len(antibodies)
+                    antibody_hubmap_ids_read.update(a['antibody_hubmap_id'] for a in antibodies)
+                    if checksum:
+                        changed: list = _changed_antibodies(es_conn, antibody_elasticsearch_index, antibodies)
+                        rows_unchanged += len(antibodies) - len(changed)
+                        antibodies = changed
+                    for antibody in antibodies:
+                        target_symbol: str = antibody['target_symbol']
+                        if target_symbol not in target_aliases_futures:
+                            target_aliases_futures[target_symbol] = executor.submit(
+                                _target_aliases, app, job, ubkg_api_url, target_symbol
+                            )
+                        pending.append((antibody, target_aliases_futures[target_symbol]))
+                    _index_pending(bulk_indexer, pending, 0)
+                    job.update(rows_read=rows_read, rows_indexed=bulk_indexer.success_count,
+                               rows_unchanged=rows_unchanged, alias_lookups=len(target_aliases_futures))
+        index_errors: list = bulk_indexer.close()
+        for index_error in index_errors:
+            job.add_error(index_error['error'], ref=index_error['ref'])
+        job.update(phase='done', force=True, rows_indexed=bulk_indexer.success_count)
+    finally:
+        db_pool.putconn(conn)
+    if index_errors:
+        raise JobFailed(f"{len(index_errors)} antibodies could not be indexed")
+    result: dict = {'index': antibody_elasticsearch_index, 'rows_indexed': bulk_indexer.success_count,
+                    'rows_unchanged': rows_unchanged}
+    if len(params) == 1 and isinstance(params[0], list):
+        result['antibody_hubmap_ids_not_found'] = [i for i in params[0] if i not in antibody_hubmap_ids_read]
+    logger.info(f'Re-indexed antibodies where {where}: {result}')
+    return result
+
+
+def _changed_antibodies(es_conn, index: str, antibodies: list) -> list:
+    """
+    The 'antibodies' whose documents in 'index' are missing or differ from the ones that would be indexed now.
+    """
+    response: dict = es_conn.mget(
+        index=index, body={'ids': [es_doc_id(a['antibody_uuid']) for a in antibodies]},
+        _source_excludes='target_aliases'
+    )
+    indexed_checksums: dict = {
+        doc['_id']: _doc_checksum(doc['_source']) for doc in response['docs'] if doc.get('found')
+    }
+    return [a for a in antibodies
+            if indexed_checksums.get(es_doc_id(a['antibody_uuid'])) != _doc_checksum(antibody_to_es_doc(
+                {**a, 'target_aliases': None}))]
+
+
+def _doc_checksum(doc: dict) -> str:
+    source: dict = {k: v for k, v in doc.items() if k != 'target_aliases'}
+    return hashlib.sha256(json.dumps(source, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _target_aliases(app, job, ubkg_api_url: str, target_symbol: str) -> list:
+    """
+    Like validate_targets(), a comma delimited target_symbol has the aliases of each of its symbols.
+    """
+    target_aliases: list = []
     with app.app_context():
-        server: str = current_app.config['ELASTICSEARCH_SERVER']
-        ubkg_api_url: str = current_app.config['UBKG_API_URL']
-        es_conn = elasticsearch.Elasticsearch([server])
-
-        antibody_elasticsearch_index: str = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
-        print(f'Zeroing Elastic Search index {antibody_elasticsearch_index} on server {server}')
-        es_conn.indices.delete(index=antibody_elasticsearch_index, ignore=[400, 404])
-        es_conn.indices.create(index=antibody_elasticsearch_index)
-
-        print(f'Restoring Elastic Search index {antibody_elasticsearch_index} on server {server}')
-        cur = get_cursor(current_app)
-        cur.execute(base_antibody_query() + ' ORDER BY a.id ASC')
-        print(f'Rows retrieved: {cur.rowcount}')
-        results = []
-        for antibody_array in cur:
-            antibody: dict = base_antibody_query_result_to_json(antibody_array)
-            target_symbol: str = antibody['target_symbol']
-            ubkg_rest_url: str = f"{ubkg_api_url}/relationships/gene/{target_symbol}"
-            response = requests.get(ubkg_rest_url, headers={"Accept": "application/json"}, verify=False)
-            target_aliases: list = [target_symbol]
-            if response.status_code == 200:
-                response_json: dict = response.json()
+        for target in target_symbol.split(','):
+            target = target.strip()
+            target_aliases.append(target)
+            try:
+                status_code, response_json = get_gene_relationships(ubkg_api_url, target)
+            except requests.RequestException as e:
+                logger.error(f"Unable to look up target aliases for '{target}': {e}")
+                job.add_error(f"Unable to look up target aliases: {e}", ref=target)
+                continue
+            if status_code == 200:
                 target_aliases += response_json["symbol-alias"] + response_json["symbol-previous"]
-            antibody['target_aliases'] = target_aliases
-            index_antibody(antibody)
-        return make_response(jsonify(antibodies=results), 200)
\ No newline at end of file
+    return list(dict.fromkeys(target_aliases))
+
+
+def _index_pending(bulk_indexer, pending: collections.deque, keep: int) -> None:
+    """
+    Hand the oldest rows in 'pending' to the 'bulk_indexer', waiting for their target aliases,
+    until only 'keep' rows are left.
+    """
+    while len(pending) > keep:
+        antibody, target_aliases_future = pending.popleft()
+        antibody['target_aliases'] = target_aliases_future.result()
+        bulk_indexer.index(antibody, ref=antibody['antibody_hubmap_id'])
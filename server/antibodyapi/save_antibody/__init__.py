@@ -1,10 +1,13 @@
 from flask import abort, Blueprint, current_app, jsonify, make_response, request, session
 from psycopg2.errors import UniqueViolation #pylint: disable=no-name-in-module
 from antibodyapi.utils import (
-    find_or_create_vendor, get_cursor,
-    get_hubmap_uuid, insert_query, json_error
+    find_or_create_vendor,
+    insert_query, json_error
 )
+from antibodyapi.utils.db import pooled_connection
 from antibodyapi.utils.elasticsearch import index_antibody
+from antibodyapi.utils.hubmap_ids import mint_hubmap_ids
+from antibodyapi.utils.vendors import cache_vendors
 from antibodyapi.utils.decorators import require_avr_group
 
 save_antibody_blueprint = Blueprint('save_antibody', __name__)
@@ -32,20 +35,25 @@ def save_antibody():
             )
 
     app = current_app
-    cur = get_cursor(app)
-    antibody['vendor_id'] = find_or_create_vendor(cur, antibody['vendor'])
-    vendor_name = antibody['vendor']
-    del antibody['vendor']
-    hubmap_uuid_dict: dict = get_hubmap_uuid(app.config['UUID_API_URL'])
-    antibody['antibody_uuid'] = hubmap_uuid_dict.get('uuid')
-    antibody['antibody_hubmap_id'] = hubmap_uuid_dict.get('hubmap_id')
-    antibody['created_by_user_displayname'] = session['name']
-    antibody['created_by_user_email'] = session['email']
-    antibody['created_by_user_sub'] = session['sub']
-    antibody['group_uuid'] = '7e5d3aec-8a99-4902-ab45-f2e3335de8b4'
-    try:
-        cur.execute(insert_query(), antibody)
-        index_antibody(antibody | {'vendor_name': vendor_name})
-    except UniqueViolation:
-        abort(json_error('Antibody not unique', 400))
-    return make_response(jsonify(id=cur.fetchone()[0], uuid=antibody['antibody_uuid']), 201)
+    # A single id is minted directly, before a connection is taken: the reserve (see utils/hubmap_ids) would
+    # lock its table and could mint a whole batch, on a second connection, for this one antibody.
+    hubmap_uuid_dict: dict = mint_hubmap_ids(app.config['UUID_API_URL'], 1)[0]
+    vendors_found: dict = {}
+    with pooled_connection(autocommit=False) as conn, conn.cursor() as cur:
+        antibody['vendor_id'] = find_or_create_vendor(cur, antibody['vendor'], vendors_found)
+        vendor_name = antibody['vendor']
+        del antibody['vendor']
+        antibody['antibody_uuid'] = hubmap_uuid_dict.get('uuid')
+        antibody['antibody_hubmap_id'] = hubmap_uuid_dict.get('hubmap_id')
+        antibody['created_by_user_displayname'] = session['name']
+        antibody['created_by_user_email'] = session['email']
+        antibody['created_by_user_sub'] = session['sub']
+        antibody['group_uuid'] = '7e5d3aec-8a99-4902-ab45-f2e3335de8b4'
+        try:
+            cur.execute(insert_query(), antibody)
+            antibody_id: int = cur.fetchone()[0]
+            index_antibody(antibody | {'vendor_name': vendor_name})
+        except UniqueViolation:
+            abort(json_error('Antibody not unique', 400))
+    cache_vendors(vendors_found)
+    return make_response(jsonify(id=antibody_id, uuid=antibody['antibody_uuid']), 201)
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify
 from pathlib import Path
 import logging
+from antibodyapi.utils.search import search_backend_stats
 
 status_blueprint = Blueprint('status', __name__)
 logger = logging.getLogger(__name__)
@@ -11,6 +12,7 @@ def get_status():
     status_data = {
         # Use strip() to remove leading and trailing spaces, newlines, and tabs
         'version': (Path(__file__).absolute().parent.parent.parent / 'VERSION').read_text().strip(),
-        'build': (Path(__file__).absolute().parent.parent.parent / 'BUILD').read_text().strip()
+        'build': (Path(__file__).absolute().parent.parent.parent / 'BUILD').read_text().strip(),
+        'search': search_backend_stats()
     }
     return jsonify(status_data)
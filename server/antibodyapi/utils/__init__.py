@@ -5,9 +5,8 @@ from flask import abort, g, jsonify, make_response,  session
 from enum import IntEnum, unique
 from werkzeug.utils import secure_filename
 import psycopg2
-from psycopg2._psycopg import connection
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import logging
+from antibodyapi.utils.vendors import find_or_create_vendors
 from requests.packages.urllib3.exceptions import InsecureRequestWarning # pylint: disable=import-error
 
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning) # pylint: disable=no-member
@@ -156,57 +155,112 @@ def base_antibody_query_result_to_json(antibody) -> dict:
     return ant
 
 
-def find_or_create_vendor(cursor, vendor_name):
-    cursor.execute('SELECT id FROM vendors WHERE UPPER(vendor_name) = %s', (vendor_name.upper(),))
-    try:
-        return cursor.fetchone()[0]
-    except TypeError:
-        cursor.execute('INSERT INTO vendors (vendor_name) VALUES (%s) RETURNING id', (vendor_name,))
-        return cursor.fetchone()[0]
+# The fields of base_antibody_query_result_to_json() and the columns that they come from, for queries
+# that only select some of them (see projected_antibody_query()).
+ANTIBODY_FIELD_COLUMNS: dict = {
+    'antibody_uuid': 'a.antibody_uuid',
+    'antibody_hubmap_id': 'a.antibody_hubmap_id',
+    'protocol_doi': 'a.protocol_doi',
+    'uniprot_accession_number': 'a.uniprot_accession_number',
+    'target_symbol': 'a.target_symbol',
+    'rrid': 'a.rrid',
+    'host': 'a.host',
+    'clonality': 'a.clonality',
+    'clone_id': 'a.clone_id',
+    'vendor_name': 'v.vendor_name',
+    'catalog_number': 'a.catalog_number',
+    'lot_number': 'a.lot_number',
+    'recombinant': 'a.recombinant',
+    'organ': 'a.organ',
+    'method': 'a.method',
+    'author_orcids': 'a.author_orcids',
+    'hgnc_id': 'a.hgnc_id',
+    'isotype': 'a.isotype',
+    'concentration_value': 'a.concentration_value',
+    'dilution_factor': 'a.dilution_factor',
+    'conjugate': 'a.conjugate',
+    'tissue_preservation': 'a.tissue_preservation',
+    'cycle_number': 'a.cycle_number',
+    'fluorescent_reporter': 'a.fluorescent_reporter',
+    'manuscript_doi': 'a.manuscript_doi',
+    'vendor_affiliation': 'a.vendor_affiliation',
+    'organ_uberon_id': 'a.organ_uberon_id',
+    'antigen_retrieval': 'a.antigen_retrieval',
+    'omap_id': 'a.omap_id',
+    'created_by_user_displayname': 'a.created_by_user_displayname',
+    'created_by_user_email': 'a.created_by_user_email',
+    'created_by_user_sub': 'a.created_by_user_sub',
+    'group_uuid': 'a.group_uuid',
+    'previous_version_id': 'a.previous_version_id',
+    'next_version_id': 'a.next_version_id',
+    'previous_version_pdf_uuid': 'a.previous_version_pdf_uuid',
+    'previous_version_pdf_filename': 'a.previous_version_pdf_filename',
+    'senescence_specific': 'a.senescence_specific',
+    'cell_marker': 'a.cell_marker',
+    'segmentation_cell_membrane': 'a.segmentation_cell_membrane',
+    'taxon': 'a.taxon',
+    'recommended': 'a.recommended',
+    'avr_pdf_uuid': 'a.avr_pdf_uuid',
+    'avr_pdf_filename': 'a.avr_pdf_filename'
+}
+UUID_FIELDS: set = {'antibody_uuid', 'group_uuid', 'avr_pdf_uuid'}
+AVR_PDF_FIELDS: set = {'avr_pdf_uuid', 'avr_pdf_filename'}
+
+
+def projected_antibody_query(fields: list) -> str:
+    """
+    Like base_antibody_query() but selecting 'a.id' followed by only the columns of 'fields'
+    (names from ANTIBODY_FIELD_COLUMNS), e.g., for keyset pagination on 'a.id'.
+    """
+    columns: str = ', '.join(['a.id'] + [ANTIBODY_FIELD_COLUMNS[f] for f in fields])
+    return f'SELECT {columns}\nFROM antibodies a\nJOIN vendors v ON a.vendor_id = v.id\n'
+
+
+def projected_antibody_query_result_to_json(antibody, fields: list) -> dict:
+    """
+    The 'fields' of a row of projected_antibody_query() in the form of base_antibody_query_result_to_json(),
+    which leaves out the avr_pdf fields of an antibody without a pdf.
+    """
+    values: dict = dict(zip(fields, antibody[1:]))
+    has_pdf: bool = values.get('avr_pdf_uuid', values.get('avr_pdf_filename')) is not None
+    return {
+        field: value.replace('-', '') if field in UUID_FIELDS and value is not None else value
+        for field, value in values.items() if has_pdf or field not in AVR_PDF_FIELDS
+    }
+
+
+def find_or_create_vendor(cursor, vendor_name, found: dict = None):
+    return find_or_create_vendors(cursor, [vendor_name], found)[vendor_name]
 
 
 def get_cursor(app):
     """
-    Reuse an existing connection after testing to see that it still works.
-    If the connection is no longer valid, or was never established, then make one.
+    The connection of the app context is taken from the process's pool (see utils/db) the first time
+    that it is needed, and given back to the pool when the app context is torn down.
 
-    Return an error message and a status_code == 502 if there is a problem creating a connection,
+    Return an error message and a status_code == 502 if there is a problem getting a connection,
     otherwise return a cursor.
     """
-    host: str = app.config['DATABASE_HOST']
-    user: str = app.config['DATABASE_USER']
-    dbname: str = app.config['DATABASE_NAME']
-    password: str = app.config['DATABASE_PASSWORD']
-    if 'connection' in g:
-        # Test to see if the connection still works...
-        try:
-            # NOTE: connection.isolation_level no longer actually calls the database
-            cur = g.connection.cursor()
-            cur.execute('SELECT 1')
-            cur.close()
-        except psycopg2.OperationalError:
-            logger.error("Connectionn to PosgreSQL database is no longer valid")
-            g.connection = None
-    if 'connection' not in g or g.connection is None or g.connection.closed != 0:
-        # Have not connected or the connection is now broken or closed...
-        logger.info(f"Connecting to PosgreSQL database; host: {host}, user: {user}, dbname: {dbname}")
+    if g.get('connection') is None:
         try:
-            conn: connection = psycopg2.connect(host=host, user=user, dbname=dbname, password=password)
+            g.connection = app.extensions['db_pool'].getconn(autocommit=True)
         except psycopg2.Error as e:
             abort(json_error(f"Unable to connect to PosgreSQL database; error: {e}", 502))
-        logger.info("Successfully connected to PosgreSQL database")
-        g.connection = conn
-        g.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
     return g.connection.cursor()
 
 
-def get_file_uuid(ingest_api_url: str, upload_folder: str, antibody_uuid: str, file) -> str:
+def get_file_uuid(ingest_api_url: str, upload_folder: str, antibody_uuid: str, file, token: str = None) -> str:
+    """
+    Upload the AVR .pdf 'file' for the antibody. The user's 'token' is taken from the session unless it is given
+    (e.g., by an import job which runs outside of the request).
+    """
+    token = token or session['groups_access_token']
     filename = secure_filename(file.filename)
     file.save(os.path.join(upload_folder, filename))
     req = requests.post(
         '%s/file-upload' % (ingest_api_url,),
         headers={
-            'authorization': 'Bearer %s' % session['groups_access_token']
+            'authorization': 'Bearer %s' % token
         },
         files={'file':
             (
@@ -228,12 +282,12 @@ def get_file_uuid(ingest_api_url: str, upload_folder: str, antibody_uuid: str, f
     req2 = requests.post(
         '%s/file-commit' % (ingest_api_url,),
         headers={
-            'authorization': 'Bearer %s' % session['groups_access_token']
+            'authorization': 'Bearer %s' % token
         },
         json={
             'entity_uuid': antibody_uuid,
             'temp_file_id': temp_file_id,
-            'user_token': session['groups_access_token']
+            'user_token': token
         },
         verify=False
     )
@@ -297,44 +351,23 @@ def get_data_provider_groups(ingest_api_url: str):
     return data_provider_groups
 
 
-def get_hubmap_uuid(uuid_api_url: str) -> dict:
-    url: str = f'{uuid_api_url}/hmuuid'
-    req = requests.post(
-        url,
-        headers={
-            'Content-Type': 'application/json',
-            'authorization': 'Bearer %s' % session['groups_access_token']
-        },
-        json={'entity_type': 'AVR'},
-        verify=False
-    )
-    if req.status_code != 200:
-        abort(json_error(f"Error accessing '{url}'; status: {req.status_code}", 406))
-
-    logger.debug(f"get_hubmap_uuid(); url={url}; req.json={req.json()}")
-    return req.json()[0]
-
-
 def get_user_info(token):
     auth_token = token.by_resource_server['auth.globus.org']['access_token']
     auth_client = globus_sdk.AuthClient(authorizer=globus_sdk.AccessTokenAuthorizer(auth_token))
     return auth_client.oauth2_userinfo()
 
 
-def update_next_version_query():
+def update_next_versions_query():
+    """
+    For psycopg2.extras.execute_values() with (previous_version_id, next_version_id) rows.
+    """
     return '''
 UPDATE antibodies
-    SET next_version_id = %(next_version_id)s
-    WHERE antibody_hubmap_id = %(previous_version_id)s
+    SET next_version_id = v.next_version_id
+    FROM (VALUES %s) AS v (previous_version_id, next_version_id)
+    WHERE antibodies.antibody_hubmap_id = v.previous_version_id
 '''
 
-def fetch_previous_version_pdf_uuid_query():
-    return '''
-        SELECT avr_pdf_uuid, avr_pdf_filename
-        FROM antibodies
-        WHERE antibody_hubmap_id = %(previous_version_id)s
-    '''
-
 
 def insert_query():
     return '''
@@ -375,7 +408,12 @@ VALUES (
 '''
 
 
-def insert_query_with_avr_file_and_uuid():
+def bulk_insert_query():
+    """
+    insert_query() of many rows, with the 'avr_pdf_uuid' and 'avr_pdf_filename' of their .pdf files, for
+    psycopg2.extras.execute_values() to put the rows (each following bulk_insert_template()) in place of the '%s'.
+    Rows without a .pdf file have None for both.
+    """
     return '''
 INSERT INTO antibodies (
     antibody_uuid,
@@ -393,9 +431,14 @@ INSERT INTO antibodies (
     created_by_user_displayname, created_by_user_email,
     created_by_user_sub, group_uuid,
     previous_version_id, antibody_hubmap_id, previous_version_pdf_uuid, previous_version_pdf_filename,
-    senescence_specific, cell_marker, segmentation_cell_membrane, taxon, recommended 
-) 
-VALUES (
+    senescence_specific, cell_marker, segmentation_cell_membrane, taxon, recommended
+)
+VALUES %s
+'''
+
+
+def bulk_insert_template():
+    return '''(
     %(antibody_uuid)s,
     %(avr_pdf_uuid)s, %(avr_pdf_filename)s,
     %(protocol_doi)s, %(uniprot_accession_number)s,
@@ -412,8 +455,7 @@ VALUES (
     %(created_by_user_sub)s, %(group_uuid)s,
     %(previous_version_id)s, %(antibody_hubmap_id)s, %(previous_version_pdf_uuid)s, %(previous_version_pdf_filename)s,
     %(senescence_specific)s, %(cell_marker)s, %(segmentation_cell_membrane)s, %(taxon)s, %(recommended)s
-) RETURNING id
-'''
+)'''
 
 
 def json_error(message: str, error_code: int):
@@ -0,0 +1,158 @@
+import atexit
+import contextlib
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+from flask import current_app
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """
+    Raised when no connection became free within DATABASE_POOL_TIMEOUT seconds.
+    """
+
+
+class ConnectionPool:
+    """
+    The PostgreSQL connections shared by the threads of a process: at least DATABASE_POOL_MINCONN
+    are kept open, and at most DATABASE_POOL_MAXCONN are open at once. A thread that finds them all
+    in use waits for one to be returned.
+
+    A connection is only checked (with 'SELECT 1') when it has been idle for DATABASE_POOL_CHECK_IDLE
+    seconds, and one returned broken or in an unknown state is closed rather than reused.
+
+    Like the Elasticsearch client, the pool is built lazily and rebuilt whenever the process id changes,
+    because the connections of a pool inherited across a uWSGI fork belong to the parent.
+    """
+
+    def __init__(self, config):
+        self.connect_kwargs: dict = {
+            'host': config['DATABASE_HOST'],
+            'user': config['DATABASE_USER'],
+            'dbname': config['DATABASE_NAME'],
+            'password': config['DATABASE_PASSWORD']
+        }
+        self.minconn: int = config['DATABASE_POOL_MINCONN']
+        self.maxconn: int = config['DATABASE_POOL_MAXCONN']
+        self.check_idle: float = config['DATABASE_POOL_CHECK_IDLE']
+        self.timeout: float = config['DATABASE_POOL_TIMEOUT']
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._available = None
+        self._in_use: set = set()
+        self._returned_at: dict = {}
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        pid: int = os.getpid()
+        if self._pool is None or self._pid != pid:
+            with self._lock:
+                if self._pool is None or self._pid != pid:
+                    logger.info(f"Creating PostgreSQL connection pool for process {pid}; "
+                                f"host: {self.connect_kwargs['host']}, dbname: {self.connect_kwargs['dbname']}")
+                    # The parent's pool is dropped without closing it, as its sockets are still the parent's.
+                    self._pool = ThreadedConnectionPool(self.minconn, self.maxconn, **self.connect_kwargs)
+                    self._available = threading.BoundedSemaphore(self.maxconn)
+                    self._in_use = set()
+                    self._returned_at = {}
+                    self._pid = pid
+        return self._pool
+
+    def getconn(self, autocommit: bool = True):
+        pool = self._get_pool()
+        available = self._available
+        if not available.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No PostgreSQL connection became free within {self.timeout} seconds")
+        try:
+            conn = pool.getconn()
+            returned_at = self._returned_at.pop(id(conn), None)
+            if conn.closed != 0 or (returned_at is not None and time.monotonic() - returned_at > self.check_idle
+                                    and not _is_alive(conn)):
+                logger.info("Replacing a PostgreSQL connection that is no longer valid")
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+            conn.autocommit = autocommit
+        except BaseException:
+            available.release()
+            raise
+        self._in_use.add(id(conn))
+        return conn
+
+    def putconn(self, conn, close: bool = False) -> None:
+        if self._pool is None or self._pid != os.getpid() or id(conn) not in self._in_use:
+            # Taken from the pool of a parent process.
+            return
+        self._in_use.discard(id(conn))
+        try:
+            if not close and conn.closed == 0:
+                status: int = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        close = True
+            close = close or conn.closed != 0
+            if not close:
+                self._returned_at[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._available.release()
+
+    def closeall(self) -> None:
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+            self._pid = None
+
+
+def _is_alive(conn) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def init_app(app) -> None:
+    """
+    Called from create_app() so that the app owns the process wide connection pool.
+    """
+    db_pool = ConnectionPool(app.config)
+    app.extensions['db_pool'] = db_pool
+    atexit.register(db_pool.closeall)
+
+
+def get_db_pool() -> ConnectionPool:
+    return current_app.extensions['db_pool']
+
+
+@contextlib.contextmanager
+def pooled_connection(autocommit: bool = True, pool: ConnectionPool = None):
+    """
+    A connection from the pool for the duration of the 'with' block. Without 'autocommit'
+    the block is a transaction, committed at its end or rolled back on an exception.
+    """
+    pool = pool or get_db_pool()
+    conn = pool.getconn(autocommit=autocommit)
+    broken: bool = False
+    try:
+        yield conn
+        if not autocommit:
+            conn.commit()
+    except psycopg2.OperationalError:
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
@@ -61,6 +61,17 @@ def require_avr_group(param: str = "token", group_param: str = "group"):
   return decorator
 
 
+def is_data_admin():
+  """
+  Whether the token of the request is that of a member of one of the GROUP_ADMIN_IDS.
+  """
+  try:
+    _require_token(current_app.config['GROUP_ADMIN_IDS'].split(','))
+  except (HTTPException, globus_sdk.GroupsAPIError):
+    return False
+  return True
+
+
 def _require_token(config_group_ids):
   auth_header = request.headers.get('Authorization')
         
@@ -1,24 +1,159 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import uuid
 import elasticsearch
 from flask import current_app
-import requests
 import logging
+from typing import List
+
+try:
+    import uwsgi
+except ImportError:
+    # Not running under uWSGI (e.g., tests or the Flask development server).
+    uwsgi = None
 
 logging.basicConfig(format='[%(asctime)s] %(levelname)s in %(module)s:%(lineno)d: %(message)s',
                     level=logging.DEBUG, datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
 
+class SharedElasticsearchClient:
+    """
+    Owns the one Elasticsearch client (and so the one urllib3 connection pool) used by a process.
+
+    The client is built lazily on first use and rebuilt whenever the process id changes. uWSGI forks its
+    workers from the master after create_app() has run, and a client inherited across a fork would share
+    its sockets with the parent, so each worker must build its own.
+
+    It also keeps the IndexGeneration of the index in 'generation'.
+    """
+
+    def __init__(self, config):
+        self.hosts: list = [config['ELASTICSEARCH_SERVER']]
+        self.client_kwargs: dict = {
+            'maxsize': config['ELASTICSEARCH_POOL_MAXSIZE'],
+            'timeout': config['ELASTICSEARCH_TIMEOUT'],
+            'max_retries': config['ELASTICSEARCH_MAX_RETRIES'],
+            'retry_on_timeout': config['ELASTICSEARCH_RETRY_ON_TIMEOUT']
+        }
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+        self.generation = IndexGeneration(config['SEARCH_GENERATION_UWSGI_CACHE'])
+
+    def get(self) -> elasticsearch.Elasticsearch:
+        pid: int = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    logger.info(f"Creating Elasticsearch client for process {pid}; hosts: {self.hosts}")
+                    self._client = elasticsearch.Elasticsearch(self.hosts, **self.client_kwargs)
+                    self._pid = pid
+        return self._client
+
+    def close(self) -> None:
+        with self._lock:
+            # Only the process that built the client may close it, otherwise a worker shutting down
+            # would close sockets that still belong to its parent.
+            if self._client is not None and self._pid == os.getpid():
+                logger.info(f"Closing Elasticsearch client for process {self._pid}")
+                self._client.close()
+            self._client = None
+            self._pid = None
+
+
+class IndexGeneration:
+    """
+    A token that changes with every write to the index (see index_changed()), so that the search results
+    cached before it (see utils/search) are no longer used.
+
+    With 'uwsgi_cache' (the name of a uWSGI cache, see uwsgi.ini) it is kept in that cache, so that a write by
+    any worker of the node (including the imports and rebuilds that run as jobs) is seen by all of them.
+    Otherwise, or when not running under uWSGI, only the process that made the write sees it.
+    """
+    key: str = 'index_generation'
+
+    def __init__(self, uwsgi_cache: str = None):
+        self.uwsgi_cache: str = uwsgi_cache if uwsgi is not None else None
+        if uwsgi_cache is not None and uwsgi is None:
+            logger.info("Not running under uWSGI; the index generation is only seen by each process")
+        self._local: int = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        if self.uwsgi_cache is not None:
+            value = uwsgi.cache_get(self.key, self.uwsgi_cache)
+            return value.decode('utf-8') if value is not None else '0'
+        return str(self._local)
+
+    def change(self) -> None:
+        if self.uwsgi_cache is not None:
+            # An expiry of 0 keeps it until the next change.
+            uwsgi.cache_update(self.key, uuid.uuid4().hex.encode('utf-8'), 0, self.uwsgi_cache)
+            return
+        with self._lock:
+            self._local += 1
+
+
+def init_app(app) -> None:
+    """
+    Called from create_app() so that the app owns the process wide Elasticsearch client.
+    """
+    shared_client = SharedElasticsearchClient(app.config)
+    app.extensions['elasticsearch'] = shared_client
+    atexit.register(shared_client.close)
+
+
+def get_es_client() -> elasticsearch.Elasticsearch:
+    return current_app.extensions['elasticsearch'].get()
+
+
+def index_changed() -> None:
+    """
+    Called after every write to the index so that cached search results (see utils/search)
+    are no longer used.
+    """
+    current_app.extensions['elasticsearch'].generation.change()
+
+
+def index_generation() -> str:
+    return current_app.extensions['elasticsearch'].generation.get()
+
+
 def index_antibody(antibody: dict):
     """
     This will save the antibody information to Elastic Search.
 
-    It should be called within the code for the endpoint at server.save_antibody(),
-    and server.import_antibodies() after the antibody information is successfully saved
-    to the PostgreSQL database.
+    It should be called within the code for the endpoint at server.save_antibody()
+    after the antibody information is successfully saved to the PostgreSQL database.
+    Uploads of many antibodies should use a BulkIndexer instead.
     """
-    
-    es_conn = elasticsearch.Elasticsearch([current_app.config['ELASTICSEARCH_SERVER']])
+    es_conn = get_es_client()
     logger.info(f"*** Indexing: {antibody}")
+    doc: dict = antibody_to_es_doc(antibody)
+    antibody_elasticsearch_index: str = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
+    es_conn.index(index=antibody_elasticsearch_index, id=es_doc_id(antibody['antibody_uuid']), body=doc) # pylint: disable=unexpected-keyword-arg, no-value-for-parameter
+    index_changed()
+
+
+def es_doc_id(antibody_uuid: str) -> str:
+    """
+    The Elastic Search document '_id' of an antibody is its 'antibody_uuid' (without dashes, as it is
+    returned by the uuid-api) so that documents can be written, updated and read directly by id, and
+    indexing the same antibody twice replaces the document rather than duplicating it.
+    """
+    return str(antibody_uuid).replace('-', '')
+
+
+def antibody_to_es_doc(antibody: dict) -> dict:
+    """
+    Build the Elastic Search document for an antibody from the row saved in the database
+    plus the 'vendor_name' and 'target_aliases' which are not stored with the row.
+    """
     doc = {
         'antibody_uuid': antibody['antibody_uuid'],
         'antibody_hubmap_id': antibody['antibody_hubmap_id'],
@@ -65,85 +200,208 @@ def index_antibody(antibody: dict):
     if 'avr_pdf_uuid' in antibody and 'avr_pdf_filename' in antibody and antibody['avr_pdf_filename'] != '':
         doc['avr_pdf_uuid'] = antibody['avr_pdf_uuid']
         doc['avr_pdf_filename'] = antibody['avr_pdf_filename']
-    logger.info(f"antibody: {antibody}")
-    antibody_elasticsearch_index: str = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
-    es_conn.index(index=antibody_elasticsearch_index, body=doc) # pylint: disable=unexpected-keyword-arg, no-value-for-parameter
+    return doc
 
 
-def update_next_version_es(antibody_hubmap_id: str, next_version_id: str):
-    es_conn = elasticsearch.Elasticsearch([current_app.config['ELASTICSEARCH_SERVER']])
-    antibody_elasticsearch_index = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
+class BulkIndexer:
+    """
+    Collects antibody documents and 'next_version_id' partial updates and sends them to
+    Elastic Search through the _bulk API rather than with one request per antibody.
 
-    logger.info(f"*** Updating next_version_id for antibody_hubmap_id={antibody_hubmap_id} to {next_version_id}")
+    A batch is sent whenever it reaches ELASTICSEARCH_BULK_MAX_ACTIONS actions or ELASTICSEARCH_BULK_MAX_BYTES
+    bytes, and close() sends whatever is left and refreshes the index once. Each action carries a 'ref'
+    (e.g., the TSV row number) so that the failures collected in 'errors' can be reported against it.
 
-    try:
-        search_result = es_conn.search(
-            index=antibody_elasticsearch_index,
-            body={
-                "query": {
-                    "term": {
-                        "antibody_hubmap_id.keyword": antibody_hubmap_id
-                    }
-                },
-                "_source": False 
-            }
-        )
-        hits = search_result.get("hits", {}).get("hits", [])
-        if not hits:
-            logger.warning(f"No document found for antibody_hubmap_id={antibody_hubmap_id}")
+    It must be used within an application context.
+    """
+
+    def __init__(self, index: str = None, refresh: bool = True):
+        self.es_conn = get_es_client()
+        self.index_name: str = index or current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
+        self.max_actions: int = current_app.config['ELASTICSEARCH_BULK_MAX_ACTIONS']
+        self.max_bytes: int = current_app.config['ELASTICSEARCH_BULK_MAX_BYTES']
+        self.refresh: bool = refresh
+        self.errors: List[dict] = []
+        self.success_count: int = 0
+        self._lines: List[str] = []
+        self._refs: list = []
+        self._bytes: int = 0
+
+    def index(self, antibody: dict, ref=None) -> None:
+        self._add({'index': {'_index': self.index_name, '_id': es_doc_id(antibody['antibody_uuid'])}},
+                  antibody_to_es_doc(antibody), ref)
+
+    def update_next_version(self, antibody_uuid: str, next_version_id: str, ref=None) -> None:
+        self._add({'update': {'_index': self.index_name, '_id': es_doc_id(antibody_uuid)}},
+                  {'doc': {'next_version_id': next_version_id}}, ref)
+
+    def flush(self) -> None:
+        self._send()
+
+    def close(self) -> List[dict]:
+        """
+        Send anything still queued, refresh the index once, and return the errors for all batches.
+        """
+        self.flush()
+        if self.refresh and self.success_count > 0:
+            self.es_conn.indices.refresh(index=self.index_name)
+        if self.success_count > 0:
+            index_changed()
+        return self.errors
+
+    def _add(self, action: dict, source: dict, ref) -> None:
+        lines: str = json.dumps(action) + '\n' + json.dumps(source) + '\n'
+        size: int = len(lines.encode('utf-8'))
+        if self._lines and self._bytes + size > self.max_bytes:
+            self._send()
+        self._lines.append(lines)
+        self._refs.append(ref)
+        self._bytes += size
+        if len(self._lines) >= self.max_actions:
+            self._send()
+
+    def _send(self) -> None:
+        if not self._lines:
+            return
+        body: str = ''.join(self._lines)
+        refs: list = self._refs
+        self._lines, self._refs, self._bytes = [], [], 0
+        logger.info(f"BulkIndexer: sending {len(refs)} actions to index {self.index_name}")
+        try:
+            response: dict = self.es_conn.bulk(body=body, index=self.index_name, refresh=False)
+        except elasticsearch.ElasticsearchException as e:
+            logger.error(f"BulkIndexer: bulk request failed: {e}")
+            self.errors += [{'ref': ref, 'action': None, 'error': str(e)} for ref in refs]
             return
+        for ref, item in zip(refs, response.get('items', [])):
+            action, result = next(iter(item.items()))
+            if 'error' in result:
+                logger.error(f"BulkIndexer: {action} failed for {ref}: {result['error']}")
+                self.errors.append({'ref': ref, 'action': action, 'error': result['error']})
+            else:
+                self.success_count += 1
 
-        doc_id = hits[0]["_id"]
 
-        update_body = {
-            'doc': {
-                'next_version_id': next_version_id
-            }
-        }
+# The suffix of the physical indices that an alias is rebuilt into, and the one (older than any rebuild) given
+# to the copy kept of a physical index that had the alias's name before the first rebuild.
+VERSIONED_INDEX_TIMESTAMP: str = '%Y%m%d%H%M%S'
+ORIGINAL_INDEX_TIMESTAMP: str = '00000000000000'
 
-        es_conn.update(
-            index=antibody_elasticsearch_index,
-            id=doc_id,
-            body=update_body
-        )
 
-        logger.info(f"Successfully updated doc {doc_id} with next_version_id={next_version_id}")
+def versioned_index_pattern(alias: str) -> re.Pattern:
+    return re.compile(re.escape(alias) + r'_\d{14}')
 
-    except Exception as e:
-        logger.error(f"Failed to update next_version_id for {antibody_hubmap_id}: {str(e)}")
 
+def create_versioned_index(es_conn, alias: str) -> str:
+    """
+    Create a new physical index for a rebuild of the index read through 'alias'.
+
+    The index is named after the alias plus a timestamp, and is created without replicas and with
+    refresh disabled so that it can be loaded as fast as possible. It is not visible to searches
+    until swap_index_alias() is called.
+    """
+    index_name: str = f"{alias}_{time.strftime(VERSIONED_INDEX_TIMESTAMP, time.gmtime())}"
+    logger.info(f"Creating index {index_name} for alias {alias}")
+    es_conn.indices.create(
+        index=index_name,
+        body={'settings': {'index': {'number_of_replicas': 0, 'refresh_interval': '-1'}}}
+    )
+    return index_name
 
-def execute_query_elasticsearch_directly(query):
-    es_conn = elasticsearch.Elasticsearch([current_app.config['ELASTICSEARCH_SERVER']])
 
-    # Return the elasticsearch resulting json data as json string
-    antibody_elasticsearch_index: str = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
-    return es_conn.search(index=antibody_elasticsearch_index, body=query)
+def swap_index_alias(es_conn, alias: str, index_name: str) -> None:
+    """
+    Make the fully loaded 'index_name' the one read through 'alias'.
 
+    Replicas and refresh are turned back on and the index refreshed before the alias is moved over
+    in a single atomic update, so searches see either the old index or the complete new one.
+    The previous index is kept (see prune_versioned_indices()) so that the alias can be moved back.
+    """
+    es_conn.indices.put_settings(
+        index=index_name,
+        body={'index': {
+            'number_of_replicas': current_app.config['ELASTICSEARCH_INDEX_REPLICAS'],
+            'refresh_interval': current_app.config['ELASTICSEARCH_INDEX_REFRESH_INTERVAL']
+        }}
+    )
+    es_conn.indices.refresh(index=index_name)
 
-def execute_query_through_search_api(query):
-    # SEARCHAPI_BASE_URL, and ANTIBODY_ELASTICSEARCH_INDEX should be defined in the Flask app.cfg file.
-    # TODO: The reference to SEARCH_API_BASE in the config file seems to be breaking things?!
-    searchapi_base_url: str = current_app.config['SEARCH_API_BASE'].rstrip("/")
-    antibody_elasticsearch_index: str = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
-    # https://smart-api.info/ui/7aaf02b838022d564da776b03f357158#/search_by_index/search-post-by-index
-    url: str = f"{searchapi_base_url}/{antibody_elasticsearch_index}/search"
-    logger.info(f'execute_query_through_search_api() URL: {url}')
-    response = requests.post(url, headers={"Content-Type": "application/json"}, json=query)
-
-    if response.status_code != 200:
-        logger.error(f"The search-api has returned status_code {response.status_code}: {response.text}")
-        raise requests.exceptions.RequestException(response.text)
-
-    return response.json()
-
-
-def execute_query(query):
-    logger.debug(f"*** Elastic Search Query: {query}")
-    query_directly: str = current_app.config['QUERY_ELASTICSEARCH_DIRECTLY']
-    result: dict = {}
-    if query_directly is True:
-        result = execute_query_elasticsearch_directly(query)
-    result = execute_query_through_search_api(query)
-    #logger.info(f"execute_query: result = {result}")
-    return result
+    actions: list = []
+    original: bool = False
+    if es_conn.indices.exists_alias(name=alias):
+        for old_index_name in es_conn.indices.get_alias(name=alias):
+            actions.append({'remove': {'index': old_index_name, 'alias': alias}})
+    elif es_conn.indices.exists(index=alias):
+        # Before the first versioned rebuild the index was a physical index with the alias's name,
+        # and it must go in the same update for the alias to take its name. A copy of it is kept first,
+        # as the previous index, so that the alias can still be moved back to it.
+        original = True
+        copy_original_index(es_conn, alias)
+        logger.info(f"Replacing physical index {alias} with an alias")
+        actions.append({'remove_index': {'index': alias}})
+    actions.append({'add': {'index': index_name, 'alias': alias}})
+    try:
+        es_conn.indices.update_aliases(body={'actions': actions})
+    except elasticsearch.ElasticsearchException:
+        if original:
+            es_conn.indices.put_settings(index=alias, body={'index': {'blocks': {'write': False}}})
+        raise
+    index_changed()
+    logger.info(f"Alias {alias} now points to index {index_name}")
+
+
+def copy_original_index(es_conn, alias: str) -> str:
+    """
+    Clone the physical index named 'alias' into a versioned index that sorts before those of every rebuild.
+
+    The original index is write blocked for the clone (as Elasticsearch requires), and stays so until it is
+    replaced by the alias. The copy is not.
+    """
+    index_name: str = f"{alias}_{ORIGINAL_INDEX_TIMESTAMP}"
+    logger.info(f"Copying physical index {alias} to {index_name}")
+    es_conn.indices.put_settings(index=alias, body={'index': {'blocks': {'write': True}}})
+    es_conn.indices.delete(index=index_name, ignore=[404])
+    es_conn.indices.clone(index=alias, target=index_name,
+                          body={'settings': {'index': {'blocks': {'write': False}}}})
+    return index_name
+
+
+def prune_versioned_indices(es_conn, alias: str) -> None:
+    """
+    Delete the versioned indices of 'alias' that are older than the ELASTICSEARCH_INDEX_KEEP_PREVIOUS
+    most recent ones that it no longer points to.
+    """
+    keep_previous: int = current_app.config['ELASTICSEARCH_INDEX_KEEP_PREVIOUS']
+    aliased: list = list(es_conn.indices.get_alias(name=alias)) if es_conn.indices.exists_alias(name=alias) else []
+    # Only names made by create_versioned_index() or copy_original_index(), not e.g. f"{alias}_backup".
+    pattern: re.Pattern = versioned_index_pattern(alias)
+    previous: list = sorted((index_name for index_name in es_conn.indices.get(index=f"{alias}_*")
+                             if pattern.fullmatch(index_name) and index_name not in aliased), reverse=True)
+    for index_name in previous[keep_previous:]:
+        logger.info(f"Deleting old index {index_name} of alias {alias}")
+        es_conn.indices.delete(index=index_name, ignore=[404])
+
+
+def update_next_version_es(antibody_uuid: str, next_version_id: str):
+    es_conn = get_es_client()
+    antibody_elasticsearch_index = current_app.config['ANTIBODY_ELASTICSEARCH_INDEX']
+
+    logger.info(f"*** Updating next_version_id for antibody_uuid={antibody_uuid} to {next_version_id}")
+
+    try:
+        es_conn.update(
+            index=antibody_elasticsearch_index,
+            id=es_doc_id(antibody_uuid),
+            body={
+                'doc': {
+                    'next_version_id': next_version_id
+                }
+            }
+        )
+        index_changed()
+        logger.info(f"Successfully updated doc {es_doc_id(antibody_uuid)} with next_version_id={next_version_id}")
+
+    except elasticsearch.NotFoundError:
+        logger.warning(f"No document found for antibody_uuid={antibody_uuid}")
+    except Exception as e:
+        logger.error(f"Failed to update next_version_id for {antibody_uuid}: {str(e)}")
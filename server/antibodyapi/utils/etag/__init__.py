@@ -0,0 +1,75 @@
+import hashlib
+import psycopg2
+from flask import current_app, make_response, request
+from werkzeug.exceptions import HTTPException
+from antibodyapi.utils import get_cursor
+import logging
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION_QUERY: str = '''
+SELECT
+    (SELECT MAX(id) FROM antibodies),
+    (SELECT MAX(created_timestamp) FROM antibodies),
+    write_count
+FROM catalog_version
+'''
+
+
+def catalog_version():
+    """
+    A version of the catalog which changes with every committed write to the antibodies or vendors,
+    from the newest antibody and the 'catalog_version' write count kept by triggers (see modify_4.sql).
+    It is None if the version cannot be read, in which case responses are just sent without an ETag.
+    """
+    try:
+        cur = get_cursor(current_app)
+        try:
+            cur.execute(CATALOG_VERSION_QUERY)
+            row = cur.fetchone()
+        finally:
+            cur.close()
+    except (HTTPException, psycopg2.Error) as e:
+        logger.error(f"Unable to read the catalog version: {e}")
+        return None
+    if row is None:
+        return None
+    max_id, max_created_timestamp, write_count = row
+    return f"{max_id}.{max_created_timestamp}.{write_count}"
+
+
+def catalog_etag(*representation):
+    """
+    The ETag of a response built from the catalog, which also depends on the 'representation' (e.g., the
+    query and format) so that different responses never share one.
+    """
+    version = catalog_version()
+    if version is None:
+        return None
+    return digest_etag(version, *representation)
+
+
+def digest_etag(*parts) -> str:
+    """
+    An ETag that is a hash of the 'parts'.
+    """
+    return hashlib.sha256('\n'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:32]
+
+
+def not_modified(etag: str):
+    """
+    A 304 response if the request's If-None-Match has the 'etag', otherwise None.
+
+    Responses have no Last-Modified (and so If-Modified-Since is not used) as it only has a resolution
+    of a second, while the catalog could change twice within one.
+    """
+    if etag is None or not request.if_none_match.contains(etag):
+        return None
+    return add_validators(make_response('', 304), etag)
+
+
+def add_validators(response, etag: str):
+    if etag is not None:
+        response.set_etag(etag)
+        response.vary.add('Accept')
+    return response
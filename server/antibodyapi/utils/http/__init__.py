@@ -0,0 +1,33 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import logging
+
+logger = logging.getLogger(__name__)
+
+_sessions: dict = {}
+_sessions_lock = threading.Lock()
+
+
+def get_http_session(name: str, pool_maxsize: int = 10) -> requests.Session:
+    """
+    Return the keep-alive requests.Session called 'name' for this process, creating it if needed.
+
+    Sessions are per process (like the Elasticsearch client) because one inherited across a uWSGI
+    fork would share its sockets with the parent. 'pool_maxsize' should be at least the number of
+    threads that use the session at once, otherwise connections are thrown away rather than reused.
+    """
+    key: tuple = (os.getpid(), name)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                logger.info(f"Creating HTTP session '{name}' for process {key[0]}; pool_maxsize: {pool_maxsize}")
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[key] = session
+    return session
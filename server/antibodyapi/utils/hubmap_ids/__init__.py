@@ -0,0 +1,74 @@
+from flask import abort, current_app, session
+from psycopg2.extras import execute_values
+from antibodyapi.utils.db import pooled_connection
+from antibodyapi.utils.http import get_http_session
+from antibodyapi.utils.validation import json_error
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def mint_hubmap_ids(uuid_api_url: str, count: int, token: str = None) -> list:
+    """
+    Have the uuid-api mint 'count' new AVR ids as a list of {'uuid': ..., 'hubmap_id': ...}, asking for up to
+    UUID_API_BATCH_SIZE of them at a time with 'entity_count'. Should the service return fewer than were asked
+    for, it is asked again for the rest.
+
+    The user's 'token' is taken from the session unless it is given.
+    """
+    token = token or session['groups_access_token']
+    url: str = f'{uuid_api_url}/hmuuid'
+    batch_size: int = current_app.config['UUID_API_BATCH_SIZE']
+    http = get_http_session('uuid-api')
+    hubmap_ids: list = []
+    while len(hubmap_ids) < count:
+        entity_count: int = min(batch_size, count - len(hubmap_ids))
+        response = http.post(
+            url,
+            params={'entity_count': entity_count},
+            headers={
+                'Content-Type': 'application/json',
+                'authorization': 'Bearer %s' % token
+            },
+            json={'entity_type': 'AVR'},
+            timeout=current_app.config['UUID_API_TIMEOUT'],
+            verify=False
+        )
+        if response.status_code != 200:
+            abort(json_error(f"Error accessing '{url}'; status: {response.status_code}", 406))
+        minted: list = response.json()
+        if len(minted) == 0:
+            abort(json_error(f"Error accessing '{url}'; no ids were returned", 406))
+        logger.debug(f"mint_hubmap_ids(); url={url}; entity_count={entity_count}; minted {len(minted)}")
+        hubmap_ids += [{'uuid': m['uuid'], 'hubmap_id': m['hubmap_id']} for m in minted[:entity_count]]
+    return hubmap_ids
+
+
+def _add_to_reserve(hubmap_ids: list) -> None:
+    # On a connection of its own, so that the ids are kept whatever becomes of the transaction that wants them.
+    with pooled_connection() as conn, conn.cursor() as cur:
+        execute_values(cur, 'INSERT INTO hubmap_id_reserve (uuid, hubmap_id) VALUES %s ON CONFLICT DO NOTHING',
+                       [(i['uuid'], str(i['hubmap_id'])) for i in hubmap_ids])
+
+
+def reserve_hubmap_ids(cur, count: int, uuid_api_url: str, token: str = None) -> list:
+    """
+    Take 'count' ids (see mint_hubmap_ids()) from the 'hubmap_id_reserve' table within the transaction of 'cur',
+    minting those that are missing into the table first. The ids are only used up when the transaction commits;
+    should it roll back they stay in the table for the next import, rather than being lost.
+    """
+    hubmap_ids: list = []
+    while len(hubmap_ids) < count:
+        # SKIP LOCKED leaves the ids taken by imports that have not committed yet to them.
+        cur.execute('''
+            DELETE FROM hubmap_id_reserve WHERE id IN (
+                SELECT id FROM hubmap_id_reserve ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, uuid, hubmap_id
+        ''', (count - len(hubmap_ids),))
+        # The uuid column gives the uuid with dashes, but the uuid-api (and so every antibody_uuid) has none.
+        hubmap_ids += [{'uuid': str(uuid).replace('-', ''), 'hubmap_id': hubmap_id}
+                       for _, uuid, hubmap_id in sorted(cur.fetchall())]
+        if len(hubmap_ids) < count:
+            _add_to_reserve(mint_hubmap_ids(uuid_api_url, count - len(hubmap_ids), token))
+    return hubmap_ids
@@ -0,0 +1,353 @@
+import concurrent.futures
+import os
+import threading
+import time
+import uuid
+import zlib
+import psycopg2
+from psycopg2.extras import Json
+from flask import current_app
+from antibodyapi.utils.db import get_db_pool, pooled_connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES: tuple = ('queued', 'running')
+
+# The error recorded for a job left active by a process that is gone.
+INTERRUPTED_ERROR: dict = {
+    'ref': None, 'error': 'The job was interrupted (e.g., by a restart) and did not finish'
+}
+
+_executors: dict = {}
+_executors_lock = threading.Lock()
+
+# The ids of the jobs queued or running in each process, and the threads keeping up their heartbeat.
+_live_jobs: dict = {}
+_heartbeats: dict = {}
+_live_jobs_lock = threading.Lock()
+
+
+class JobAlreadyRunning(Exception):
+    """
+    Raised by start_job() when an exclusive job of the same kind is already running in any worker.
+    """
+    def __init__(self, job_id):
+        super().__init__(f"Job {job_id} is already running")
+        self.job_id = job_id
+
+
+class JobCancelled(Exception):
+    """
+    Raised from Job.update() when a cancel of the job has been requested, to stop the job's work.
+    """
+
+
+class JobFailed(Exception):
+    """
+    Raised by a job's target when it fails for a reason that it has already recorded with Job.add_error().
+    """
+
+
+class Job:
+    """
+    A long running task run in a background thread. Its state is kept in the 'jobs' table so that
+    whichever uWSGI worker receives a status request can report it.
+
+    The job holds a pooled database connection for its whole run (a queued job only takes one once it
+    starts). Progress is written at most every JOB_PROGRESS_INTERVAL seconds, and each write also picks
+    up any cancel request.
+
+    Until it finishes its process also renews its heartbeat_timestamp (see _beat()), which is how
+    start_job() tells a job orphaned by a restart from one that is still running.
+    """
+
+    def __init__(self, db_pool, conn, job_id: str, kind: str):
+        self.db_pool = db_pool
+        self.conn = conn
+        self.job_id: str = job_id
+        self.kind: str = kind
+        self.progress_interval: float = current_app.config['JOB_PROGRESS_INTERVAL']
+        self.max_errors: int = current_app.config['JOB_MAX_ERRORS']
+        self.phase: str = None
+        self.progress: dict = {}
+        self.errors: list = []
+        self.error_count: int = 0
+        self.cancel_requested: bool = False
+        self._written_at: float = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, phase: str = None, force: bool = False, **progress) -> None:
+        """
+        Record the 'phase' and 'progress' counters of the job, raising JobCancelled if a cancel was requested.
+        """
+        with self._lock:
+            if phase is not None:
+                self.phase = phase
+            self.progress.update(progress)
+            if force or phase is not None or time.monotonic() - self._written_at >= self.progress_interval:
+                self._write()
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def add_error(self, error, ref=None) -> None:
+        with self._lock:
+            self.error_count += 1
+            if len(self.errors) < self.max_errors:
+                self.errors.append({'ref': ref, 'error': error})
+
+    def finish(self, status: str, result=None) -> None:
+        with self._lock:
+            self.progress['error_count'] = self.error_count
+            with self.conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE jobs
+                    SET status = %s, phase = %s, progress = %s, errors = %s, result = %s,
+                        finished_timestamp = EXTRACT(epoch FROM NOW())
+                    WHERE job_id = %s
+                ''', (status, self.phase, Json(self.progress), Json(self.errors), Json(result), self.job_id))
+        logger.info(f"Job {self.kind} {self.job_id} finished with status '{status}'")
+
+    def close(self) -> None:
+        if self.conn is not None:
+            _release_connection(self.db_pool, self.conn)
+
+    def _write(self) -> None:
+        self.progress['error_count'] = self.error_count
+        with self.conn.cursor() as cur:
+            cur.execute('''
+                UPDATE jobs SET status = 'running', phase = %s, progress = %s, errors = %s
+                WHERE job_id = %s
+                RETURNING cancel_requested
+            ''', (self.phase, Json(self.progress), Json(self.errors), self.job_id))
+            self.cancel_requested = cur.fetchone()[0]
+        self._written_at = time.monotonic()
+
+
+def _release_connection(db_pool, conn) -> None:
+    # The advisory lock of an exclusive job belongs to the session, so it is released before the
+    # connection goes back to the pool (or with the connection should it have been lost).
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_unlock_all()')
+    except psycopg2.Error as e:
+        logger.error(f"Unable to release the advisory locks of a job: {e}")
+        db_pool.putconn(conn, close=True)
+        return
+    db_pool.putconn(conn)
+
+
+def _get_executor(kind: str, workers: int) -> concurrent.futures.ThreadPoolExecutor:
+    # Like the HTTP sessions (see utils/http) the pools are per process, as threads do not survive a fork.
+    key: tuple = (os.getpid(), kind)
+    executor = _executors.get(key)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(key)
+            if executor is None:
+                logger.info(f"Creating a pool of {workers} workers for {kind} jobs in process {key[0]}")
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=kind)
+                _executors[key] = executor
+    return executor
+
+
+def _add_live_job(app, job_id: str) -> None:
+    pid: int = os.getpid()
+    with _live_jobs_lock:
+        _live_jobs.setdefault(pid, set()).add(job_id)
+        if pid not in _heartbeats:
+            _heartbeats[pid] = threading.Thread(target=_beat, args=(app, pid), daemon=True)
+            _heartbeats[pid].start()
+
+
+def _remove_live_job(job_id: str) -> None:
+    with _live_jobs_lock:
+        _live_jobs.get(os.getpid(), set()).discard(job_id)
+
+
+def _beat(app, pid: int) -> None:
+    # Every JOB_HEARTBEAT_INTERVAL seconds the heartbeat_timestamp of the jobs still live in this
+    # process is renewed, whatever they are doing, and the thread stops once there are none left.
+    interval: float = app.config['JOB_HEARTBEAT_INTERVAL']
+    while True:
+        time.sleep(interval)
+        with _live_jobs_lock:
+            job_ids: tuple = tuple(_live_jobs.get(pid, ()))
+            if not job_ids:
+                del _heartbeats[pid]
+                return
+        try:
+            with app.app_context(), pooled_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    'UPDATE jobs SET heartbeat_timestamp = EXTRACT(epoch FROM NOW()) '
+                    'WHERE job_id IN %s', (job_ids,)
+                )
+        except psycopg2.Error as e:
+            logger.error(f"Unable to record the heartbeat of jobs {job_ids}: {e}")
+
+
+def _fail_orphaned_jobs(cur, kind: str = None) -> None:
+    """
+    Mark as failed the active jobs whose process is gone: all of those of 'kind' if it is given
+    (the caller holding its advisory lock), and otherwise those of any kind that have had no
+    heartbeat for JOB_ORPHANED_AFTER seconds.
+    """
+    if kind is not None:
+        condition, params = 'kind = %s', (kind,)
+    else:
+        condition = \
+            'COALESCE(heartbeat_timestamp, created_timestamp) < EXTRACT(epoch FROM NOW()) - %s'
+        params = (current_app.config['JOB_ORPHANED_AFTER'],)
+    cur.execute(f'''
+        UPDATE jobs
+        SET status = 'failed', errors = errors || %s, finished_timestamp = EXTRACT(epoch FROM NOW())
+        WHERE status IN %s AND {condition}
+        RETURNING kind, job_id
+    ''', (Json([INTERRUPTED_ERROR]), ACTIVE_STATUSES) + params)
+    for orphaned_kind, job_id in cur.fetchall():
+        logger.warning(f"Job {orphaned_kind} {job_id} was interrupted; marking it failed")
+
+
+def start_job(kind: str, target, *args, exclusive: bool = False, workers: int = None,
+              created_by_user_sub: str = None) -> str:
+    """
+    Record a new job of 'kind' and run 'target(job, *args)' for it in a background thread within
+    an application context. Whatever 'target' returns is saved as the job's result.
+    The 'created_by_user_sub' of the user who started it is kept, so that its status can be limited
+    to them.
+
+    An 'exclusive' job holds a PostgreSQL advisory lock for the kind while it runs, so only one
+    can run at a time across all workers and servers; JobAlreadyRunning is raised otherwise.
+    Jobs of any kind that were left active by a process that is gone are marked failed first.
+
+    Otherwise, with 'workers' the job runs on a pool of that many threads for the kind in this process,
+    and it stays 'queued' until one of them is free.
+    """
+    app = current_app._get_current_object()
+    db_pool = get_db_pool()
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            if exclusive:
+                cur.execute('SELECT pg_try_advisory_lock(%s)', (zlib.crc32(kind.encode('utf-8')),))
+                if not cur.fetchone()[0]:
+                    cur.execute('''
+                        SELECT job_id FROM jobs WHERE kind = %s AND status IN %s
+                        ORDER BY created_timestamp DESC LIMIT 1
+                    ''', (kind, ACTIVE_STATUSES))
+                    running = cur.fetchone()
+                    raise JobAlreadyRunning(running[0] if running is not None else None)
+                # Holding the lock means that no other job of this kind is running, so any
+                # still marked as active were interrupted (e.g., by a restart).
+                _fail_orphaned_jobs(cur, kind)
+            # Jobs of other kinds can only be told apart from live ones by their heartbeat.
+            _fail_orphaned_jobs(cur)
+            job_id: str = uuid.uuid4().hex
+            cur.execute('''
+                INSERT INTO jobs (
+                    job_id, kind, status, created_by_user_sub, created_timestamp, heartbeat_timestamp
+                )
+                VALUES (%s, %s, 'queued', %s, EXTRACT(epoch FROM NOW()), EXTRACT(epoch FROM NOW()))
+            ''', (job_id, kind, created_by_user_sub))
+        if workers is not None and not exclusive:
+            # The connection is not held while the job waits in the queue.
+            _release_connection(db_pool, conn)
+            conn = None
+        job = Job(db_pool, conn, job_id, kind)
+    except BaseException:
+        if conn is not None:
+            _release_connection(db_pool, conn)
+        raise
+    _add_live_job(app, job_id)
+    if conn is None:
+        _get_executor(kind, workers).submit(_run_job, app, job, target, args)
+    else:
+        threading.Thread(target=_run_job, args=(app, job, target, args), daemon=True).start()
+    logger.info(f"Job {kind} {job_id} started")
+    return job_id
+
+
+def _run_job(app, job: Job, target, args: tuple) -> None:
+    try:
+        _run_job_in_context(app, job, target, args)
+    finally:
+        _remove_live_job(job.job_id)
+
+
+def _run_job_in_context(app, job: Job, target, args: tuple) -> None:
+    with app.app_context():
+        if job.conn is None:
+            try:
+                job.conn = job.db_pool.getconn()
+            except psycopg2.Error:
+                logger.exception(f"Job {job.kind} {job.job_id} could not get a database connection")
+                return
+        try:
+            with job.conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE jobs SET status = 'running', started_timestamp = EXTRACT(epoch FROM NOW())
+                    WHERE job_id = %s
+                ''', (job.job_id,))
+            result = target(job, *args)
+            job.finish('succeeded', result)
+        except JobCancelled:
+            logger.info(f"Job {job.kind} {job.job_id} was cancelled")
+            job.finish('cancelled')
+        except JobFailed:
+            logger.info(f"Job {job.kind} {job.job_id} failed with {job.error_count} errors")
+            job.finish('failed')
+        except Exception as e:
+            logger.exception(f"Job {job.kind} {job.job_id} failed")
+            job.add_error(str(e))
+            job.finish('failed')
+        finally:
+            job.close()
+
+
+def get_job(kind: str, job_id: str):
+    """
+    The state of a job as a dict, or None if there is no job of 'kind' with that id.
+    """
+    try:
+        with pooled_connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                SELECT job_id, kind, status, phase, progress, errors, result, cancel_requested,
+                    created_timestamp, started_timestamp, finished_timestamp, created_by_user_sub
+                FROM jobs WHERE kind = %s AND job_id = %s
+            ''', (kind, job_id))
+            row = cur.fetchone()
+    except psycopg2.DataError:
+        # job_id is not a valid uuid
+        return None
+    if row is None:
+        return None
+    return {
+        'job_id': row[0].replace('-', ''),
+        'kind': row[1],
+        'status': row[2],
+        'phase': row[3],
+        'progress': row[4],
+        'errors': row[5],
+        'result': row[6],
+        'cancel_requested': row[7],
+        'created_timestamp': row[8],
+        'started_timestamp': row[9],
+        'finished_timestamp': row[10],
+        'created_by_user_sub': row[11]
+    }
+
+
+def request_cancel(kind: str, job_id: str) -> bool:
+    """
+    Ask an active job to stop; it does so the next time it reports progress.
+    Returns False if there is no active job of 'kind' with that id.
+    """
+    try:
+        with pooled_connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                UPDATE jobs SET cancel_requested = true
+                WHERE kind = %s AND job_id = %s AND status IN %s
+            ''', (kind, job_id, ACTIVE_STATUSES))
+            return cur.rowcount == 1
+    except psycopg2.DataError:
+        return False
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+from pypdf import PdfReader
+from pypdf.errors import PdfReadError
+from werkzeug.datastructures import FileStorage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Like werkzeug's uploads, a copy of a file is kept in memory up to this size and on disk beyond it.
+SPOOL_MAX_SIZE: int = 500 * 1024
+
+
+def spooled_copy(file: FileStorage) -> FileStorage:
+    """
+    A copy of the uploaded 'file' that outlives the request (e.g., for an import job).
+    """
+    stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    shutil.copyfileobj(file.stream, stream)
+    stream.seek(0)
+    return FileStorage(stream, filename=file.filename, name=file.name, content_type=file.content_type)
+
+
+class PdfFile:
+    """
+    An uploaded .pdf file with its 'size' in bytes. Whether it is a valid PDF is only found out the first
+    time that is_valid() is asked, and then remembered.
+    """
+
+    def __init__(self, file: FileStorage):
+        self._file: FileStorage = file
+        self.filename: str = file.filename
+        file.stream.seek(0, os.SEEK_END)
+        self.size: int = file.stream.tell()
+        file.stream.seek(0)
+        self._valid: bool = None
+
+    @property
+    def file(self) -> FileStorage:
+        """
+        The file, from its start.
+        """
+        self._file.stream.seek(0)
+        return self._file
+
+    def is_valid(self) -> bool:
+        if self._valid is None:
+            try:
+                # https://pypdf.readthedocs.io/en/stable/modules/PdfReader.html
+                PdfReader(self.file.stream)
+                self._valid = True
+            except PdfReadError:
+                self._valid = False
+            logger.debug(f"PdfFile: '{self.filename}'; size: {self.size}; valid: {self._valid}")
+        return self._valid
+
+
+class PdfFiles:
+    """
+    The 'pdf' files of an upload by filename, so that each row of the .tsv files finds its avr_pdf_filename
+    with one lookup. The upload is shared by validation and import, and a file named more than once
+    is only known by the first of them.
+    """
+
+    def __init__(self, files):
+        self._pdf_files: dict = {}
+        for file in files.getlist('pdf'):
+            if file.filename not in self._pdf_files:
+                self._pdf_files[file.filename] = PdfFile(file)
+
+    def get(self, filename: str) -> PdfFile:
+        return self._pdf_files.get(filename)
@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_buckets: dict = {}
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket that allows 'rate' acquisitions per second on average,
+    with bursts of up to 'capacity' (by default one second's worth).
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate: float = rate
+        self.capacity: float = max(1.0, rate if capacity is None else capacity)
+        self._tokens: float = self.capacity
+        self._updated_at: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """
+        Take a token, and return how many seconds the caller has to wait before it may be used.
+        """
+        with self._lock:
+            now: float = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        """
+        Block until the rate allows another request. A rate of 0 or less is unlimited.
+        """
+        if self.rate <= 0:
+            return
+        wait: float = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+def get_rate_limiter(host: str, rate: float) -> TokenBucket:
+    """
+    Return the TokenBucket for requests to 'host' from this process, creating it with 'rate' if needed.
+
+    Like the HTTP sessions (see utils/http) the buckets are per process, so each uWSGI worker
+    allows 'rate' requests per second to a host.
+    """
+    key: tuple = (os.getpid(), host)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                logger.info(f"Limiting requests to '{host}' from process {key[0]} to {rate} per second")
+                bucket = TokenBucket(rate)
+                _buckets[key] = bucket
+    return bucket
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import random
+import threading
+import time
+import elasticsearch
+import requests
+from flask import current_app
+from antibodyapi.utils.cache import TTLCache
+from antibodyapi.utils.elasticsearch import get_es_client, index_generation
+from antibodyapi.utils.etag import digest_etag
+from antibodyapi.utils.http import get_http_session
+from antibodyapi.utils.singleflight import make_single_flight
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SearchError(Exception):
+    """
+    Raised when a search backend fails to answer a query.
+    """
+
+
+class LatencyStats:
+    """
+    The number of searches and errors of a backend, and an exponentially weighted moving average
+    (with weight 'alpha' for the newest sample) of the time its successful searches took.
+    """
+
+    def __init__(self, alpha: float):
+        self.alpha: float = alpha
+        self.count: int = 0
+        self.errors: int = 0
+        self.ewma_ms = None
+        self.last_ms = None
+        self.last_error = None
+        self.last_error_at = None
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.last_ms = elapsed_ms
+            self.ewma_ms = elapsed_ms if self.ewma_ms is None else \
+                self.alpha * elapsed_ms + (1 - self.alpha) * self.ewma_ms
+
+    def record_error(self, error: str) -> None:
+        with self._lock:
+            self.count += 1
+            self.errors += 1
+            self.last_error = error
+            self.last_error_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'ewma_ms': None if self.ewma_ms is None else round(self.ewma_ms, 1),
+            'last_ms': None if self.last_ms is None else round(self.last_ms, 1),
+            'last_error': self.last_error,
+            'last_error_at': self.last_error_at
+        }
+
+
+class SearchBackend:
+    """
+    Runs Elastic Search queries against the antibody index, timing each one in 'stats'.
+    """
+    name: str = None
+
+    def __init__(self, config):
+        self.index: str = config['ANTIBODY_ELASTICSEARCH_INDEX']
+        self.timeout: float = config['SEARCH_TIMEOUT']
+        self.stats = LatencyStats(config['SEARCH_LATENCY_EWMA_ALPHA'])
+
+    def search(self, query) -> dict:
+        start: float = time.monotonic()
+        try:
+            result: dict = self._search(query)
+        except SearchError as e:
+            self.stats.record_error(str(e))
+            raise
+        self.stats.record((time.monotonic() - start) * 1000)
+        return result
+
+    def _search(self, query) -> dict:
+        raise NotImplementedError()
+
+
+class ElasticsearchBackend(SearchBackend):
+    """
+    Queries Elastic Search directly through the shared client (see utils/elasticsearch).
+    """
+    name: str = 'elasticsearch'
+
+    def _search(self, query) -> dict:
+        try:
+            return get_es_client().search(index=self.index, body=query, request_timeout=self.timeout)
+        except elasticsearch.ElasticsearchException as e:
+            logger.error(f"Elastic Search query failed: {e}")
+            raise SearchError(str(e)) from e
+
+
+class SearchApiBackend(SearchBackend):
+    """
+    Queries through the search-api, on a keep-alive session shared by the threads of the process.
+    """
+    name: str = 'search-api'
+
+    def __init__(self, config):
+        super().__init__(config)
+        # https://smart-api.info/ui/7aaf02b838022d564da776b03f357158#/search_by_index/search-post-by-index
+        self.url: str = f"{config['SEARCH_API_BASE'].rstrip('/')}/{self.index}/search"
+        self.pool_maxsize: int = config['SEARCH_API_POOL_MAXSIZE']
+
+    def _search(self, query) -> dict:
+        session = get_http_session('search-api', self.pool_maxsize)
+        try:
+            response = session.post(self.url, headers={"Content-Type": "application/json"}, json=query,
+                                    timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f"The search-api request to {self.url} failed: {e}")
+            raise SearchError(str(e)) from e
+        if response.status_code != 200:
+            logger.error(f"The search-api has returned status_code {response.status_code}: {response.text}")
+            raise SearchError(response.text)
+        return response.json()
+
+
+class FailoverBackend:
+    """
+    Sends each query to whichever of its 'backends' has the lowest average latency, and on an error
+    retries it on the next one. A backend that fails is passed over for SEARCH_FAILOVER_COOLDOWN seconds,
+    and a fraction SEARCH_FAILOVER_PROBE_RATE of queries go to another backend so that the averages
+    of the backends not in use stay current.
+    """
+    name: str = 'failover'
+
+    def __init__(self, config, backends: list):
+        self.backends: list = backends
+        self.cooldown: float = config['SEARCH_FAILOVER_COOLDOWN']
+        self.probe_rate: float = config['SEARCH_FAILOVER_PROBE_RATE']
+
+    def search(self, query) -> dict:
+        ordered: list = self._ordered()
+        for i, backend in enumerate(ordered):
+            try:
+                return backend.search(query)
+            except SearchError:
+                if i == len(ordered) - 1:
+                    raise
+                logger.warning(f"Search backend {backend.name} failed; failing over to {ordered[i + 1].name}")
+
+    def _ordered(self) -> list:
+        now: float = time.time()
+        healthy: list = []
+        cooling: list = []
+        for backend in self.backends:
+            last_error_at = backend.stats.last_error_at
+            (cooling if last_error_at is not None and now - last_error_at < self.cooldown else healthy).append(backend)
+        # A backend without samples sorts first so that it gets some.
+        healthy.sort(key=lambda b: b.stats.ewma_ms or 0.0)
+        if len(healthy) > 1 and random.random() < self.probe_rate:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        return healthy + cooling
+
+
+class SearchCache:
+    """
+    Caches the responses to the searchkit queries sent to /_search, which are mostly the same
+    few queries repeated against a catalog that rarely changes.
+
+    Entries are keyed on a hash of the canonical JSON of the query plus the index generation, so
+    a write to the index (see index_changed()) makes every earlier entry unreachable, and they age out
+    through the LRU eviction. The generation is shared by the workers of a node through the uWSGI cache
+    SEARCH_GENERATION_UWSGI_CACHE; without it (or for a write made by another node) a write is only seen
+    once the entry expires, so SEARCH_CACHE_TTL bounds how stale a search can be.
+
+    Each result is cached with its ETag, a hash of the query and the result itself, so that a conditional
+    search is answered without another lookup and only changes when the result does.
+
+    On a miss, identical queries that arrive while one is being run wait for it and share its result
+    (see utils/singleflight), so a burst of them makes one call to the backend.
+    """
+
+    def __init__(self, config):
+        self.memory = TTLCache(config['SEARCH_CACHE_MAXSIZE'], config['SEARCH_CACHE_TTL'])
+        self.flights = make_single_flight(config['SEARCH_SINGLE_FLIGHT_TIMEOUT'],
+                                          config['SEARCH_SINGLE_FLIGHT_UWSGI_CACHE'])
+
+    def search(self, query) -> tuple:
+        """
+        The (result, ETag) of the query.
+        """
+        key: tuple = (index_generation(), query_key(query))
+        cached = self.memory.get(key)
+        if cached is not None:
+            return cached
+        result = self.flights.do(f"{key[0]}:{key[1]}", lambda: execute_query(query))
+        cached = (result, result_etag(key[1], result))
+        # The generation is read again, so that a result which raced with a write is not cached for long.
+        if key[0] == index_generation():
+            self.memory.set(key, cached)
+        return cached
+
+
+def query_key(query) -> str:
+    """
+    A hash of 'query' which is the same however its keys are ordered or the JSON was spaced.
+    """
+    canonical: str = json.dumps(query, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def result_etag(key: str, result: dict) -> str:
+    """
+    The ETag of the 'result' of the query with the query_key() 'key'.
+    """
+    return digest_etag(key, json.dumps(result, sort_keys=True, separators=(',', ':')))
+
+
+def make_search_backend(config):
+    """
+    The backend named by SEARCH_BACKEND: 'elasticsearch', 'search-api' or 'failover' (which prefers
+    the faster of the two). If it is not set, QUERY_ELASTICSEARCH_DIRECTLY chooses between the first two.
+    """
+    name = config.get('SEARCH_BACKEND')
+    if name is None:
+        name = ElasticsearchBackend.name if config['QUERY_ELASTICSEARCH_DIRECTLY'] is True else SearchApiBackend.name
+    if name == ElasticsearchBackend.name:
+        return ElasticsearchBackend(config)
+    if name == SearchApiBackend.name:
+        return SearchApiBackend(config)
+    if name == FailoverBackend.name:
+        return FailoverBackend(config, [SearchApiBackend(config), ElasticsearchBackend(config)])
+    raise ValueError(f"Unknown SEARCH_BACKEND '{name}'")
+
+
+def init_app(app) -> None:
+    app.extensions['search_backend'] = make_search_backend(app.config)
+    app.extensions['search_cache'] = SearchCache(app.config)
+
+
+def execute_query(query) -> dict:
+    logger.debug(f"*** Elastic Search Query: {query}")
+    return current_app.extensions['search_backend'].search(query)
+
+
+def search_with_etag(query) -> tuple:
+    """
+    The (result, ETag) of the Elastic Search 'query', served from the SearchCache when it can be.
+    """
+    return current_app.extensions['search_cache'].search(query)
+
+
+def search_backend_stats() -> dict:
+    """
+    The LatencyStats of each search backend in use, by name.
+    """
+    search_backend = current_app.extensions['search_backend']
+    backends: list = getattr(search_backend, 'backends', [search_backend])
+    return {'backend': search_backend.name, 'backends': {b.name: b.stats.to_dict() for b in backends}}
@@ -0,0 +1,122 @@
+import json
+import math
+import threading
+import time
+import uuid
+import logging
+
+try:
+    import uwsgi
+except ImportError:
+    # Not running under uWSGI (e.g., tests or the Flask development server).
+    uwsgi = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is running, other threads that
+    ask for the same key wait for it and share its result (or its exception) rather than making
+    their own. Once it returns the key is forgotten, so a later call always runs afresh.
+
+    A follower that has waited 'timeout' seconds makes the call itself. With 'shared' (a
+    UwsgiSingleFlight) the one thread running a call also coalesces it with the other workers.
+    """
+
+    def __init__(self, timeout: float = None, shared=None):
+        self.timeout: float = timeout
+        self.shared = shared
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader: bool = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if call.done.wait(self.timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            logger.warning(f"SingleFlight: timed out waiting for {key}; calling it again")
+            return fn()
+        try:
+            call.result = fn() if self.shared is None else self.shared.do(key, fn)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class UwsgiSingleFlight:
+    """
+    Coalesces identical calls across the uWSGI workers through the uWSGI cache 'cache_name'
+    (which must be configured with 'cache2' in uwsgi.ini), so results must be JSON serialisable.
+
+    The first worker adds a 'flight' entry for the key, runs the call, and leaves the JSON result for
+    a few seconds under an id unique to that flight. Others that find the flight entry poll for its
+    result. If the result does not appear (the call failed, or the result is larger than a cache block)
+    or 'timeout' seconds pass, they make the call themselves.
+    """
+    result_ttl: int = 5
+
+    def __init__(self, cache_name: str, timeout: float, poll_interval: float = 0.02):
+        self.cache_name: str = cache_name
+        self.timeout: float = timeout
+        self.poll_interval: float = poll_interval
+
+    def do(self, key: str, fn):
+        flight_key: str = f"flight:{key}"
+        flight_id: str = uuid.uuid4().hex
+        # cache_set() does nothing (and returns None) if the key is already there, so only one worker leads.
+        if uwsgi.cache_set(flight_key, flight_id.encode('utf-8'), math.ceil(self.timeout) + 1, self.cache_name):
+            try:
+                result = fn()
+                if not uwsgi.cache_update(f"result:{flight_id}", json.dumps(result).encode('utf-8'),
+                                          self.result_ttl, self.cache_name):
+                    logger.warning(f"UwsgiSingleFlight: result of {key} could not be shared")
+                return result
+            finally:
+                uwsgi.cache_del(flight_key, self.cache_name)
+
+        leader_flight_id = uwsgi.cache_get(flight_key, self.cache_name)
+        if leader_flight_id is not None:
+            result_key: str = f"result:{leader_flight_id.decode('utf-8')}"
+            deadline: float = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                in_flight: bool = uwsgi.cache_exists(flight_key, self.cache_name)
+                value = uwsgi.cache_get(result_key, self.cache_name)
+                if value is not None:
+                    return json.loads(value)
+                if not in_flight:
+                    break
+                time.sleep(self.poll_interval)
+        return fn()
+
+
+def make_single_flight(timeout: float, shared_cache_name: str = None) -> SingleFlight:
+    """
+    A SingleFlight for the threads of this worker, which also coalesces across workers through
+    the uWSGI cache 'shared_cache_name' when that is given and the app is running under uWSGI.
+    """
+    shared = None
+    if shared_cache_name is not None:
+        if uwsgi is None:
+            logger.info(f"Not running under uWSGI; calls are only coalesced within each process")
+        else:
+            shared = UwsgiSingleFlight(shared_cache_name, timeout)
+    return SingleFlight(timeout=timeout, shared=shared)
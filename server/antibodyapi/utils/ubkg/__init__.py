@@ -0,0 +1,129 @@
+import json
+import psycopg2
+from flask import current_app
+from antibodyapi.utils.cache import TTLCache
+from antibodyapi.utils.db import pooled_connection
+from antibodyapi.utils.http import get_http_session
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UbkgCache:
+    """
+    Caches the responses of the UBKG endpoints used by validation, import and restore.
+
+    Only a 200 (for UBKG_CACHE_TTL seconds) or a 404 (negatively, for UBKG_CACHE_NEGATIVE_TTL seconds)
+    is cached; anything else is retried next time. Responses are kept in process in a TTLCache of
+    UBKG_CACHE_MAXSIZE entries and, when UBKG_CACHE_PERSISTENT is set, also in the 'ubkg_cache' table
+    so that they are shared by all workers and survive restarts.
+    """
+
+    def __init__(self, config, db_pool=None):
+        self.ttl: float = config['UBKG_CACHE_TTL']
+        self.negative_ttl: float = config['UBKG_CACHE_NEGATIVE_TTL']
+        self.timeout: float = config['UBKG_TIMEOUT']
+        self.memory = TTLCache(config['UBKG_CACHE_MAXSIZE'], self.ttl)
+        self.persistent = PostgresUbkgCache(db_pool) if config['UBKG_CACHE_PERSISTENT'] else None
+
+    def get(self, url: str) -> tuple:
+        """
+        Return the (status_code, json) response of a GET on 'url', where json is None unless the status is 200.
+        A requests.ConnectionError is raised as it would be without the cache.
+        """
+        cached = self.memory.get(url)
+        if cached is not None:
+            return cached
+        if self.persistent is not None:
+            cached = self.persistent.get(url)
+            if cached is not None:
+                self.memory.set(url, cached, self._ttl(cached[0]))
+                return cached
+
+        logger.debug(f'UbkgCache: GET {url}')
+        response = get_http_session('ubkg').get(url, headers={"Accept": "application/json"},
+                                                 timeout=self.timeout, verify=False)
+        try:
+            response_json = None
+            if response.status_code == 200:
+                response_json = response.json()
+        except ValueError:
+            logger.error(f"UbkgCache: response from {url} is not JSON")
+            return response.status_code, None
+        finally:
+            response.close()
+
+        result: tuple = (response.status_code, response_json)
+        ttl = self._ttl(response.status_code)
+        if ttl is not None:
+            self.memory.set(url, result, ttl)
+            if self.persistent is not None:
+                self.persistent.set(url, result, ttl)
+        return result
+
+    def _ttl(self, status_code: int):
+        if status_code == 200:
+            return self.ttl
+        if status_code == 404:
+            return self.negative_ttl
+        return None
+
+
+class PostgresUbkgCache:
+    """
+    The 'ubkg_cache' table tier of the UbkgCache. Failures here are logged and treated as a miss,
+    since the cache only saves calls to UBKG.
+    """
+    prune_every: int = 1000
+
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+        self._sets: int = 0
+
+    def get(self, url: str):
+        row = self._execute('''
+            SELECT status_code, body FROM ubkg_cache
+            WHERE cache_key = %s AND expires_at > EXTRACT(epoch FROM NOW())
+        ''', (url,), fetch=True)
+        if row is None:
+            return None
+        return row[0], row[1]
+
+    def set(self, url: str, result: tuple, ttl: float) -> None:
+        self._execute('''
+            INSERT INTO ubkg_cache (cache_key, status_code, body, expires_at)
+            VALUES (%s, %s, %s, EXTRACT(epoch FROM NOW()) + %s)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET status_code = EXCLUDED.status_code, body = EXCLUDED.body, expires_at = EXCLUDED.expires_at
+        ''', (url, result[0], json.dumps(result[1]), ttl))
+        self._sets += 1
+        if self._sets % self.prune_every == 0:
+            self._execute('DELETE FROM ubkg_cache WHERE expires_at <= EXTRACT(epoch FROM NOW())', ())
+
+    def _execute(self, query: str, params: tuple, fetch: bool = False):
+        try:
+            with pooled_connection(pool=self.db_pool) as conn, conn.cursor() as cur:
+                cur.execute(query, params)
+                return cur.fetchone() if fetch else None
+        except psycopg2.Error as e:
+            logger.error(f"PostgresUbkgCache: {e}")
+            return None
+
+
+def init_app(app) -> None:
+    app.extensions['ubkg_cache'] = UbkgCache(app.config, app.extensions.get('db_pool'))
+
+
+def get_gene_relationships(ubkg_api_url: str, target: str) -> tuple:
+    """
+    The UBKG 'relationships/gene' entry for the 'target' symbol as (status_code, json).
+    """
+    target_encoded: str = target.replace(' ', '%20')
+    return current_app.extensions['ubkg_cache'].get(f"{ubkg_api_url}/relationships/gene/{target_encoded}")
+
+
+def get_celltype(ubkg_api_url: str, cell_type_id: str) -> tuple:
+    """
+    The UBKG 'celltypes' entry for the Cell Ontology 'cell_type_id' (without the 'CL:' prefix) as (status_code, json).
+    """
+    return current_app.extensions['ubkg_cache'].get(f"{ubkg_api_url}/celltypes/{cell_type_id}")
@@ -1,17 +1,20 @@
+import concurrent.futures
 import csv
-import io
-import psycopg2
-from pypdf import PdfReader
-from pypdf.errors import PdfReadError
 import requests
 import re
 from flask import abort, make_response, jsonify, current_app
-from urllib.parse import quote
+from urllib.parse import quote, urlparse
 import logging
 from typing import List
 import time
 import datetime
 from werkzeug.exceptions import HTTPException
+from antibodyapi.utils import get_cursor
+from antibodyapi.utils.http import get_http_session
+from antibodyapi.utils.pdf_files import PdfFile, PdfFiles
+from antibodyapi.utils.ratelimit import get_rate_limiter
+from antibodyapi.utils.ubkg import get_celltype, get_gene_relationships
+from antibodyapi.utils.validation_cache import NOT_FOUND, PROBLEM, VALID
 
 
 logging.basicConfig(format='[%(asctime)s] %(levelname)s in %(module)s:%(lineno)d: %(message)s',
@@ -177,27 +180,30 @@ def validate_row_data(row_i: int, row: dict) -> None:
                          f" is not one of: {', '.join(canonicalize_yn_response.valid())}", 406))
 
 
-def validate_targets(row_i: int, targets: str, ubkg_api_url: str) -> dict:
+# The kinds of identifier that are checked against an external service. The status of a check is one of
+# those of utils/validation_cache.
+UNIPROT, HGNC, TARGET, RRID, DOI, ORCID, ONTOLOGY = 'uniprot', 'hgnc', 'target', 'rrid', 'doi', 'orcid', 'ontology'
+CELL_TYPE = 'celltype'
+# Those looked up in UBKG, whose responses have their own cache (see utils/ubkg).
+UBKG_KINDS: tuple = (TARGET, CELL_TYPE)
+
+UBERON_PREFIX: str = "UBERON:"
+
+
+def _get(url: str, **kwargs) -> requests.Response:
     """
-    Since the target_symbol can be a comma delimited string, the validated target_symbol must also be one.
-    The aliases of each to the array of aliases must be combine so that they can all be searched on through
-    ElasticSearch.
+    GET 'url' on the validation session once the rate limit for its host allows it.
     """
-    result: dict = {targets: {"target_symbol": "", "target_aliases": []}}
-    for target in targets.split(','):
-        target_strip = target.strip()
-        validated = validate_target(row_i, target_strip, ubkg_api_url)
-        validated_data = validated[target_strip]
-        if result[targets]["target_symbol"] != "":
-            result[targets]["target_symbol"] += ","
-        result[targets]["target_symbol"] += validated_data["target_symbol"]
-        result[targets]["target_aliases"] += validated_data["target_aliases"]
-    # remove duplicates from the target_aliases
-    result[targets]["target_aliases"] = list(set(result[targets]["target_aliases"]))
-    return result
+    config = current_app.config
+    host: str = urlparse(url).hostname
+    rate: float = config['VALIDATION_RATE_LIMITS'].get(host, config['VALIDATION_DEFAULT_RATE_LIMIT'])
+    get_rate_limiter(host, rate).acquire()
+    session = get_http_session('validation', pool_maxsize=config['VALIDATION_WORKERS'])
+    return session.get(url, headers={"Accept": "application/json"}, verify=False,
+                       timeout=config['VALIDATION_TIMEOUT'], **kwargs)
 
 
-def validate_target(row_i: int, target: str, ubkg_api_url: str) -> dict:
+def check_target(target: str, ubkg_api_url: str) -> tuple:
     """
     Look up the target using the UBKG API endpoint.
 
@@ -206,122 +212,76 @@ def validate_target(row_i: int, target: str, ubkg_api_url: str) -> dict:
     The approved is used rather than the target in the database as the target_symbol.
     The user can then search on any of the entries returned for the target in target_aliases.
     """
-    response = None
     try:
-        target_encoded: str = target.replace(' ', '%20')
-        ubkg_rest_url: str = f"{ubkg_api_url}/relationships/gene/{target_encoded}"
-        logger.debug(f'validate_target() URL: {ubkg_rest_url}')
-        response = requests.get(ubkg_rest_url, headers={"Accept": "application/json"}, verify=False)
-        if response.status_code == 200:
-            response_json: dict = response.json()
+        logger.debug(f'check_target() target: {target}')
+        status_code, response_json = get_gene_relationships(ubkg_api_url, target)
+        if status_code == 200:
             target_symbol: str = response_json["symbol-approved"][0]
             target_aliases: list = [target_symbol] + response_json["symbol-alias"] + response_json["symbol-previous"]
-            return {target: {"target_symbol": target_symbol, "target_aliases": target_aliases}}
-        elif response.status_code == 404:
-            abort(json_error(f"TSV file row number `{row_i}`: target_symbol '{target}' is not found", 406))
-        else:
-            abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating target_symbol '{target}'", 406))
-    except requests.ConnectionError as error:
-        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
-        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating target_symbol '{target}'", 406))
-    finally:
-        if response is not None:
-            response.close()
-
-def validate_previous_version_id(row_i: int, previous_version_id: str, cur) -> None:
-    if not previous_version_id.strip():
-        return
-    try:
-        cur.execute("""
-            SELECT next_version_id 
-            FROM antibodies 
-            WHERE antibody_hubmap_id = %s
-        """, (previous_version_id,))
-
-        result = cur.fetchone()
-
-    except Exception as e:
-        logger.exception(f"validate_previous_version_id: Unexpected error: {e}")
-        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered while validating previous_revision_hubmap_id", 500))
-    
-    if result is None:
-            abort(json_error(f"TSV file row number `{row_i}`: previous_revision_hubmap_id '{previous_version_id}' does not exist", 406))
-    elif result[0] is not None:
-        abort(json_error(f"TSV file row number `{row_i}`: previous_version_id '{previous_version_id}' "
-                            f"already has a newer version specified (next_revision_hubmap_id='{result[0]}')", 406))
+            return VALID, {"target_symbol": target_symbol, "target_aliases": target_aliases}
+        if status_code == 404:
+            return NOT_FOUND, None
+        return PROBLEM, None
+    except (requests.ConnectionError, requests.Timeout):
+        return PROBLEM, None
 
 
-def validate_uniprot_accession_numbers(row_i: int, uniprot_accession_numbers: str) -> None:
-    for uniprot_accession_number in uniprot_accession_numbers.split(','):
-        validate_uniprot_accession_number(row_i, uniprot_accession_number.strip())
+def check_cell_type(cell_type_id: str, ubkg_api_url: str) -> tuple:
+    """
+    Look up the Cell Ontology 'cell_type_id' (without the 'CL:' prefix) using the UBKG API endpoint.
+    """
+    try:
+        logger.debug(f'check_cell_type() cell_type_id: {cell_type_id}')
+        status_code, _ = get_celltype(ubkg_api_url, cell_type_id)
+        if status_code >= 400:
+            return NOT_FOUND, None
+        return VALID, None
+    except (requests.ConnectionError, requests.Timeout):
+        return PROBLEM, None
 
 
-def validate_uniprot_accession_number(row_i: int, uniprot_accession_number: str) -> None:
-    response = None
+def check_uniprot_accession_number(uniprot_accession_number: str) -> tuple:
     try:
         uniprot_url: str = f"https://www.uniprot.org/uniprot/{uniprot_accession_number}.rdf?include=yes"
-        logger.debug(f'validate_uniprot_accession_number() URL: {uniprot_url}')
-        response = requests.get(uniprot_url, headers={"Accept": "application/json"}, verify=False)
-        # https://www.uniprot.org/help/api_retrieve_entries
-        if response.status_code == 404:
-            abort(json_error(f"TSV file row number `{row_i}`: Uniprot Accession Number"
-                             f" '{uniprot_accession_number}' is not found in catalogue",
-                             406))
-    except requests.ConnectionError as error:
-        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
-        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating Uniprot Accession Number", 406))
-    finally:
-        if response is not None:
-            response.close()
-
+        logger.debug(f'check_uniprot_accession_number() URL: {uniprot_url}')
+        with _get(uniprot_url) as response:
+            # https://www.uniprot.org/help/api_retrieve_entries
+            if response.status_code == 404:
+                return NOT_FOUND, None
+            return VALID, None
+    except (requests.ConnectionError, requests.Timeout):
+        return PROBLEM, None
 
-def validate_orcids(row_i: int, orcids: str) -> None:
-    for orcid in orcids.split(','):
-        validate_orcid(row_i, orcid.strip())
 
-
-def validate_orcid(row_i: int, orcid: str) -> None:
-    """
-    This field can be a single entry or a comma delimated list of ORCIDs.
-    """
-    response = None
+def check_orcid(orcid: str) -> tuple:
     try:
         orcid_url: str = f"https://pub.orcid.org/{orcid}"
-        logger.debug(f'validate_orcid() URL: {orcid_url}')
-        response = requests.get(orcid_url, headers={"Accept": "application/json"}, verify=False)
-        # TODO: 302
-        if response.status_code == 404:
-            abort(json_error(f"TSV file row number `{row_i}`: ORCID '{orcid}' is not found in catalogue", 406))
-    except requests.ConnectionError as error:
-        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
-        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered fetching ORCID", 406))
-    finally:
-        if response is not None:
-            response.close()
+        logger.debug(f'check_orcid() URL: {orcid_url}')
+        with _get(orcid_url) as response:
+            # TODO: 302
+            if response.status_code == 404:
+                return NOT_FOUND, None
+            return VALID, None
+    except (requests.ConnectionError, requests.Timeout):
+        return PROBLEM, None
 
 
-def validate_rrid(row_i: int, rrid: str) -> None:
-    response = None
+def check_rrid(rrid: str) -> tuple:
     try:
         rrid_url: str = f"https://scicrunch.org/resolver/RRID:{rrid}.json"
-        logger.debug(f'validate_rrid() URL: {rrid_url}')
-        response = requests.get(rrid_url, headers={"Accept": "application/json"}, verify=False)
-        if response.status_code != 200:
-            abort(json_error(f"TSV file row number `{row_i}`: RRID '{rrid}' is not found in catalogue", 406))
-    except requests.ConnectionError as error:
-        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
-        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating RRID '{rrid}'", 406))
-    finally:
-        if response is not None:
-            response.close()
-
-
-def validate_dois(row_i: int, dois: str) -> None:
-    for doi in dois.split(','):
-        validate_doi(row_i, doi.strip())
-
-
-def validate_doi(row_i: int, original_doi: str) -> None:
+        logger.debug(f'check_rrid() URL: {rrid_url}')
+        with _get(rrid_url) as response:
+            if response.status_code == 404:
+                return NOT_FOUND, None
+            if response.status_code != 200:
+                # e.g., 429 or 5xx, which say nothing of the RRID and so must not be cached.
+                return PROBLEM, None
+            return VALID, None
+    except (requests.ConnectionError, requests.Timeout):
+        return PROBLEM, None
+
+
+def check_doi(doi: str) -> tuple:
     """
     https://www.doi.org/factsheets/DOIProxy.html
     2. Encoding DOIs for use in URIs
@@ -333,35 +293,27 @@ def validate_doi(row_i: int, original_doi: str) -> None:
     2 : Error. Something unexpected went wrong during handle resolution. (HTTP 500 Internal Server Error)
     100 : Handle Not Found. (HTTP 404 Not Found)
     200 : Values Not Found. The handle exists but has no values (or no values according to the types and indices specified). (HTTP 200 OK)
+
+    'doi' is canonical (see CanonicalizeDOI).
     """
-    response = None
     try:
         doi_url_base: str = "https://doi.org/api/handles/"
-        canonicalize_doi = CanonicalizeDOI()
-        doi: str = canonicalize_doi.canonicalize(original_doi)
-        if doi is None:
-            abort(json_error(
-                f"TSV file row number `{row_i}`: DOI '{original_doi}' none of the prefixes {','.join(canonicalize_doi.valid())} matched", 406))
         doi_url: str = f"{doi_url_base}{quote(doi)}?type=URL"
-        logger.debug(f'validate_doi() URL: {doi_url}')
-        response = requests.get(doi_url, headers={"Accept": "application/json"}, verify=False)
-        response_json: dict = response.json()
-        if response.status_code != 200 or 'responseCode' not in response_json or response_json['responseCode'] != 1:
-            abort(json_error(f"TSV file row number `{row_i}`: DOI '{original_doi}' is not found in catalogue", 406))
-    except requests.ConnectionError as error:
-        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
-        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating DOI '{original_doi}'", 406))
-    finally:
-        if response is not None:
-            response.close()
-
-
-def validate_hgncs(row_i: int, hgncs: str) -> None:
-    for hgnc in hgncs.split(','):
-        validate_hgnc(row_i, hgnc.strip())
+        logger.debug(f'check_doi() URL: {doi_url}')
+        with _get(doi_url) as response:
+            if response.status_code == 404:
+                return NOT_FOUND, None
+            if response.status_code != 200:
+                return PROBLEM, None
+            response_json: dict = response.json()
+            if 'responseCode' not in response_json or response_json['responseCode'] != 1:
+                return NOT_FOUND, None
+            return VALID, None
+    except (requests.ConnectionError, requests.Timeout):
+        return PROBLEM, None
 
 
-def validate_hgnc(row_i: int, hgnc: str) -> None:
+def check_hgnc(hgnc: str) -> tuple:
     """
     https://www.genenames.org/help/rest/
     Please only send REST requests at a rate of 10 requests per second
@@ -369,36 +321,26 @@ def validate_hgnc(row_i: int, hgnc: str) -> None:
 
     Valid if 'response.numFound > 0'
     """
-    response = None
     try:
         hgnc_url_base: str = "https://rest.genenames.org/fetch/hgnc_id/"
         hgnc_url: str = f"{hgnc_url_base}{hgnc}"
-        logger.debug(f'validate_hgnc() URL: {hgnc_url}')
-        response = requests.get(hgnc_url, headers={"Accept": "application/json"}, verify=False)
-        response_json: dict = response.json()
-        if 'response' not in response_json or 'numFound' not in response_json['response']:
-            abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating HGNC '{hgnc}'", 406))
-        num_found: int = response_json['response']['numFound']
-        if response.status_code != 200 or num_found <= 0:
-            abort(json_error(f"TSV file row number `{row_i}`: HGNC '{hgnc}' is not found in catalogue", 406))
-    except requests.ConnectionError as error:
-        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
-        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating HGNC '{hgnc}'", 406))
-    finally:
-        if response is not None:
-            response.close()
-
-
-def validate_uberon_id(row_i: int, ontology_id: str) -> None:
-    required_prefix: str = "UBERON:"
-    if ontology_id[0:len(required_prefix)] != required_prefix:
-        abort(json_error(f"TSV file row number `{row_i}`: UBERON Ontoloty ID "
-                         f"'{ontology_id}' must begin with '{required_prefix}'", 406))
-    validate_ontology(row_i, ontology_id)
-
+        logger.debug(f'check_hgnc() URL: {hgnc_url}')
+        with _get(hgnc_url) as response:
+            if response.status_code == 404:
+                return NOT_FOUND, None
+            if response.status_code != 200:
+                return PROBLEM, None
+            response_json: dict = response.json()
+            if 'response' not in response_json or 'numFound' not in response_json['response']:
+                return PROBLEM, None
+            if response_json['response']['numFound'] <= 0:
+                return NOT_FOUND, None
+            return VALID, None
+    except (requests.ConnectionError, requests.Timeout):
+        return PROBLEM, None
 
 
-def validate_ontology(row_i: int, ontology_id: str) -> None:
+def check_ontology(ontology_id: str) -> tuple:
     """
     https://www.ebi.ac.uk/ols/docs/api
     Ontology Search API
@@ -407,23 +349,347 @@ def validate_ontology(row_i: int, ontology_id: str) -> None:
 
     Valid if 'page.totalElements > 0'
     """
-    response = None
     try:
         ols_url_base: str = "http://www.ebi.ac.uk/ols/api/terms"
         ols_url: str = f"{ols_url_base}?id={ontology_id}"
-        logger.debug(f'validate_ontology() URL: {ols_url}')
-        response = requests.get(ols_url, headers={"Accept": "application/json"}, verify=False, allow_redirects=True)
-        if response.status_code != 200:
-            abort(json_error(f"TSV file row number `{row_i}`: Ontology ID '{ontology_id}' is not found", 406))
-    except requests.ConnectionError as error:
+        logger.debug(f'check_ontology() URL: {ols_url}')
+        with _get(ols_url, allow_redirects=True) as response:
+            if response.status_code == 404:
+                return NOT_FOUND, None
+            if response.status_code != 200:
+                return PROBLEM, None
+            return VALID, None
+    except (requests.ConnectionError, requests.Timeout):
+        return PROBLEM, None
+
+
+IDENTIFIER_CHECKS: dict = {
+    UNIPROT: check_uniprot_accession_number,
+    HGNC: check_hgnc,
+    RRID: check_rrid,
+    DOI: check_doi,
+    ORCID: check_orcid,
+    ONTOLOGY: check_ontology,
+}
+
+
+def check_identifier(kind: str, value: str, ubkg_api_url: str = None) -> tuple:
+    """
+    Check the identifier 'value' of 'kind' against its external service.
+
+    Returns (status, data) where status is VALID, NOT_FOUND or PROBLEM (the service could not be reached
+    or gave an unexpected answer), and data is only given for a valid TARGET. Other than a PROBLEM,
+    the status is cached (see utils/validation_cache).
+    """
+    if kind == TARGET:
+        # UBKG responses have their own cache (see utils/ubkg).
+        return check_target(value, ubkg_api_url)
+    if kind == CELL_TYPE:
+        return check_cell_type(value, ubkg_api_url)
+    validation_cache = current_app.extensions['validation_cache']
+    status: str = validation_cache.get(kind, value)
+    if status is None:
+        status, _ = IDENTIFIER_CHECKS[kind](value)
+        validation_cache.set(kind, value, status)
+    return status, None
+
+
+def row_identifiers(row: dict):
+    """
+    Yield the (kind, value) of each identifier in 'row' that validate_antibodytsv_row() checks against an
+    external service, in the order that it checks them. A DOI is given in its canonical form, and one without
+    a valid prefix (or a UBERON ID without its prefix) is left out since it fails without being looked up.
+    """
+    for uniprot_accession_number in row['uniprot_accession_number'].split(','):
+        yield UNIPROT, uniprot_accession_number.strip()
+    for hgnc in row['hgnc_id'].split(','):
+        yield HGNC, hgnc.strip()
+    for target in row['target_symbol'].split(','):
+        yield TARGET, target.strip()
+    yield RRID, row['rrid']
+    dois: list = [doi.strip() for doi in row['protocol_doi'].split(',')]
+    orcids: list = [orcid.strip() for orcid in row['author_orcids'].split(',')]
+    for doi in dois:
+        canonical_doi: str = CanonicalizeDOI().canonicalize(doi)
+        if canonical_doi is not None:
+            yield DOI, canonical_doi
+    for orcid in orcids:
+        yield ORCID, orcid
+    if row['organ_uberon_id'].startswith(UBERON_PREFIX):
+        yield ONTOLOGY, row['organ_uberon_id']
+    if row['manuscript_doi'] != '':
+        canonical_doi: str = CanonicalizeDOI().canonicalize(row['manuscript_doi'])
+        if canonical_doi is not None:
+            yield DOI, canonical_doi
+    if 'cell_marker' in row:
+        yield CELL_TYPE, cell_type_id(row['cell_marker'])
+
+
+def cell_type_id(cell_marker: str) -> str:
+    """
+    The Cell Ontology id of the 'cell_marker' (e.g., 'CL:0000236') without its prefix, as UBKG looks it up.
+    """
+    return cell_marker.upper().replace('CL:', '')
+
+
+class IdentifierChecks:
+    """
+    Checks the identifiers of an uploaded TSV file on a pool of VALIDATION_WORKERS threads.
+
+    plan() collects the distinct identifiers of every row before the rows are validated, and checks each of
+    them once, so a DOI or ORCID shared by the whole batch is looked up once rather than once per row.
+    The validate_*() functions then wait for the result of the check that they need. So the rows are still
+    validated in order, and the first one that fails is reported with the same message as when the checks
+    were made one after another.
+    """
+
+    def __init__(self, app, ubkg_api_url: str):
+        self.app = app
+        self.ubkg_api_url: str = ubkg_api_url
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=app.config['VALIDATION_WORKERS'],
+                                                               thread_name_prefix='validation')
+        self._futures: dict = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _check(self, kind: str, value: str) -> tuple:
+        with self.app.app_context():
+            return check_identifier(kind, value, self.ubkg_api_url)
+
+    def submit(self, kind: str, value: str) -> None:
+        key: tuple = (kind, value)
+        if key not in self._futures:
+            self._futures[key] = self._executor.submit(self._check, kind, value)
+
+    def plan(self, rows: list) -> None:
+        """
+        Check each distinct identifier in 'rows' once. Those already in the ValidationCache are read from it
+        in one go (see get_many()), and the rest are submitted in the order that the rows need them.
+        """
+        identifiers: dict = {}
+        references: int = 0
+        for row in rows:
+            for identifier in row_identifiers(row):
+                references += 1
+                identifiers[identifier] = None
+        cached: dict = self.app.extensions['validation_cache'].get_many(
+            [identifier for identifier in identifiers if identifier[0] not in UBKG_KINDS]
+        )
+        for (kind, value) in identifiers:
+            status = cached.get((kind, value))
+            if status is not None:
+                future = concurrent.futures.Future()
+                future.set_result((status, None))
+                self._futures[(kind, value)] = future
+            else:
+                self.submit(kind, value)
+        logger.info(f"IdentifierChecks: {len(rows)} rows refer to {references} identifiers; {len(identifiers)} distinct,"
+                    f" {len(cached)} of them cached")
+
+    def result(self, kind: str, value: str) -> tuple:
+        future = self._futures.get((kind, value))
+        if future is None:
+            return check_identifier(kind, value, self.ubkg_api_url)
+        return future.result()
+
+    def close(self) -> None:
+        # After a row has failed the checks of the rows that follow it are not needed.
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _check_result(kind: str, value: str, checks: IdentifierChecks = None, ubkg_api_url: str = None) -> tuple:
+    if checks is not None:
+        return checks.result(kind, value)
+    return check_identifier(kind, value, ubkg_api_url)
+
+
+def validate_targets(row_i: int, targets: str, ubkg_api_url: str, checks: IdentifierChecks = None) -> dict:
+    """
+    Since the target_symbol can be a comma delimited string, the validated target_symbol must also be one.
+    The aliases of each to the array of aliases must be combine so that they can all be searched on through
+    ElasticSearch.
+    """
+    result: dict = {targets: {"target_symbol": "", "target_aliases": []}}
+    for target in targets.split(','):
+        target_strip = target.strip()
+        validated = validate_target(row_i, target_strip, ubkg_api_url, checks)
+        validated_data = validated[target_strip]
+        if result[targets]["target_symbol"] != "":
+            result[targets]["target_symbol"] += ","
+        result[targets]["target_symbol"] += validated_data["target_symbol"]
+        result[targets]["target_aliases"] += validated_data["target_aliases"]
+    # remove duplicates from the target_aliases
+    result[targets]["target_aliases"] = list(set(result[targets]["target_aliases"]))
+    return result
+
+
+def validate_target(row_i: int, target: str, ubkg_api_url: str, checks: IdentifierChecks = None) -> dict:
+    status, target_data = _check_result(TARGET, target, checks, ubkg_api_url)
+    if status == NOT_FOUND:
+        abort(json_error(f"TSV file row number `{row_i}`: target_symbol '{target}' is not found", 406))
+    elif status == PROBLEM:
+        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
+        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating target_symbol '{target}'", 406))
+    return {target: target_data}
+
+
+def validate_cell_marker(row_i: int, cell_marker: str, ubkg_api_url: str, checks: IdentifierChecks = None) -> None:
+    cell_marker = cell_marker.upper()
+    cell_marker_err = f"TSV file row number `{row_i}`: Problem processing `cell_marker` field with value `{cell_marker}`"
+    status, _ = _check_result(CELL_TYPE, cell_type_id(cell_marker), checks, ubkg_api_url)
+    if status == NOT_FOUND:
+        abort(json_error(f"{cell_marker_err}. Invalid cell type.\nPlease refer to the cell types ontology for a list of valid cell types and associated codes. {current_app.config['UBKG_CELL_TYPES_ONTOLOGY_URL']}", 406))
+    elif status == PROBLEM:
+        abort(json_error(f"{cell_marker_err}. Problem encountered validating the cell type", 406))
+
+
+def find_previous_versions(rows: list, cur) -> dict:
+    """
+    Look up the antibody of every 'previous_version_id' in the .tsv 'rows' with one query, and return
+    {previous_version_id: {'next_version_id', 'antibody_uuid', 'avr_pdf_uuid', 'avr_pdf_filename'}}
+    for each that exists, so that neither validate_previous_version_id() nor the import query them again.
+    """
+    previous_version_ids: list = [row['previous_version_id'] for row in rows if row['previous_version_id'].strip()]
+    if not previous_version_ids:
+        return {}
+    try:
+        cur.execute("""
+            SELECT antibody_hubmap_id, next_version_id, antibody_uuid, avr_pdf_uuid, avr_pdf_filename
+            FROM antibodies
+            WHERE antibody_hubmap_id = ANY(%s)
+        """, (previous_version_ids,))
+        results: list = cur.fetchall()
+    except Exception as e:
+        logger.exception(f"find_previous_versions: Unexpected error: {e}")
+        # Reported against the first row that would have been looked up.
+        row_i: int = next(row_i for row_i, row in enumerate(rows, start=2) if row['previous_version_id'].strip())
+        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered while validating previous_revision_hubmap_id", 500))
+    return {
+        antibody_hubmap_id: {
+            'next_version_id': next_version_id,
+            'antibody_uuid': str(antibody_uuid),
+            'avr_pdf_uuid': avr_pdf_uuid,
+            'avr_pdf_filename': avr_pdf_filename
+        }
+        for antibody_hubmap_id, next_version_id, antibody_uuid, avr_pdf_uuid, avr_pdf_filename in results
+    }
+
+
+def validate_previous_version_id(row_i: int, previous_version_id: str, cur, previous_versions: dict = None) -> None:
+    """
+    The antibody of 'previous_version_id' is taken from 'previous_versions' (see find_previous_versions())
+    when it is given, and queried otherwise.
+    """
+    if not previous_version_id.strip():
+        return
+    if previous_versions is None:
+        previous_versions = find_previous_versions([{'previous_version_id': previous_version_id}], cur)
+    result = previous_versions.get(previous_version_id)
+
+    if result is None:
+            abort(json_error(f"TSV file row number `{row_i}`: previous_revision_hubmap_id '{previous_version_id}' does not exist", 406))
+    elif result['next_version_id'] is not None:
+        abort(json_error(f"TSV file row number `{row_i}`: previous_version_id '{previous_version_id}' "
+                            f"already has a newer version specified (next_revision_hubmap_id='{result['next_version_id']}')", 406))
+
+
+def validate_uniprot_accession_numbers(row_i: int, uniprot_accession_numbers: str, checks: IdentifierChecks = None) -> None:
+    for uniprot_accession_number in uniprot_accession_numbers.split(','):
+        validate_uniprot_accession_number(row_i, uniprot_accession_number.strip(), checks)
+
+
+def validate_uniprot_accession_number(row_i: int, uniprot_accession_number: str, checks: IdentifierChecks = None) -> None:
+    status, _ = _check_result(UNIPROT, uniprot_accession_number, checks)
+    if status == NOT_FOUND:
+        abort(json_error(f"TSV file row number `{row_i}`: Uniprot Accession Number"
+                         f" '{uniprot_accession_number}' is not found in catalogue",
+                         406))
+    elif status == PROBLEM:
+        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
+        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating Uniprot Accession Number", 406))
+
+
+def validate_orcids(row_i: int, orcids: str, checks: IdentifierChecks = None) -> None:
+    for orcid in orcids.split(','):
+        validate_orcid(row_i, orcid.strip(), checks)
+
+
+def validate_orcid(row_i: int, orcid: str, checks: IdentifierChecks = None) -> None:
+    """
+    This field can be a single entry or a comma delimated list of ORCIDs.
+    """
+    status, _ = _check_result(ORCID, orcid, checks)
+    if status == NOT_FOUND:
+        abort(json_error(f"TSV file row number `{row_i}`: ORCID '{orcid}' is not found in catalogue", 406))
+    elif status == PROBLEM:
+        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
+        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered fetching ORCID", 406))
+
+
+def validate_rrid(row_i: int, rrid: str, checks: IdentifierChecks = None) -> None:
+    status, _ = _check_result(RRID, rrid, checks)
+    if status == NOT_FOUND:
+        abort(json_error(f"TSV file row number `{row_i}`: RRID '{rrid}' is not found in catalogue", 406))
+    elif status == PROBLEM:
+        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
+        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating RRID '{rrid}'", 406))
+
+
+def validate_dois(row_i: int, dois: str, checks: IdentifierChecks = None) -> None:
+    for doi in dois.split(','):
+        validate_doi(row_i, doi.strip(), checks)
+
+
+def validate_doi(row_i: int, original_doi: str, checks: IdentifierChecks = None) -> None:
+    canonicalize_doi = CanonicalizeDOI()
+    doi: str = canonicalize_doi.canonicalize(original_doi)
+    if doi is None:
+        abort(json_error(
+            f"TSV file row number `{row_i}`: DOI '{original_doi}' none of the prefixes {','.join(canonicalize_doi.valid())} matched", 406))
+    status, _ = _check_result(DOI, doi, checks)
+    if status == NOT_FOUND:
+        abort(json_error(f"TSV file row number `{row_i}`: DOI '{original_doi}' is not found in catalogue", 406))
+    elif status == PROBLEM:
+        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
+        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating DOI '{original_doi}'", 406))
+
+
+def validate_hgncs(row_i: int, hgncs: str, checks: IdentifierChecks = None) -> None:
+    for hgnc in hgncs.split(','):
+        validate_hgnc(row_i, hgnc.strip(), checks)
+
+
+def validate_hgnc(row_i: int, hgnc: str, checks: IdentifierChecks = None) -> None:
+    status, _ = _check_result(HGNC, hgnc, checks)
+    if status == NOT_FOUND:
+        abort(json_error(f"TSV file row number `{row_i}`: HGNC '{hgnc}' is not found in catalogue", 406))
+    elif status == PROBLEM:
+        # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
+        abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating HGNC '{hgnc}'", 406))
+
+
+def validate_uberon_id(row_i: int, ontology_id: str, checks: IdentifierChecks = None) -> None:
+    if not ontology_id.startswith(UBERON_PREFIX):
+        abort(json_error(f"TSV file row number `{row_i}`: UBERON Ontoloty ID "
+                         f"'{ontology_id}' must begin with '{UBERON_PREFIX}'", 406))
+    validate_ontology(row_i, ontology_id, checks)
+
+
+def validate_ontology(row_i: int, ontology_id: str, checks: IdentifierChecks = None) -> None:
+    status, _ = _check_result(ONTOLOGY, ontology_id, checks)
+    if status == NOT_FOUND:
+        abort(json_error(f"TSV file row number `{row_i}`: Ontology ID '{ontology_id}' is not found", 406))
+    elif status == PROBLEM:
         # TODO: This should probably return a 502 and the frontend needs to be modified to handle it.
         abort(json_error(f"TSV file row number `{row_i}`: Problem encountered validating ontology_id '{ontology_id}'", 406))
-    finally:
-        if response is not None:
-            response.close()
 
 
-def validate_antibodytsv_row(row_i: int, row: dict, request_files: dict, ubkg_api_url: str, cur):
+def validate_antibodytsv_row(row_i: int, row: dict, pdf_files: PdfFiles, ubkg_api_url: str, cur,
+                             checks: IdentifierChecks = None, previous_versions: dict = None):
     """
     This routine will behave as follows.
     1) if any of the validation tests are found to fail it will throw an abort message with http status code,
@@ -434,47 +700,35 @@ def validate_antibodytsv_row(row_i: int, row: dict, request_files: dict, ubkg_ap
 
     validate_row_data(row_i, row)
 
-    found_pdf: str = None
-    if 'pdf' in request_files:
-        for avr_pdf_file in request_files.getlist('pdf'):
-            if avr_pdf_file.filename == row['avr_pdf_filename']:
-                pdf_file_content: bytes = avr_pdf_file.stream.read()
-                # Since this is a stream, we need to go back to the beginning or the next time that it is read
-                # it will be read from the end where there are no characters providing an empty file.
-                pdf_file_size_mb: float = len(pdf_file_content)/(1024.0*1000.0)
-                max_ingest_file_upload_size_mb: float = 10.0
-                if pdf_file_size_mb >= max_ingest_file_upload_size_mb:
-                    abort(json_error(f"TSV file row number `{row_i}`: avr_pdf_filename '{row['avr_pdf_filename']}'"
-                                     f" is over maximum file size of {max_ingest_file_upload_size_mb}MB", 406))
-                avr_pdf_file.stream.seek(0)
-                logger.debug("validate_antibodytsv_row: avr_pdf_file.filename:"
-                             f" {row['avr_pdf_filename']}; size: {pdf_file_size_mb}MB")
-                try:
-                    # https://pypdf.readthedocs.io/en/stable/modules/PdfReader.html
-                    PdfReader(io.BytesIO(pdf_file_content))
-                    logger.debug("validate_antibodytsv_row: Processing"
-                                 f" avr_pdf_filename: {avr_pdf_file.filename}; is a valid PDF file")
-                    found_pdf = avr_pdf_file.filename
-                    break
-                except PdfReadError:
-                    abort(json_error(f"TSV file row number `{row_i}`: avr_pdf_filename '{row['avr_pdf_filename']}'"
-                                     " found, but not a valid PDF file", 406))
-        if found_pdf is None:
-            abort(json_error(f"TSV file row number `{row_i}`: avr_pdf_filename '{row['avr_pdf_filename']}' is not found", 406))
-    else:
+    # The file is looked up by name (see utils/pdf_files), and its size and validity are only found out once.
+    pdf_file: PdfFile = pdf_files.get(row['avr_pdf_filename'])
+    if pdf_file is None:
         abort(json_error(f"TSV file row number `{row_i}`: avr_pdf_filename '{row['avr_pdf_filename']}' is not found", 406))
-
-    validate_previous_version_id(row_i, row['previous_version_id'], cur)
-    # All of these make callouts to other RestAPIs...
-    validate_uniprot_accession_numbers(row_i, row['uniprot_accession_number'])
-    validate_hgncs(row_i, row['hgnc_id'])
-    target_data: dict = validate_targets(row_i, row['target_symbol'], ubkg_api_url)
-    validate_rrid(row_i, row['rrid'])
-    validate_dois(row_i, row['protocol_doi'])
-    validate_orcids(row_i, row['author_orcids'])
-    validate_uberon_id(row_i, row['organ_uberon_id'])
+    pdf_file_size_mb: float = pdf_file.size/(1024.0*1000.0)
+    max_ingest_file_upload_size_mb: float = 10.0
+    if pdf_file_size_mb >= max_ingest_file_upload_size_mb:
+        abort(json_error(f"TSV file row number `{row_i}`: avr_pdf_filename '{row['avr_pdf_filename']}'"
+                         f" is over maximum file size of {max_ingest_file_upload_size_mb}MB", 406))
+    logger.debug("validate_antibodytsv_row: avr_pdf_file.filename:"
+                 f" {row['avr_pdf_filename']}; size: {pdf_file_size_mb}MB")
+    if not pdf_file.is_valid():
+        abort(json_error(f"TSV file row number `{row_i}`: avr_pdf_filename '{row['avr_pdf_filename']}'"
+                         " found, but not a valid PDF file", 406))
+    found_pdf: str = pdf_file.filename
+
+    validate_previous_version_id(row_i, row['previous_version_id'], cur, previous_versions)
+    # All of these make callouts to other RestAPIs (unless 'checks' has already made them)...
+    validate_uniprot_accession_numbers(row_i, row['uniprot_accession_number'], checks)
+    validate_hgncs(row_i, row['hgnc_id'], checks)
+    target_data: dict = validate_targets(row_i, row['target_symbol'], ubkg_api_url, checks)
+    validate_rrid(row_i, row['rrid'], checks)
+    validate_dois(row_i, row['protocol_doi'], checks)
+    validate_orcids(row_i, row['author_orcids'], checks)
+    validate_uberon_id(row_i, row['organ_uberon_id'], checks)
     if row['manuscript_doi'] != '':
-        validate_doi(row_i, row['manuscript_doi'])
+        validate_doi(row_i, row['manuscript_doi'], checks)
+    if 'cell_marker' in row:
+        validate_cell_marker(row_i, row['cell_marker'], ubkg_api_url, checks)
 
     return found_pdf, target_data
 
@@ -513,7 +767,7 @@ def call_cedar_api(file_obj):
 
     return response
 
-def validate_antibodytsv(request_files: dict, ubkg_api_url: str):
+def validate_antibodytsv(request_files: dict, ubkg_api_url: str, on_row=None, pdf_files: PdfFiles = None):
     """
     Used to validate the content of the uploaded .tsv file.
 
@@ -531,39 +785,53 @@ def validate_antibodytsv(request_files: dict, ubkg_api_url: str):
     'target_symbol' (i.e., approved name for the target from UBKG), and also 'target_aliases' for the
     'target_symbol' which is a list that contains strings that can be searched for this target
     (i.e, aliases, previous, approved).
+    3) A dictionary that maps each 'previous_version_id' in the .tsv file to what the import needs of that
+    antibody (see find_previous_versions()).
+
+    The .pdf files are found through 'pdf_files' so that an import can go on using them (see utils/pdf_files),
+    and it is made from the 'request_files' when it is not given.
+
+    When given, 'on_row(row_i)' is called as each row is validated (e.g., to report the progress of an import job).
     """
     start_time = time.time()
     pdf_files_processed: list = []
     target_datas: dict = {}
-
-    with psycopg2.connect(
-        host = current_app.config['DATABASE_HOST'],
-        dbname = current_app.config['DATABASE_NAME'],
-        user = current_app.config['DATABASE_USER'],
-        password = current_app.config['DATABASE_PASSWORD']
-    ) as conn:
-        with conn.cursor() as cur:
-            previous_version_ids = []
-            for file in request_files.getlist('file'):
-                if not file or file.filename == '':
-                    abort(json_error('Filename missing in uploaded files', 406))
-                if file and allowed_file(file.filename):
-                    cedar_response = call_cedar_api(file)
-                    file.stream.seek(0)
-                    lines: [str] = [x.decode("ascii", "ignore") for x in file.stream.read().splitlines()]
-                    file.stream.seek(0)
-                    logger.debug(f'Lines: {lines}')
-                    # TODO: Limit the number of lines to 16 (header plus 15 lines of data)
-                    logger.debug(f"validate_antibodytsv: processing filename '{file.filename}'")
-                    row_i = 1
-                    for row_dr in csv.DictReader(lines, delimiter='\t'):
-                        row = {k.lower().strip(): v.strip() for k, v in row_dr.items()}
+    previous_versions: dict = {}
+    if pdf_files is None:
+        pdf_files = PdfFiles(request_files)
+
+    app = current_app._get_current_object()
+    # The lookups share the app context's pooled connection (see get_cursor()).
+    with get_cursor(current_app) as cur:
+        previous_version_ids = []
+        for file in request_files.getlist('file'):
+            if not file or file.filename == '':
+                abort(json_error('Filename missing in uploaded files', 406))
+            if file and allowed_file(file.filename):
+                cedar_response = call_cedar_api(file)
+                file.stream.seek(0)
+                lines: [str] = [x.decode("ascii", "ignore") for x in file.stream.read().splitlines()]
+                file.stream.seek(0)
+                logger.debug(f'Lines: {lines}')
+                # TODO: Limit the number of lines to 16 (header plus 15 lines of data)
+                logger.debug(f"validate_antibodytsv: processing filename '{file.filename}'")
+                rows: list = [{k.lower().strip(): v.strip() for k, v in row_dr.items()}
+                              for row_dr in csv.DictReader(lines, delimiter='\t')]
+                # A row's previous version is looked up with the rest of the file's, before the rows are validated.
+                file_previous_versions: dict = find_previous_versions(rows, cur)
+                previous_versions |= file_previous_versions
+                with IdentifierChecks(app, ubkg_api_url) as checks:
+                    checks.plan(rows)
+                    # The first data row is row 2 (after the header).
+                    for row_i, row in enumerate(rows, start=2):
+                        if on_row is not None:
+                            on_row(row_i)
                         if row['previous_version_id']:
                             if row['previous_version_id'] in previous_version_ids:
                                 abort(json_error('Multiple rows contain the same value "previous_revision_hubmap_id". Each antibody may only have a single next revision', 406))
                             previous_version_ids.append(row['previous_version_id'])
-                        row_i = row_i + 1
-                        found_pdf, target_data = validate_antibodytsv_row(row_i, row, request_files, ubkg_api_url, cur)
+                        found_pdf, target_data = validate_antibodytsv_row(row_i, row, pdf_files, ubkg_api_url, cur, checks,
+                                                                          file_previous_versions)
                         if found_pdf is not None:
                             logger.debug(f"validate_antibodytsv: TSV file row number `{row_i}`:"
                                         f" found PDF file '{found_pdf}' as valid PDF")
@@ -574,7 +842,7 @@ def validate_antibodytsv(request_files: dict, ubkg_api_url: str):
     logger.debug(f"validate_antibodytsv: found valid PDF files ({len(pdf_files_processed)}): '{pdf_files_processed}'")
     logger.debug(f"validate_antibodytsv: found target_datas ({len(target_datas)}): '{target_datas}'")
     logger.debug(f"validate_antibodytsv: run time: {datetime.timedelta(seconds=time.time() - start_time)}")
-    return pdf_files_processed, target_datas
+    return pdf_files_processed, target_datas, previous_versions
 
 
 # TODO: Apparently a POST has a 100MB limit which we cannot check here.
@@ -592,8 +860,14 @@ if __name__ == '__main__':
 
     # Since 'validate_antibodytsv' is intended to be called within a Flask App, we need to dummy one up here.
     from flask import Flask, request
+    from antibodyapi.default_config import DefaultConfig
+    from antibodyapi.utils import db, ubkg, validation_cache
     app = Flask(__name__)
+    app.config.from_object(DefaultConfig)
     app.config.from_pyfile('../../../../instance/app.conf')
+    db.init_app(app)
+    ubkg.init_app(app)
+    validation_cache.init_app(app)
     data: dict = {
         'file': [open(args.tsv_file, 'rb')],
         'pdf': [open(pdf_file, 'rb') for pdf_file in args.pdf_file]
@@ -604,9 +878,10 @@ if __name__ == '__main__':
         ubkg_api_url: str = app.config['UBKG_API_URL']
 
         start = time.time()
-        pdf_files_processed, target_datas =\
+        pdf_files_processed, target_datas, previous_versions =\
             validate_antibodytsv(request.files, ubkg_api_url)
         end = time.time()
         print(f"pdf_files_processed ({len(pdf_files_processed)}): {pdf_files_processed}")
         print(f"target_datas ({len(target_datas)}): {target_datas}")
+        print(f"previous_versions ({len(previous_versions)}): {previous_versions}")
         print(f"Run time: {datetime.timedelta(seconds = end - start)}")
@@ -0,0 +1,146 @@
+import psycopg2
+from antibodyapi.utils.cache import TTLCache
+from antibodyapi.utils.db import pooled_connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The status of checking an identifier (see check_identifier() in utils/validation). Only VALID and
+# NOT_FOUND are cached; PROBLEM means that the service could not be reached.
+VALID, NOT_FOUND, PROBLEM = 'valid', 'not_found', 'problem'
+
+
+class ValidationCache:
+    """
+    Caches the outcome of checking an external identifier (see check_identifier() in
+    utils/validation), keyed by the (kind, value) of the identifier.
+
+    An identifier that was found is cached for VALIDATION_CACHE_TTL seconds, and one that was not
+    found for VALIDATION_CACHE_NEGATIVE_TTL seconds so that a newly registered identifier is soon
+    accepted. A problem reaching the service is not cached. Outcomes are kept in process in a
+    TTLCache of VALIDATION_CACHE_MAXSIZE entries and, when VALIDATION_CACHE_PERSISTENT is set, also
+    in the 'identifier_validation_cache' table so that they are shared by all workers and nodes.
+    """
+
+    def __init__(self, config, db_pool=None):
+        self.ttls: dict = {
+            VALID: config['VALIDATION_CACHE_TTL'],
+            NOT_FOUND: config['VALIDATION_CACHE_NEGATIVE_TTL'],
+        }
+        self.memory = TTLCache(config['VALIDATION_CACHE_MAXSIZE'], config['VALIDATION_CACHE_TTL'])
+        self.persistent = PostgresValidationCache(db_pool, config['VALIDATION_CACHE_MAX_ROWS'])\
+            if config['VALIDATION_CACHE_PERSISTENT'] else None
+
+    def get(self, kind: str, value: str):
+        """
+        Return the cached status of the identifier, or None.
+        """
+        key: tuple = (kind, value)
+        status = self.memory.get(key)
+        if status is not None:
+            return status
+        if self.persistent is not None:
+            cached = self.persistent.get(kind, value)
+            if cached is not None:
+                status, ttl = cached
+                self.memory.set(key, status, ttl)
+                return status
+        return None
+
+    def get_many(self, identifiers: list) -> dict:
+        """
+        Return the cached status of each of the (kind, value) 'identifiers' that is cached, looking
+        up those that are not in process with one query.
+        """
+        result: dict = {}
+        missing: list = []
+        for identifier in identifiers:
+            status = self.memory.get(identifier)
+            if status is not None:
+                result[identifier] = status
+            else:
+                missing.append(identifier)
+        if self.persistent is not None and missing:
+            for kind, value, status, ttl in self.persistent.get_many(missing):
+                self.memory.set((kind, value), status, ttl)
+                result[(kind, value)] = status
+        return result
+
+    def set(self, kind: str, value: str, status: str) -> None:
+        ttl = self.ttls.get(status)
+        if ttl is None or ttl <= 0:
+            return
+        self.memory.set((kind, value), status, ttl)
+        if self.persistent is not None:
+            self.persistent.set(kind, value, status, ttl)
+
+
+class PostgresValidationCache:
+    """
+    The 'identifier_validation_cache' table tier of the ValidationCache. Expired rows are deleted,
+    and the table is cut back to the 'max_rows' that expire last, every 'prune_every' sets.
+    Failures here are logged and treated as a miss, since the cache only saves calls to the
+    external services.
+    """
+    prune_every: int = 1000
+
+    def __init__(self, db_pool, max_rows: int):
+        self.db_pool = db_pool
+        self.max_rows: int = max_rows
+        self._sets: int = 0
+
+    def get(self, kind: str, value: str):
+        """
+        Return (status, remaining ttl) of the identifier, or None.
+        """
+        return self._execute('''
+            SELECT status, expires_at - EXTRACT(epoch FROM NOW()) FROM identifier_validation_cache
+            WHERE kind = %s AND value = %s AND expires_at > EXTRACT(epoch FROM NOW())
+        ''', (kind, value), fetch=True)
+
+    def get_many(self, identifiers: list) -> list:
+        """
+        Return (kind, value, status, remaining ttl) of each of the (kind, value) 'identifiers'
+        found.
+        """
+        return self._execute('''
+            SELECT c.kind, c.value, c.status, c.expires_at - EXTRACT(epoch FROM NOW())
+            FROM identifier_validation_cache c
+            JOIN unnest(%s::text[], %s::text[]) AS i(kind, value)
+                ON c.kind = i.kind AND c.value = i.value
+            WHERE c.expires_at > EXTRACT(epoch FROM NOW())
+        ''', ([kind for kind, _ in identifiers], [value for _, value in identifiers]),
+            fetch_all=True) or []
+
+    def set(self, kind: str, value: str, status: str, ttl: float) -> None:
+        self._execute('''
+            INSERT INTO identifier_validation_cache (kind, value, status, expires_at)
+            VALUES (%s, %s, %s, EXTRACT(epoch FROM NOW()) + %s)
+            ON CONFLICT (kind, value) DO UPDATE
+            SET status = EXCLUDED.status, expires_at = EXCLUDED.expires_at
+        ''', (kind, value, status, ttl))
+        self._sets += 1
+        if self._sets % self.prune_every == 0:
+            self._execute('''
+                DELETE FROM identifier_validation_cache WHERE expires_at <= EXTRACT(epoch FROM NOW())
+            ''', ())
+            self._execute('''
+                DELETE FROM identifier_validation_cache WHERE (kind, value) IN (
+                    SELECT kind, value FROM identifier_validation_cache ORDER BY expires_at DESC OFFSET %s
+                )
+            ''', (self.max_rows,))
+
+    def _execute(self, query: str, params: tuple, fetch: bool = False, fetch_all: bool = False):
+        try:
+            with pooled_connection(pool=self.db_pool) as conn, conn.cursor() as cur:
+                cur.execute(query, params)
+                if fetch_all:
+                    return cur.fetchall()
+                return cur.fetchone() if fetch else None
+        except psycopg2.Error as e:
+            logger.error(f"PostgresValidationCache: {e}")
+            return None
+
+
+def init_app(app) -> None:
+    app.extensions['validation_cache'] = ValidationCache(app.config, app.extensions.get('db_pool'))
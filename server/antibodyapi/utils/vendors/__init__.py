@@ -0,0 +1,106 @@
+from flask import current_app
+from psycopg2.extras import execute_values
+from antibodyapi.utils.cache import TTLCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class VendorCache(TTLCache):
+    """
+    The ids of vendors, keyed by UPPER(vendor_name) as PostgreSQL computes it (and vendors_unique_index is),
+    kept in process for VENDOR_CACHE_TTL seconds. Vendors are only cached (see cache_vendors()) once the
+    transaction that found them has committed: one that it created, or read after another of its statements
+    created it, would not exist should it roll back.
+
+    Python's str.upper() does not always agree with PostgreSQL's UPPER() (e.g., 'ß'), so the key of each
+    vendor name is also kept in 'keys' once the database has given it.
+    """
+
+    def __init__(self, config):
+        super().__init__(config['VENDOR_CACHE_MAXSIZE'], config['VENDOR_CACHE_TTL'])
+        self.keys = TTLCache(config['VENDOR_CACHE_MAXSIZE'], config['VENDOR_CACHE_TTL'])
+
+
+def find_or_create_vendors(cursor, vendor_names, found: dict = None) -> dict:
+    """
+    The id of each of the 'vendor_names', keyed by the name as given, creating the vendors that do not exist.
+    Names that differ only in case are the same vendor.
+
+    Whatever the number of names this takes at most one query to find them, one multi-row INSERT to create
+    those that are missing, and one more query should another transaction have created any of them meanwhile.
+
+    'found' holds the vendors already found in the transaction of the 'cursor', keyed by UPPER(vendor_name),
+    which are not looked up again, and the vendors found now are added to it; once the transaction has
+    committed they can be cached with cache_vendors().
+    """
+    vendor_cache: VendorCache = current_app.extensions['vendor_cache']
+    found = {} if found is None else found
+    vendor_ids: dict = {}
+    # The names to look up, in order.
+    unknown: dict = {}
+    for vendor_name in vendor_names:
+        if vendor_name in vendor_ids or vendor_name in unknown:
+            continue
+        key: str = vendor_cache.keys.get(vendor_name)
+        vendor_id = None
+        if key is not None:
+            vendor_id = found.get(key)
+            if vendor_id is None:
+                vendor_id = vendor_cache.get(key)
+        if vendor_id is not None:
+            vendor_ids[vendor_name] = vendor_id
+        else:
+            unknown[vendor_name] = None
+    if not unknown:
+        return vendor_ids
+
+    # The key of each name comes from the database, along with the id of its vendor if there is one.
+    keys: dict = {}
+    # The first spelling of a vendor is the one that is saved.
+    missing: dict = {}
+    cursor.execute('''
+        SELECT n.vendor_name, UPPER(n.vendor_name), v.id
+        FROM unnest(%s::text[]) WITH ORDINALITY AS n(vendor_name, i)
+        LEFT JOIN vendors v ON UPPER(v.vendor_name) = UPPER(n.vendor_name)
+        ORDER BY n.i
+    ''', (list(unknown),))
+    for vendor_name, key, vendor_id in cursor.fetchall():
+        keys[vendor_name] = key
+        vendor_cache.keys.set(vendor_name, key)
+        if vendor_id is not None:
+            found[key] = vendor_id
+        elif key not in missing:
+            missing[key] = vendor_name
+    if missing:
+        inserted: list = execute_values(cursor, '''
+            INSERT INTO vendors (vendor_name) VALUES %s
+            ON CONFLICT ((UPPER(vendor_name))) DO NOTHING
+            RETURNING UPPER(vendor_name), id
+        ''', [(vendor_name,) for vendor_name in missing.values()], fetch=True)
+        for key, vendor_id in inserted:
+            found[key] = vendor_id
+            del missing[key]
+        logger.info(f"find_or_create_vendors: created {len(inserted)} vendors")
+    if missing:
+        # Created by another transaction since they were looked for.
+        cursor.execute('SELECT UPPER(vendor_name), id FROM vendors WHERE UPPER(vendor_name) = ANY(%s)',
+                       (list(missing),))
+        for key, vendor_id in cursor.fetchall():
+            found[key] = vendor_id
+    for vendor_name, key in keys.items():
+        vendor_ids[vendor_name] = found[key]
+    return vendor_ids
+
+
+def cache_vendors(found: dict) -> None:
+    """
+    Cache the vendors 'found' (see find_or_create_vendors()) by a transaction, once it has committed.
+    """
+    vendor_cache: VendorCache = current_app.extensions['vendor_cache']
+    for key, vendor_id in found.items():
+        vendor_cache.set(key, vendor_id)
+
+
+def init_app(app) -> None:
+    app.extensions['vendor_cache'] = VendorCache(app.config)
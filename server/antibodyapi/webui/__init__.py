@@ -1,9 +1,10 @@
 from flask import (
     abort, Blueprint, redirect, render_template, session,
-    request, current_app, send_from_directory
+    request, current_app, send_from_directory, jsonify, make_response
 )
 import os
-from antibodyapi.utils.elasticsearch import execute_query
+from antibodyapi.utils.etag import add_validators, not_modified
+from antibodyapi.utils.search import search_with_etag
 import logging
 import html5lib
 
@@ -185,5 +186,13 @@ def search():
     # Use the app.config['DEFAULT_INDEX_WITHOUT_PREFIX'] since /search doesn't take any index
     # target_index = get_target_index(request, app.config['DEFAULT_INDEX_WITHOUT_PREFIX'])
 
+    # A search whose result is unchanged is answered with a 304. Its ETag is cached with the result
+    # (see utils/search), so neither takes more than the search itself.
+    query = request.get_json()
+    result, etag = search_with_etag(query)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
     # Return the elasticsearch resulting json data as json string
-    return execute_query(request.get_json())
+    return add_validators(make_response(jsonify(result)), etag)
@@ -5,6 +5,7 @@ import pytest
 from faker import Faker
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from antibodyapi import create_app
+from antibodyapi.utils import vendors
 
 @pytest.hookimpl(hookwrapper=True)
 def pytest_runtest_makereport(item, call): # pylint: disable=unused-argument
@@ -109,11 +110,18 @@ def cursor(conn):
     yield cur
     cur.execute('DELETE FROM antibodies')
     cur.execute('DELETE FROM vendors')
+    cur.execute('DELETE FROM hubmap_id_reserve')
     cur.close()
 
 @pytest.fixture(scope='session')
 def flask_app():
-    return create_app(testing=True)
+    app = create_app(testing=True)
+    # The tests check the response of an import rather than polling its job.
+    app.config['IMPORT_ANTIBODIES_ASYNC'] = False
+    # The vendors are deleted after each test, so their ids must not be cached.
+    app.config['VENDOR_CACHE_TTL'] = 0
+    vendors.init_app(app)
+    return app
 
 @pytest.fixture(scope='session')
 def headers(mimetype):
@@ -16,7 +16,7 @@ class TestGetAntibodies(AntibodyTesting):
             sess['name'] = 'Name'
             sess['email'] = 'name@example.com'
             sess['sub'] = '1234567890'
-        class_mocker.patch('elasticsearch.Elasticsearch')
+        class_mocker.patch('antibodyapi.utils.elasticsearch.get_es_client')
         client.post('/antibodies', data=json.dumps(antibody_data), headers=headers)
         return client.get('/antibodies', headers=headers)
 
@@ -39,3 +39,78 @@ class TestGetAntibodies(AntibodyTesting):
         expected_data = { k: v for k, v in received_antibody.items() if k not in expected_fields }
         sent_data = { k: v for k, v in antibody_data['antibody'].items() if k[0] != '_' }
         assert sent_data == expected_data
+
+    @pytest.fixture(scope='class')
+    def response_ndjson(self, client, response):
+        return client.get('/antibodies?format=ndjson')
+
+    def test_ndjson_should_return_one_antibody_per_line(self, response, response_ndjson):
+        """GET /antibodies?format=ndjson should return the same antibodies one per line"""
+        assert response_ndjson.mimetype == 'application/x-ndjson'
+        received_antibodies = [json.loads(line) for line in response_ndjson.data.splitlines()]
+        assert received_antibodies == json.loads(response.data)['antibodies']
+
+    @pytest.fixture(scope='class')
+    def response_projected_page(self, client, response):
+        return client.get('/antibodies?fields=antibody_hubmap_id,rrid&limit=1')
+
+    def test_fields_and_limit_return_a_projected_page(self, response_projected_page):
+        """GET /antibodies?fields=...&limit=1 should return one antibody with only those fields"""
+        received = json.loads(response_projected_page.data)
+        assert len(received['antibodies']) == 1
+        assert set(received['antibodies'][0]) == {'antibody_hubmap_id', 'rrid'}
+        assert 'next_after' in received
+
+    def test_unknown_field_should_return_400(self, client):
+        """GET /antibodies?fields=... with an unknown field should return 400"""
+        assert client.get('/antibodies?fields=rrid,nonsense').status_code == 400
+
+    def test_invalid_limit_should_return_400(self, client):
+        """GET /antibodies?limit=0 should return 400"""
+        assert client.get('/antibodies?limit=0').status_code == 400
+
+    def test_matching_if_none_match_should_return_304(self, client, headers, response):
+        """GET /antibodies with the ETag of an unchanged catalog should return 304"""
+        etag = response.headers['ETag']
+        assert client.get('/antibodies', headers=headers | {'If-None-Match': etag}).status_code == 304
+
+class TestStreamAntibodies:
+    # pylint: disable=no-self-use
+    @pytest.fixture
+    def db_pool(self, mocker):
+        mocker.patch('antibodyapi.list_antibodies.catalog_etag', return_value=None)
+        db_pool = mocker.Mock()
+        db_pool.getconn.return_value.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+        mocker.patch('antibodyapi.list_antibodies.get_db_pool', return_value=db_pool)
+        mocker.patch('antibodyapi.list_antibodies.projected_antibody_query_result_to_json',
+                     side_effect=lambda row, fields: {'id': row[0]})
+        return db_pool
+
+    def test_head_closes_the_cursor(self, client, db_pool):
+        """HEAD /antibodies should close its cursor and give its connection back without reading the rows"""
+        response = client.head('/antibodies')
+        response.close()
+        # A cursor in a transaction, which is not materialised when it is declared as one WITH HOLD would be.
+        db_pool.getconn.assert_called_once_with(autocommit=False)
+        conn = db_pool.getconn.return_value
+        conn.cursor.return_value.close.assert_called_once()
+        db_pool.putconn.assert_called_once_with(conn)
+        conn.cursor.return_value.fetchmany.assert_not_called()
+
+    def test_early_close_closes_the_cursor(self, client, db_pool):
+        """GET /antibodies closed before its body was read should close its cursor and give its connection back"""
+        response = client.get('/antibodies', buffered=False)
+        assert next(iter(response.response)) == b'{"antibodies": ['
+        response.close()
+        db_pool.putconn.assert_called_once_with(db_pool.getconn.return_value)
+
+    def test_cursors_have_names_of_their_own(self, client, db_pool):
+        """Each GET /antibodies should stream from a cursor of its own"""
+        for _ in range(2):
+            response = client.get('/antibodies')
+            assert response.json == {'antibodies': [{'id': 1}]}
+            response.close()
+            db_pool.getconn.return_value.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+        names = [c.kwargs['name'] for c in db_pool.getconn.return_value.cursor.call_args_list]
+        assert len(set(names)) == 2
+        assert db_pool.putconn.call_count == 2
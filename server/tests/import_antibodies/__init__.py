@@ -0,0 +1,203 @@
+import io
+from unittest import mock
+from uuid import uuid4
+import psycopg2
+import pytest
+from antibodyapi.import_antibodies import _insert_antibodies
+from antibodyapi.utils.hubmap_ids import mint_hubmap_ids, reserve_hubmap_ids
+from antibodyapi.utils.vendors import VendorCache, cache_vendors, find_or_create_vendors
+
+class TestImportJobs:
+    # pylint: disable=no-self-use, unused-argument
+    @pytest.fixture
+    def authorized(self, client, flask_app, mocker, monkeypatch):
+        # Both are only set in app.conf.
+        monkeypatch.setitem(flask_app.config, 'SECRET_KEY', 'test')
+        monkeypatch.setitem(flask_app.config, 'CONSORTIUM_AVR_UPLOADERS_GROUP_ID', 'group')
+        with client.session_transaction() as sess:
+            sess['is_authenticated'] = True
+            sess['is_authorized'] = True
+            sess['groups_access_token'] = 'woot'
+            sess['name'] = 'Name'
+            sess['email'] = 'name@example.com'
+            sess['sub'] = '1234567890'
+        mocker.patch('antibodyapi.utils.decorators._require_token', return_value=({'id': 'group'}, 'woot'))
+
+    def test_import_is_queued_as_job(self, client, flask_app, authorized, mocker, monkeypatch):
+        """POST /antibodies/import should queue a job and return 202 with where to poll it"""
+        monkeypatch.setitem(flask_app.config, 'IMPORT_ANTIBODIES_ASYNC', True)
+        mocker.patch('antibodyapi.import_antibodies.get_group_id', return_value='group')
+        start_job = mocker.patch('antibodyapi.import_antibodies.start_job', return_value='abc123')
+        response = client.post(
+            '/antibodies/import',
+            content_type='multipart/form-data',
+            data={'file': (io.BytesIO(b'uniprot_accession_number\n'), 'antibodies.tsv')},
+            headers={'Authorization': 'Bearer woot'}
+        )
+        assert response.status == '202 ACCEPTED'
+        assert response.json['job_id'] == 'abc123'
+        assert response.headers['Location'].endswith('/antibodies/import/abc123')
+        files, group_id, user = start_job.call_args.args[2:]
+        # The files are read before the request is closed.
+        assert files['file'].read() == b'uniprot_accession_number\n'
+        assert group_id == 'group'
+        assert user['token'] == 'woot'
+        assert start_job.call_args.kwargs['created_by_user_sub'] == '1234567890'
+
+    def test_import_job_reports_progress(self, client, authorized, mocker):
+        """GET /antibodies/import/<job_id> should report the phase and progress of the import"""
+        mocker.patch('antibodyapi.import_antibodies.get_job', return_value={
+            'job_id': 'abc123', 'status': 'running', 'phase': 'importing', 'errors': [], 'result': None,
+            'progress': {'row': 4, 'rows_done': 2, 'rows_total': 10}, 'created_by_user_sub': '1234567890'
+        })
+        response = client.get('/antibodies/import/abc123', headers={'Authorization': 'Bearer woot'})
+        assert response.status == '200 OK'
+        assert response.json['phase'] == 'importing'
+        assert response.json['rows_done'] == 2
+        assert response.json['rows_total'] == 10
+
+    @pytest.mark.parametrize('data_admin, status', [(False, '404 NOT FOUND'), (True, '200 OK')])
+    def test_import_job_of_other_user(self, client, authorized, mocker, data_admin, status):
+        """GET /antibodies/import/<job_id> should only show an import to the user who started it, or a data admin"""
+        mocker.patch('antibodyapi.import_antibodies.get_job', return_value={
+            'job_id': 'abc123', 'status': 'failed', 'phase': 'validating', 'errors': [], 'result': None,
+            'progress': {}, 'created_by_user_sub': 'someone-else'
+        })
+        mocker.patch('antibodyapi.import_antibodies.is_data_admin', return_value=data_admin)
+        response = client.get('/antibodies/import/abc123', headers={'Authorization': 'Bearer woot'})
+        assert response.status == status
+
+    def test_unknown_import_job_is_not_found(self, client, authorized, mocker):
+        """GET /antibodies/import/<job_id> for an unknown job should return 404"""
+        mocker.patch('antibodyapi.import_antibodies.get_job', return_value=None)
+        response = client.get('/antibodies/import/nope', headers={'Authorization': 'Bearer woot'})
+        assert response.status == '404 NOT FOUND'
+
+class FakeUuidApi:
+    """A stand-in for the uuid-api's POST /hmuuid that mints at most 'limit' ids per request."""
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.requests = []
+
+    def post(self, url, params=None, **kwargs):
+        entity_count = params['entity_count']
+        self.requests.append(entity_count)
+        minted = [
+            {'uuid': str(uuid4()), 'hubmap_base_id': 'X', 'hubmap_id': f'HBM{len(self.requests)}.{i}'}
+            for i in range(min(entity_count, self.limit or entity_count))
+        ]
+        response = mock.Mock(status_code=200)
+        response.json.return_value = minted
+        return response
+
+class TestHubmapIds:
+    # pylint: disable=no-self-use
+    def test_ids_are_minted_in_batches(self, flask_app, mocker, monkeypatch):
+        """mint_hubmap_ids() should ask for UUID_API_BATCH_SIZE ids per request"""
+        monkeypatch.setitem(flask_app.config, 'UUID_API_BATCH_SIZE', 100)
+        uuid_api = FakeUuidApi()
+        mocker.patch('antibodyapi.utils.hubmap_ids.get_http_session', return_value=uuid_api)
+        with flask_app.app_context():
+            hubmap_ids = mint_hubmap_ids('http://uuid-api', 250, token='woot')
+        assert uuid_api.requests == [100, 100, 50]
+        assert len({i['uuid'] for i in hubmap_ids}) == 250
+
+    def test_short_batches_are_topped_up(self, flask_app, mocker):
+        """mint_hubmap_ids() should ask again for the ids that a request did not return"""
+        uuid_api = FakeUuidApi(limit=1)
+        mocker.patch('antibodyapi.utils.hubmap_ids.get_http_session', return_value=uuid_api)
+        with flask_app.app_context():
+            hubmap_ids = mint_hubmap_ids('http://uuid-api', 3, token='woot')
+        assert uuid_api.requests == [3, 2, 1]
+        assert len(hubmap_ids) == 3
+
+    def test_reserved_ids_have_no_dashes(self):
+        """reserve_hubmap_ids() should give the uuids as the uuid-api does, without dashes"""
+        uuid = uuid4()
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = [(1, str(uuid), 'HBM123.ABCD.456')]
+        hubmap_ids = reserve_hubmap_ids(cursor, 1, 'http://uuid-api', token='woot')
+        assert hubmap_ids == [{'uuid': uuid.hex, 'hubmap_id': 'HBM123.ABCD.456'}]
+
+class TestFindOrCreateVendors:
+    # pylint: disable=no-self-use
+    @pytest.fixture
+    def vendor_cache(self, flask_app):
+        vendor_cache = VendorCache(dict(flask_app.config, VENDOR_CACHE_TTL=60))
+        with mock.patch.dict(flask_app.extensions, {'vendor_cache': vendor_cache}):
+            yield vendor_cache
+
+    def test_vendors_are_found_and_created_together(self, flask_app, vendor_cache, mocker):
+        """find_or_create_vendors() should look up every vendor at once and create the missing ones with one INSERT"""
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = [
+            ('Abcam', 'ABCAM', 1), ('BioLegend', 'BIOLEGEND', None), ('abcam', 'ABCAM', 1),
+            ('Biolegend', 'BIOLEGEND', None)
+        ]
+        execute_values = mocker.patch('antibodyapi.utils.vendors.execute_values', return_value=[('BIOLEGEND', 2)])
+        with flask_app.app_context():
+            vendor_ids = find_or_create_vendors(cursor, ['Abcam', 'BioLegend', 'abcam', 'Biolegend'])
+        assert vendor_ids == {'Abcam': 1, 'BioLegend': 2, 'abcam': 1, 'Biolegend': 2}
+        cursor.execute.assert_called_once()
+        assert execute_values.call_args.args[2] == [('BioLegend',)]
+
+    def test_cached_vendors_are_not_queried(self, flask_app, vendor_cache):
+        """find_or_create_vendors() should not query for vendors that are cached"""
+        vendor_cache.keys.set('Abcam', 'ABCAM')
+        vendor_cache.set('ABCAM', 1)
+        cursor = mock.Mock()
+        with flask_app.app_context():
+            assert find_or_create_vendors(cursor, ['Abcam']) == {'Abcam': 1}
+        cursor.execute.assert_not_called()
+
+    def test_vendors_are_keyed_as_postgresql_upper_cases_them(self, flask_app, vendor_cache, mocker):
+        """A name that Python upper cases differently from PostgreSQL should still find its vendor"""
+        cursor = mock.Mock()
+        # PostgreSQL leaves 'ß' as it is where Python makes it 'SS'.
+        cursor.fetchall.return_value = [('Weiß', 'WEIß', None)]
+        mocker.patch('antibodyapi.utils.vendors.execute_values', return_value=[('WEIß', 3)])
+        with flask_app.app_context():
+            assert find_or_create_vendors(cursor, ['Weiß']) == {'Weiß': 3}
+
+    def test_vendors_are_only_cached_after_commit(self, flask_app, vendor_cache, mocker):
+        """Vendors found by a transaction that rolls back should not be cached, even once read back"""
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = [('BioLegend', 'BIOLEGEND', None)]
+        mocker.patch('antibodyapi.utils.vendors.execute_values', return_value=[('BIOLEGEND', 2)])
+        found: dict = {}
+        with flask_app.app_context():
+            # The first file of an import creates the vendor...
+            find_or_create_vendors(cursor, ['BioLegend'], found)
+            # ...which the second file finds in the transaction without querying for it.
+            cursor.execute.reset_mock()
+            assert find_or_create_vendors(cursor, ['BioLegend'], found) == {'BioLegend': 2}
+            cursor.execute.assert_not_called()
+            # The import rolls back, so cache_vendors() is never called.
+            assert vendor_cache.get('BIOLEGEND') is None
+            cache_vendors(found)
+        assert vendor_cache.get('BIOLEGEND') == 2
+
+class TestInsertAntibodies:
+    # pylint: disable=no-self-use
+    def test_rows_are_inserted_together(self, flask_app, mocker):
+        """_insert_antibodies() should insert all of the rows of a file with one INSERT"""
+        cursor = mock.Mock()
+        execute_values = mocker.patch('antibodyapi.import_antibodies.execute_values')
+        with flask_app.app_context():
+            _insert_antibodies(None, cursor, [(2, {'antibody_hubmap_id': 'A'}), (3, {'antibody_hubmap_id': 'B'})])
+        execute_values.assert_called_once()
+        assert execute_values.call_args.args[2] == [{'antibody_hubmap_id': 'A'}, {'antibody_hubmap_id': 'B'}]
+
+    def test_failing_row_is_found(self, flask_app, mocker):
+        """_insert_antibodies() should find the row that a failed INSERT failed on and report it to the job"""
+        cursor = mock.Mock()
+        job = mock.Mock()
+        execute_values = mocker.patch(
+            'antibodyapi.import_antibodies.execute_values',
+            side_effect=[psycopg2.Error('bulk'), None, psycopg2.Error('row 3'), None]
+        )
+        with flask_app.app_context(), pytest.raises(psycopg2.Error, match='row 3'):
+            _insert_antibodies(job, cursor, [(2, {}), (3, {}), (4, {})])
+        assert execute_values.call_count == 3
+        cursor.execute.assert_any_call('ROLLBACK TO SAVEPOINT insert_antibodies')
+        job.update.assert_called_with(row=3)
@@ -1,7 +1,11 @@
 import io
 import json
+from unittest import mock
+import elasticsearch
 import pytest
 from antibody_testing import AntibodyTesting
+from antibodyapi.restore_elasticsearch import _catch_up
+from antibodyapi.utils.elasticsearch import prune_versioned_indices, swap_index_alias
 from .mock_es import MockES
 
 class TestElasticsearchIndexing(AntibodyTesting):
@@ -24,7 +28,7 @@ class TestElasticsearchIndexing(AntibodyTesting):
             'antibody': { k: v for k, v in antibody_data['antibody'].items() if k[0] != '_' }
         }
         mock = mocker.patch.object(MockES, 'index')
-        mocker.patch('elasticsearch.Elasticsearch', new=MockES)
+        mocker.patch('antibodyapi.utils.elasticsearch.get_es_client', return_value=MockES())
         client.post('/antibodies', data=json.dumps(data_to_send), headers=headers)
         return mock
 
@@ -42,8 +46,8 @@ class TestElasticsearchIndexing(AntibodyTesting):
             sess['name'] = 'Name'
             sess['email'] = 'name@example.com'
             sess['sub'] = '1234567890'
-        mock = class_mocker.patch.object(MockES, 'index')
-        class_mocker.patch('elasticsearch.Elasticsearch', new=MockES)
+        mock = class_mocker.patch.object(MockES, 'bulk', autospec=True, side_effect=MockES.bulk)
+        class_mocker.patch('antibodyapi.utils.elasticsearch.get_es_client', return_value=MockES())
         client.post(
             '/antibodies/import',
             content_type='multipart/form-data',
@@ -78,4 +82,73 @@ class TestElasticsearchIndexing(AntibodyTesting):
     def test_antibodies_get_indexed_in_elasticsearch(
         self, antibody_data_multiple, response_csv_file
     ):
-        assert response_csv_file.call_count == len(antibody_data_multiple['antibody'])
+        assert MockES.count_actions(response_csv_file, 'index') == len(antibody_data_multiple['antibody'])
+
+class TestVersionedIndices:
+    # pylint: disable=no-self-use, unused-argument
+    @pytest.fixture
+    def es_conn(self, flask_app):
+        with flask_app.app_context():
+            yield mock.MagicMock()
+
+    def test_first_swap_keeps_copy_of_original_index(self, es_conn):
+        """Replacing a physical index with an alias should keep a copy of it to roll back to"""
+        es_conn.indices.exists_alias.return_value = False
+        es_conn.indices.exists.return_value = True
+        swap_index_alias(es_conn, 'antibodies', 'antibodies_20240102030405')
+        es_conn.indices.clone.assert_called_once()
+        assert es_conn.indices.clone.call_args.kwargs['index'] == 'antibodies'
+        assert es_conn.indices.clone.call_args.kwargs['target'] == 'antibodies_00000000000000'
+        actions = es_conn.indices.update_aliases.call_args.kwargs['body']['actions']
+        assert {'add': {'index': 'antibodies_20240102030405', 'alias': 'antibodies'}} in actions
+
+    def test_failed_first_swap_unblocks_original_index(self, es_conn):
+        """The original index should take writes again when the alias could not replace it"""
+        es_conn.indices.exists_alias.return_value = False
+        es_conn.indices.exists.return_value = True
+        es_conn.indices.update_aliases.side_effect = elasticsearch.ElasticsearchException('failed')
+        with pytest.raises(elasticsearch.ElasticsearchException):
+            swap_index_alias(es_conn, 'antibodies', 'antibodies_20240102030405')
+        es_conn.indices.put_settings.assert_called_with(
+            index='antibodies', body={'index': {'blocks': {'write': False}}}
+        )
+
+    def test_prune_keeps_previous_and_unrelated_indices(self, flask_app, es_conn, monkeypatch):
+        """Only versioned indices older than the ones kept should be deleted"""
+        monkeypatch.setitem(flask_app.config, 'ELASTICSEARCH_INDEX_KEEP_PREVIOUS', 1)
+        es_conn.indices.exists_alias.return_value = True
+        es_conn.indices.get_alias.return_value = {'antibodies_20240103000000': {}}
+        es_conn.indices.get.return_value = {
+            'antibodies_20240103000000': {}, 'antibodies_20240102000000': {}, 'antibodies_00000000000000': {},
+            'antibodies_backup': {}, 'antibodies_2024': {}
+        }
+        prune_versioned_indices(es_conn, 'antibodies')
+        es_conn.indices.delete.assert_called_once_with(index='antibodies_00000000000000', ignore=[404])
+
+class TestRestoreCatchUp:
+    # pylint: disable=no-self-use, unused-argument
+    def test_rows_written_during_restore_are_caught_up(self, flask_app, mocker):
+        """_catch_up() should index the rows written since the marker into the given index"""
+        marker_cursor, rows_cursor = mock.MagicMock(), mock.MagicMock()
+        marker_cursor.fetchone.return_value = (12, 1700000100.0)
+        rows_cursor.__iter__.return_value = iter([
+            {'antibody_hubmap_id': 'HBM1', 'target_symbol': 'CD4'},
+            {'antibody_hubmap_id': 'HBM2', 'target_symbol': 'CD4'}
+        ])
+        conn = mock.MagicMock()
+        conn.cursor.side_effect = lambda name=None: mock.MagicMock(
+            __enter__=mock.Mock(return_value=rows_cursor if name else marker_cursor)
+        )
+        mocker.patch('antibodyapi.restore_elasticsearch.pooled_connection').return_value.__enter__.return_value = conn
+        mocker.patch('antibodyapi.restore_elasticsearch.base_antibody_query_result_to_json', side_effect=dict)
+        target_aliases = mocker.patch('antibodyapi.restore_elasticsearch._target_aliases', return_value=['CD4'])
+        bulk_indexer = mocker.patch('antibodyapi.restore_elasticsearch.BulkIndexer')
+        bulk_indexer.return_value.close.return_value = []
+        with flask_app.app_context():
+            marker, rows_caught_up = _catch_up(mock.Mock(), 'http://ubkg', 'antibodies_20240102030405',
+                                               (10, 1700000000.0))
+        assert (marker, rows_caught_up) == ((12, 1700000100.0), 2)
+        assert rows_cursor.execute.call_args.args[1] == {'max_id': 10, 'since': 1700000000.0}
+        bulk_indexer.assert_called_once_with(index='antibodies_20240102030405')
+        assert bulk_indexer.return_value.index.call_count == 2
+        target_aliases.assert_called_once()
@@ -1,6 +1,30 @@
+import json
+
+
+class MockIndices:
+    # pylint: disable=no-self-use, too-few-public-methods
+    def refresh(self, **kwargs):
+        pass
+
+
 class MockES:
     # pylint: disable=no-self-use, too-few-public-methods
     def __init__(self, *_, **kwargs):
-        pass
+        self.indices = MockIndices()
     def index(self):
         pass
+    def bulk(self, body, **kwargs):
+        actions = [json.loads(line) for line in body.splitlines()[0::2]]
+        return {
+            'errors': False,
+            'items': [{op: {'status': 200}} for action in actions for op in action]
+        }
+
+    @classmethod
+    def count_actions(cls, bulk_mock, op):
+        count = 0
+        for call in bulk_mock.call_args_list:
+            for line in call.kwargs['body'].splitlines()[0::2]:
+                if op in json.loads(line):
+                    count += 1
+        return count
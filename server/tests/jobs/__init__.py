@@ -0,0 +1,41 @@
+import threading
+from unittest import mock
+import pytest
+from antibodyapi.utils import jobs
+
+class TestJobHeartbeat:
+    # pylint: disable=no-self-use, unused-argument, protected-access
+    @pytest.fixture
+    def cursor(self, flask_app, mocker, monkeypatch):
+        monkeypatch.setitem(flask_app.config, 'JOB_HEARTBEAT_INTERVAL', 0.01)
+        cursor = mock.MagicMock()
+        conn = mock.MagicMock()
+        conn.cursor.return_value.__enter__.return_value = cursor
+        mocker.patch('antibodyapi.utils.jobs.pooled_connection').return_value.__enter__.return_value = conn
+        return cursor
+
+    def test_live_jobs_have_heartbeat(self, flask_app, cursor):
+        """The heartbeat of the jobs of a process should be renewed until they finish"""
+        beaten = threading.Event()
+        cursor.execute.side_effect = lambda query, params: beaten.set()
+        jobs._add_live_job(flask_app, 'abc123')
+        heartbeat = jobs._heartbeats[jobs.os.getpid()]
+        try:
+            assert beaten.wait(5)
+            assert cursor.execute.call_args.args[1] == (('abc123',),)
+        finally:
+            jobs._remove_live_job('abc123')
+        heartbeat.join(5)
+        assert not heartbeat.is_alive()
+
+    def test_orphaned_jobs_of_any_kind_are_failed(self, flask_app, monkeypatch):
+        """Active jobs of any kind without a recent heartbeat should be marked failed"""
+        monkeypatch.setitem(flask_app.config, 'JOB_ORPHANED_AFTER', 300)
+        cursor = mock.MagicMock()
+        cursor.fetchall.return_value = [('import_antibodies', 'abc123')]
+        with flask_app.app_context():
+            jobs._fail_orphaned_jobs(cursor)
+        query, params = cursor.execute.call_args.args
+        assert 'heartbeat_timestamp' in query
+        assert 'kind = %s' not in query
+        assert params[1:] == (jobs.ACTIVE_STATUSES, 300)
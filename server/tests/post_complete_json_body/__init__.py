@@ -36,7 +36,7 @@ class TestPostWithCompleteJSONBody(AntibodyTesting):
         data_to_send = {
             'antibody': { k: v for k, v in antibody_data['antibody'].items() if k[0] != '_' }
         }
-        mocker.patch('elasticsearch.Elasticsearch')
+        mocker.patch('antibodyapi.utils.elasticsearch.get_es_client')
         return client.post('/antibodies', data=json.dumps(data_to_send), headers=headers)
 
     def test_antibody_gets_uuid_saved(
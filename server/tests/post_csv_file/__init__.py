@@ -260,7 +260,7 @@ class TestPostCSVFile(AntibodyTesting):
             sess['name'] = 'Name'
             sess['email'] = 'name@example.com'
             sess['sub'] = '1234567890'
-        class_mocker.patch('elasticsearch.Elasticsearch')
+        class_mocker.patch('antibodyapi.utils.elasticsearch.get_es_client')
         yield client.post(
             '/antibodies/import',
             content_type='multipart/form-data',
@@ -296,7 +296,7 @@ class TestPostCSVFile(AntibodyTesting):
             sess['name'] = 'Name'
             sess['email'] = 'name@example.com'
             sess['sub'] = '1234567890'
-        mocker.patch('elasticsearch.Elasticsearch')
+        mocker.patch('antibodyapi.utils.elasticsearch.get_es_client')
         yield client.post(
             '/antibodies/import',
             content_type='multipart/form-data',
@@ -315,7 +315,7 @@ class TestPostCSVFile(AntibodyTesting):
             sess['name'] = 'Name'
             sess['email'] = 'name@example.com'
             sess['sub'] = '1234567890'
-        mocker.patch('elasticsearch.Elasticsearch')
+        mocker.patch('antibodyapi.utils.elasticsearch.get_es_client')
         yield client.post(
             '/antibodies/import',
             content_type='multipart/form-data',
@@ -345,7 +345,7 @@ class TestPostCSVFile(AntibodyTesting):
             sess['name'] = 'Name'
             sess['email'] = 'name@example.com'
             sess['sub'] = '1234567890'
-        mocker.patch('elasticsearch.Elasticsearch')
+        mocker.patch('antibodyapi.utils.elasticsearch.get_es_client')
         return client.post(
             '/antibodies/import',
             content_type='multipart/form-data',
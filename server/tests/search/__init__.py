@@ -0,0 +1,129 @@
+import concurrent.futures
+import json
+import threading
+import time
+from unittest import mock
+import pytest
+from antibodyapi.utils.elasticsearch import IndexGeneration, index_changed
+from antibodyapi.utils.singleflight import SingleFlight
+from antibodyapi.utils.search import (
+    ElasticsearchBackend, SearchApiBackend, SearchError, make_search_backend
+)
+
+class TestSearchCache:
+    # pylint: disable=no-self-use, unused-argument
+    @pytest.fixture
+    def execute_query(self, flask_app, mocker):
+        flask_app.extensions['search_cache'].memory.clear()
+        return mocker.patch(
+            'antibodyapi.utils.search.execute_query',
+            return_value={'hits': {'total': {'value': 0}, 'hits': []}}
+        )
+
+    def test_repeated_search_is_served_from_cache(self, client, headers, execute_query):
+        """A repeated /_search should only query Elastic Search once"""
+        query = {'query': {'match_all': {}}, 'size': 10}
+        first = client.post('/_search', data=json.dumps(query), headers=headers)
+        second = client.post('/_search', data=json.dumps(query), headers=headers)
+        assert first.json == second.json
+        execute_query.assert_called_once()
+
+    def test_search_cache_ignores_key_order(self, client, headers, execute_query):
+        """A /_search with the same query in a different key order should be served from cache"""
+        client.post('/_search', data='{"size": 10, "from": 0}', headers=headers)
+        client.post('/_search', data='{"from":0,"size":10}', headers=headers)
+        execute_query.assert_called_once()
+
+    def test_index_write_invalidates_search_cache(self, client, headers, execute_query):
+        """A /_search after a write to the index should query Elastic Search again"""
+        query = {'query': {'match_all': {}}}
+        client.post('/_search', data=json.dumps(query), headers=headers)
+        index_changed()
+        client.post('/_search', data=json.dumps(query), headers=headers)
+        assert execute_query.call_count == 2
+
+    def test_unchanged_search_is_not_modified(self, client, headers, execute_query, mocker):
+        """A /_search with the ETag of its unchanged result should get a 304 without querying the database"""
+        catalog_version = mocker.patch('antibodyapi.utils.etag.catalog_version')
+        query = {'query': {'match_all': {}}, 'size': 1}
+        first = client.post('/_search', data=json.dumps(query), headers=headers)
+        assert 'Last-Modified' not in first.headers
+        second = client.post('/_search', data=json.dumps(query), headers=headers | {'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 304
+        execute_query.return_value = {'hits': {'total': {'value': 1}, 'hits': [{}]}}
+        index_changed()
+        third = client.post('/_search', data=json.dumps(query), headers=headers | {'If-None-Match': first.headers['ETag']})
+        assert third.status_code == 200
+        catalog_version.assert_not_called()
+
+    def test_generation_is_shared_through_uwsgi_cache(self, mocker):
+        """A write by one worker should change the index generation that the others read from the uWSGI cache"""
+        cache: dict = {}
+        uwsgi = mocker.patch('antibodyapi.utils.elasticsearch.uwsgi')
+        uwsgi.cache_get.side_effect = lambda key, cache_name: cache.get((cache_name, key))
+        uwsgi.cache_update.side_effect = lambda key, value, expires, cache_name: cache.update({(cache_name, key): value})
+        worker, other_worker = IndexGeneration('search_generation'), IndexGeneration('search_generation')
+        before = other_worker.get()
+        worker.change()
+        assert other_worker.get() != before
+        assert other_worker.get() == worker.get()
+
+class TestSearchBackends:
+    # pylint: disable=no-self-use, unused-argument
+    @pytest.fixture
+    def failover(self, flask_app):
+        # No random probes, so that each test knows which backend is tried first.
+        return make_search_backend(dict(flask_app.config, SEARCH_BACKEND='failover', SEARCH_FAILOVER_PROBE_RATE=0))
+
+    def test_failover_uses_other_backend_on_error(self, failover, mocker):
+        """The failover backend should answer from Elastic Search when the search-api fails"""
+        mocker.patch.object(SearchApiBackend, '_search', side_effect=SearchError('down'))
+        mocker.patch.object(ElasticsearchBackend, '_search', return_value={'hits': {}})
+        assert failover.search({'size': 0}) == {'hits': {}}
+        search_api, direct = failover.backends
+        assert search_api.stats.errors == 1
+        assert direct.stats.count == 1
+
+    def test_failover_prefers_faster_backend(self, failover, mocker):
+        """The failover backend should send queries to the backend with the lower average latency"""
+        mocker.patch('antibodyapi.utils.search.random.random', return_value=1.0)
+        search_api, direct = failover.backends
+        search_api.stats.record(200.0)
+        direct.stats.record(20.0)
+        search_api_search = mocker.patch.object(SearchApiBackend, '_search', return_value={})
+        mocker.patch.object(ElasticsearchBackend, '_search', return_value={})
+        failover.search({'size': 0})
+        search_api_search.assert_not_called()
+
+class TestSingleFlight:
+    # pylint: disable=no-self-use
+    def test_concurrent_identical_calls_are_coalesced(self):
+        """Identical calls made while one is running should share its result"""
+        single_flight = SingleFlight(timeout=5)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'hits': {}}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(single_flight.do, 'key', fn)
+            started.wait(5)
+            followers = [executor.submit(single_flight.do, 'key', fn) for _ in range(3)]
+            time.sleep(0.1)
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+        assert len(calls) == 1
+        assert all(r is results[0] for r in results)
+
+    def test_later_call_runs_again(self):
+        """A call made after an identical one has returned should run again"""
+        single_flight = SingleFlight(timeout=5)
+        fn = mock.Mock(return_value={})
+        single_flight.do('key', fn)
+        single_flight.do('key', fn)
+        assert fn.call_count == 2
@@ -1,12 +1,16 @@
 # pylint: disable=unused-import
-from get_antibodies import TestGetAntibodies
+from get_antibodies import TestGetAntibodies, TestStreamAntibodies
+from import_antibodies import TestFindOrCreateVendors, TestHubmapIds, TestImportJobs, TestInsertAntibodies
 from login import TestLogin
 from logout import TestLogout
 from post_csv_file import TestPostCSVFile
 from post_empty_json_body import TestPostEmptyJSONBody
 from post_incomplete_json_body import TestPostIncompleteJSONBody
 from post_complete_json_body import TestPostWithCompleteJSONBody
-from index_elasticsearch import TestElasticsearchIndexing
+from index_elasticsearch import TestElasticsearchIndexing, TestRestoreCatchUp, TestVersionedIndices
+from jobs import TestJobHeartbeat
+from search import TestSearchBackends, TestSearchCache, TestSingleFlight
+from validation import TestCellMarker, TestIdentifierChecks, TestPdfFiles, TestPreviousVersions, TestTokenBucket, TestValidationCache
 
 def test_post_with_no_body_should_return_400(client, headers):
     """POST /antibodies with no body should return 400 BAD REQUEST"""
@@ -0,0 +1,215 @@
+import io
+import threading
+import time
+from unittest import mock
+import pytest
+from pypdf import PdfWriter
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import HTTPException
+from antibodyapi.utils import validation
+from antibodyapi.utils.pdf_files import PdfFiles
+from antibodyapi.utils.ratelimit import TokenBucket
+from antibodyapi.utils.validation import (
+    CELL_TYPE, DOI, NOT_FOUND, ORCID, PROBLEM, RRID, VALID, IdentifierChecks, check_identifier,
+    find_previous_versions, row_identifiers, validate_cell_marker, validate_dois, validate_orcids,
+    validate_previous_version_id
+)
+from antibodyapi.utils.validation_cache import ValidationCache
+
+class TestIdentifierChecks:
+    # pylint: disable=no-self-use, unused-argument
+    @pytest.fixture
+    def checked(self, flask_app, mocker):
+        flask_app.extensions['validation_cache'] = ValidationCache(
+            dict(flask_app.config, VALIDATION_CACHE_PERSISTENT=False)
+        )
+        checked = []
+        def check(kind, value, ubkg_api_url=None):
+            checked.append((kind, value))
+            # The checks of earlier rows finish last.
+            time.sleep(0.05 if value.endswith('1') else 0)
+            return (NOT_FOUND, None) if value.startswith('missing') else (VALID, None)
+        mocker.patch('antibodyapi.utils.validation.check_identifier', side_effect=check)
+        return checked
+
+    def test_checks_are_submitted_concurrently(self, flask_app, checked):
+        """IdentifierChecks should check the submitted identifiers on more than one thread"""
+        with flask_app.app_context(), IdentifierChecks(flask_app, 'http://ubkg') as checks:
+            start = time.monotonic()
+            for row_i in range(2, 6):
+                checks.submit(ORCID, f'0000-000{row_i}-1')
+            validate_orcids(2, '0000-0002-1', checks)
+            assert time.monotonic() - start < 0.05 * 4
+        assert len(checked) == 4
+
+    def test_first_failing_row_is_reported(self, flask_app, checked):
+        """The error of the first failing row should be reported even when a later row fails first"""
+        with flask_app.app_context(), IdentifierChecks(flask_app, 'http://ubkg') as checks:
+            checks.submit(DOI, 'missing/1')
+            checks.submit(DOI, 'missing/2')
+            with pytest.raises(HTTPException) as error:
+                for row_i, doi in ((2, 'doi:missing/1'), (3, 'doi:missing/2')):
+                    validate_dois(row_i, doi, checks)
+        assert error.value.response.json['message'] ==\
+            "TSV file row number `2`: DOI 'doi:missing/1' is not found in catalogue"
+
+    def test_shared_identifiers_are_checked_once(self, flask_app, checked):
+        """An identifier shared by several rows, or repeated within one, should only be checked once"""
+        row = {
+            'uniprot_accession_number': 'P1', 'hgnc_id': 'HGNC:1', 'target_symbol': 'CD4', 'rrid': 'AB_1',
+            'protocol_doi': 'doi:10.1/a, https://doi.org/10.1/a', 'author_orcids': '0000-0001', 'organ_uberon_id': '',
+            'manuscript_doi': ''
+        }
+        with flask_app.app_context(), IdentifierChecks(flask_app, 'http://ubkg') as checks:
+            rows = [row, dict(row, rrid='AB_2'), dict(row)]
+            checks.plan(rows)
+            for identifier in (identifier for row in rows for identifier in row_identifiers(row)):
+                assert checks.result(*identifier) == (VALID, None)
+        assert sorted(checked) == sorted([
+            ('uniprot', 'P1'), ('hgnc', 'HGNC:1'), ('target', 'CD4'), ('rrid', 'AB_1'), ('rrid', 'AB_2'),
+            (DOI, '10.1/a'), (ORCID, '0000-0001')
+        ])
+
+class TestTokenBucket:
+    # pylint: disable=no-self-use
+    def test_token_bucket_limits_rate(self):
+        """A TokenBucket should allow a burst of its rate and then pace the requests that follow"""
+        bucket = TokenBucket(20)
+        start = time.monotonic()
+        threads = [threading.Thread(target=bucket.acquire) for _ in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert 0.4 <= time.monotonic() - start < 1.0
+
+class TestValidationCache:
+    # pylint: disable=no-self-use
+    @pytest.fixture
+    def check_rrid(self, flask_app, mocker):
+        flask_app.extensions['validation_cache'] = ValidationCache(
+            dict(flask_app.config, VALIDATION_CACHE_PERSISTENT=False)
+        )
+        return mocker.patch.dict(
+            'antibodyapi.utils.validation.IDENTIFIER_CHECKS', {RRID: mocker.Mock(return_value=(VALID, None))}
+        )[RRID]
+
+    def test_identifier_is_checked_once(self, flask_app, check_rrid):
+        """An identifier that was found should be served from the cache when it is checked again"""
+        with flask_app.app_context():
+            assert check_identifier(RRID, 'AB_1') == (VALID, None)
+            assert check_identifier(RRID, 'AB_1') == (VALID, None)
+        check_rrid.assert_called_once_with('AB_1')
+
+    def test_not_found_is_cached(self, flask_app, check_rrid):
+        """An identifier that was not found should also be served from the cache"""
+        check_rrid.return_value = (NOT_FOUND, None)
+        with flask_app.app_context():
+            check_identifier(RRID, 'AB_2')
+            assert check_identifier(RRID, 'AB_2') == (NOT_FOUND, None)
+        check_rrid.assert_called_once_with('AB_2')
+
+    def test_problem_is_not_cached(self, flask_app, check_rrid):
+        """An identifier whose service could not be reached should be checked again"""
+        check_rrid.return_value = (PROBLEM, None)
+        with flask_app.app_context():
+            check_identifier(RRID, 'AB_3')
+            check_identifier(RRID, 'AB_3')
+        assert check_rrid.call_count == 2
+
+    @pytest.mark.parametrize('status_code', [429, 503])
+    def test_error_response_is_a_problem(self, flask_app, mocker, status_code):
+        """An error response other than 404 should say nothing of the identifier, so it is not cached"""
+        response = mocker.MagicMock(status_code=status_code)
+        mocker.patch('antibodyapi.utils.validation._get').return_value.__enter__.return_value = response
+        with flask_app.app_context():
+            assert validation.check_rrid('AB_4') == (PROBLEM, None)
+            assert validation.check_doi('10.1/a') == (PROBLEM, None)
+            assert validation.check_hgnc('HGNC:1') == (PROBLEM, None)
+            assert validation.check_ontology('UBERON:0002113') == (PROBLEM, None)
+
+class TestPreviousVersions:
+    # pylint: disable=no-self-use
+    def test_previous_versions_are_found_together(self):
+        """find_previous_versions() should look up the previous versions of all of the rows with one query"""
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = [('HBM1', None, 'uuid1', 'pdf1', 'a.pdf'), ('HBM2', 'HBM3', 'uuid2', None, None)]
+        previous_versions = find_previous_versions(
+            [{'previous_version_id': 'HBM1'}, {'previous_version_id': ''}, {'previous_version_id': 'HBM2'}], cursor
+        )
+        cursor.execute.assert_called_once()
+        assert cursor.execute.call_args.args[1] == (['HBM1', 'HBM2'],)
+        assert previous_versions['HBM1'] == {
+            'next_version_id': None, 'antibody_uuid': 'uuid1', 'avr_pdf_uuid': 'pdf1', 'avr_pdf_filename': 'a.pdf'
+        }
+
+    def test_previous_version_is_not_queried_again(self, flask_app):
+        """validate_previous_version_id() should use the previous versions that were found"""
+        cursor = mock.Mock()
+        previous_versions = {'HBM2': {'next_version_id': 'HBM3'}}
+        with flask_app.app_context():
+            with pytest.raises(HTTPException) as error:
+                validate_previous_version_id(2, 'HBM2', cursor, previous_versions)
+            assert error.value.response.json['message'] ==\
+                "TSV file row number `2`: previous_version_id 'HBM2' already has a newer version specified " \
+                "(next_revision_hubmap_id='HBM3')"
+            with pytest.raises(HTTPException) as error:
+                validate_previous_version_id(3, 'HBM4', cursor, previous_versions)
+            assert error.value.response.json['message'] ==\
+                "TSV file row number `3`: previous_revision_hubmap_id 'HBM4' does not exist"
+        cursor.execute.assert_not_called()
+
+class TestCellMarker:
+    # pylint: disable=no-self-use
+    def test_cell_types_are_checked_once(self, flask_app, mocker):
+        """A cell_marker shared by several rows should be looked up in UBKG once, while validating"""
+        get_celltype = mocker.patch('antibodyapi.utils.validation.get_celltype', return_value=(200, {}))
+        with flask_app.app_context(), IdentifierChecks(flask_app, 'http://ubkg') as checks:
+            for cell_marker in ('CL:0000236', 'cl:0000236'):
+                checks.submit(CELL_TYPE, '0000236')
+                validate_cell_marker(2, cell_marker, 'http://ubkg', checks)
+        get_celltype.assert_called_once_with('http://ubkg', '0000236')
+
+    def test_invalid_cell_type(self, flask_app, mocker, monkeypatch):
+        """A cell_marker that UBKG does not know should fail with the cell types ontology to refer to"""
+        # Only set in app.conf.
+        monkeypatch.setitem(flask_app.config, 'UBKG_CELL_TYPES_ONTOLOGY_URL', 'https://ontology')
+        mocker.patch('antibodyapi.utils.validation.get_celltype', return_value=(404, None))
+        with flask_app.app_context(), pytest.raises(HTTPException) as error:
+            validate_cell_marker(3, 'CL:9999999', 'http://ubkg')
+        assert error.value.response.json['message'] ==\
+            "TSV file row number `3`: Problem processing `cell_marker` field with value `CL:9999999`. " \
+            "Invalid cell type.\nPlease refer to the cell types ontology for a list of valid cell types and " \
+            "associated codes. https://ontology"
+
+class TestPdfFiles:
+    # pylint: disable=no-self-use
+    @staticmethod
+    def pdf() -> bytes:
+        writer = PdfWriter()
+        writer.add_blank_page(width=72, height=72)
+        content = io.BytesIO()
+        writer.write(content)
+        return content.getvalue()
+
+    def test_pdf_files_are_found_by_name(self):
+        """PdfFiles should find the first .pdf file of a name, with its size and whether it is valid"""
+        pdf = self.pdf()
+        pdf_files = PdfFiles(MultiDict([
+            ('pdf', FileStorage(io.BytesIO(pdf), filename='a.pdf')),
+            ('pdf', FileStorage(io.BytesIO(b'not a pdf'), filename='b.pdf')),
+            ('pdf', FileStorage(io.BytesIO(b'not a pdf'), filename='a.pdf')),
+        ]))
+        assert pdf_files.get('a.pdf').size == len(pdf)
+        assert pdf_files.get('a.pdf').is_valid()
+        assert not pdf_files.get('b.pdf').is_valid()
+        assert pdf_files.get('c.pdf') is None
+        # Whatever has read it, the file is given from its start.
+        assert pdf_files.get('a.pdf').file.read() == pdf
+
+    def test_validity_is_found_once(self, mocker):
+        """A .pdf file named by several rows should only be parsed once"""
+        pdf_reader = mocker.patch('antibodyapi.utils.pdf_files.PdfReader')
+        pdf_file = PdfFiles(MultiDict([('pdf', FileStorage(io.BytesIO(b'%PDF'), filename='a.pdf'))])).get('a.pdf')
+        assert pdf_file.is_valid() and pdf_file.is_valid()
+        pdf_reader.assert_called_once()